@@ -9,8 +9,12 @@ if exists(".env"):
 
 login_regex = compile(r'^[a-zA-Z0-9_]{1,64}$')
 
-MONGODB = environ.get("MONGODB") or input("MongoDB connect string: ")
-db = MongoClient(MONGODB).ftp["users"]
+if environ.get("METADATA_BACKEND", "mongo").lower() == "sqlite":
+    from ftp.sqlitestore import SQLiteStore
+    db = SQLiteStore(environ.get("SQLITE_PATH", "data/nebula.db"))["users"]
+else:
+    MONGODB = environ.get("MONGODB") or input("MongoDB connect string: ")
+    db = MongoClient(MONGODB).ftp["users"]
 
 class Permission:
     def __init__(self, path, readable=False, writable=False):
@@ -0,0 +1 @@
+"""Benchmark de ponta a ponta do NebulaFTP (python -m bench.run --help)."""
@@ -0,0 +1,333 @@
+"""
+Mongo em memória com a parte da API assíncrona do motor usada pelo NebulaFTP.
+
+Serve ao benchmark (e a experimentos locais) sem mongod. Filtros, atualizações,
+projeções e aggregate são avaliados por ftp.query; aqui ficam a coleção
+(upserts, find_one_and_*, bulk_write, insert_many não ordenado) e os índices.
+
+Os índices criados com create_index viram mapas em memória (valor -> _ids):
+consultas por igualdade em todos os campos de um índice não varrem a coleção,
+e índices unique levantam DuplicateKeyError como o Mongo. `latency` simula o
+tempo de ida e volta de cada operação.
+"""
+from asyncio import sleep as asleep
+from collections import defaultdict
+import re
+
+from bson import ObjectId
+from pymongo import ReturnDocument, InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+
+from ftp.query import MISSING, clone, hashable, get_field, is_ops, match, project, sort_spec, sort_key, apply_update, upsert_doc, aggregate
+
+__all__ = ("FakeClient", "FakeDatabase", "FakeCollection")
+
+
+class _Index:
+    def __init__(self, fields, unique=False, sparse=False):
+        self.fields = fields; self.unique = unique; self.sparse = sparse
+        self.entries = defaultdict(set)
+
+    def key(self, doc):
+        values = tuple(get_field(doc, f) for f in self.fields)
+        if self.sparse and all(v is MISSING for v in values): return MISSING
+        return tuple(hashable(None if v is MISSING else v) for v in values)
+
+
+class FakeCursor:
+    def __init__(self, source, projection=None, latency=0.0):
+        self._source = source  # callable -> documentos internos (clonados/projetados ao materializar)
+        self._projection = projection; self._latency = latency
+        self._sort = None; self._skip = 0; self._limit = 0
+        self._docs = None
+
+    def sort(self, key, direction=None):
+        self._sort = sort_spec(key, direction); return self
+
+    def skip(self, n): self._skip = n; return self
+    def limit(self, n): self._limit = n; return self
+    def batch_size(self, n): return self
+
+    def _materialize(self):
+        if self._docs is None:
+            docs = self._source()
+            if self._sort: docs = sorted(docs, key=sort_key(self._sort))
+            if self._skip: docs = docs[self._skip:]
+            if self._limit: docs = docs[:self._limit]
+            self._docs = [project(d, self._projection) for d in docs]
+            self._pos = 0
+        return self._docs
+
+    async def to_list(self, length=None):
+        if self._docs is None: await asleep(self._latency)
+        docs = self._materialize()
+        out = docs[self._pos:] if not length else docs[self._pos:self._pos + length]
+        self._pos += len(out)
+        return out
+
+    def __aiter__(self): return self
+
+    async def __anext__(self):
+        if self._docs is None: await asleep(self._latency)
+        docs = self._materialize()
+        if self._pos >= len(docs): raise StopAsyncIteration
+        self._pos += 1
+        return docs[self._pos - 1]
+
+
+class FakeCollection:
+    def __init__(self, database, name):
+        self.database = database; self.name = name
+        self._docs = {}  # _id -> documento
+        self._indexes = {}
+
+    async def _tick(self):
+        await asleep(self.database.latency)
+
+    # --- índices -----------------------------------------------------------
+
+    async def create_index(self, keys, unique=False, sparse=False, **kwargs):
+        fields = tuple(k for k, _ in sort_spec(keys))
+        name = kwargs.get("name") or "_".join(f"{f}_1" for f in fields)
+        if name not in self._indexes:
+            index = self._indexes[name] = _Index(fields, unique, sparse)
+            for _id, doc in self._docs.items():
+                key = index.key(doc)
+                if key is MISSING: continue
+                if unique and index.entries[key]: raise DuplicateKeyError(f"E11000 duplicate key: {name}", 11000)
+                index.entries[key].add(_id)
+        return name
+
+    async def drop(self):
+        self._docs.clear()
+        for index in self._indexes.values(): index.entries.clear()
+
+    def _check_unique(self, doc, ignore=None):
+        for name, index in self._indexes.items():
+            if not index.unique: continue
+            key = index.key(doc)
+            if key is MISSING: continue
+            if index.entries.get(key, set()) - {ignore}:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name} dup key: {key}", 11000)
+
+    def _index_add(self, doc):
+        for index in self._indexes.values():
+            key = index.key(doc)
+            if key is not MISSING: index.entries[key].add(doc["_id"])
+
+    def _index_remove(self, doc):
+        for index in self._indexes.values():
+            key = index.key(doc)
+            if key is MISSING: continue
+            ids = index.entries.get(key)
+            if ids:
+                ids.discard(doc["_id"])
+                if not ids: del index.entries[key]
+
+    def _scan(self, filter):
+        """Documentos (internos, sem cópia) que casam com o filtro; usa índice quando possível."""
+        filter = filter or {}
+        ids = None
+        if "_id" in filter and not is_ops(filter["_id"]):
+            ids = {filter["_id"]} if filter["_id"] in self._docs else set()
+        else:
+            for index in self._indexes.values():
+                conds = [filter.get(f, MISSING) for f in index.fields]
+                if any(c is MISSING or is_ops(c) or isinstance(c, (re.Pattern, dict, list)) for c in conds): continue
+                found = index.entries.get(tuple(hashable(c) for c in conds), set())
+                if ids is None or len(found) < len(ids): ids = found
+        if ids is None: source = list(self._docs.values())
+        else: source = [self._docs[i] for i in ids if i in self._docs]
+        return [d for d in source if match(d, filter)]
+
+    def _first(self, filter, sort=None):
+        docs = self._scan(filter)
+        if sort and docs: docs = sorted(docs, key=sort_key(sort_spec(sort)))
+        return docs[0] if docs else None
+
+    # --- escrita (síncrona, sem ponto de suspensão: atômica no event loop) --
+
+    def _insert(self, doc):
+        doc = clone(doc)
+        if "_id" not in doc: doc["_id"] = ObjectId()
+        if doc["_id"] in self._docs: raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_", 11000)
+        self._check_unique(doc)
+        self._docs[doc["_id"]] = doc; self._index_add(doc)
+        return doc
+
+    def _update_doc(self, doc, update):
+        new = clone(doc); apply_update(new, update)
+        if new == doc: return False
+        self._check_unique(new, ignore=doc["_id"])
+        self._index_remove(doc); self._docs[doc["_id"]] = new; self._index_add(new)
+        return True
+
+    def _upsert(self, filter, update):
+        doc = upsert_doc(filter, update)
+        if "_id" not in doc and "_id" in filter and not is_ops(filter["_id"]): doc["_id"] = filter["_id"]
+        return self._insert(doc)
+
+    def _update(self, filter, update, upsert=False, many=False):
+        docs = self._scan(filter)
+        if not many: docs = docs[:1]
+        if not docs:
+            if not upsert: return {"n": 0, "nModified": 0, "updatedExisting": False}
+            doc = self._upsert(filter, update)
+            return {"n": 1, "nModified": 0, "upserted": doc["_id"], "updatedExisting": False}
+        modified = sum(self._update_doc(d, update) for d in docs)
+        return {"n": len(docs), "nModified": modified, "updatedExisting": True}
+
+    def _delete(self, filter, many=False):
+        docs = self._scan(filter)
+        if not many: docs = docs[:1]
+        for d in docs:
+            self._index_remove(d); del self._docs[d["_id"]]
+        return len(docs)
+
+    # --- API do motor ---------------------------------------------------------
+
+    def find(self, filter=None, projection=None, sort=None, limit=0, skip=0, **kwargs):
+        cursor = FakeCursor(lambda: self._scan(filter), projection, self.database.latency)
+        if sort: cursor.sort(sort)
+        if skip: cursor.skip(skip)
+        if limit: cursor.limit(limit)
+        return cursor
+
+    async def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        await self._tick()
+        if filter is not None and not isinstance(filter, dict): filter = {"_id": filter}
+        doc = self._first(filter, sort)
+        return None if doc is None else project(doc, projection)
+
+    async def count_documents(self, filter, **kwargs):
+        await self._tick()
+        return len(self._scan(filter))
+
+    async def estimated_document_count(self, **kwargs):
+        await self._tick()
+        return len(self._docs)
+
+    async def distinct(self, key, filter=None, **kwargs):
+        await self._tick()
+        out = []
+        for d in self._scan(filter):
+            value = get_field(d, key)
+            for v in value if isinstance(value, list) else [value]:
+                if v is not MISSING and v not in out: out.append(v)
+        return out
+
+    async def insert_one(self, document, **kwargs):
+        await self._tick()
+        doc = self._insert(document)
+        document.setdefault("_id", doc["_id"])
+        return InsertOneResult(doc["_id"], True)
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        await self._tick()
+        ids = []; errors = []
+        for i, document in enumerate(documents):
+            try:
+                doc = self._insert(document); document.setdefault("_id", doc["_id"]); ids.append(doc["_id"])
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e), "op": document})
+                if ordered: break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [], "nInserted": len(ids), "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []})
+        return InsertManyResult(ids, True)
+
+    async def update_one(self, filter, update, upsert=False, **kwargs):
+        await self._tick()
+        return UpdateResult(self._update(filter, update, upsert), True)
+
+    async def update_many(self, filter, update, upsert=False, **kwargs):
+        await self._tick()
+        return UpdateResult(self._update(filter, update, upsert, many=True), True)
+
+    async def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        await self._tick()
+        return UpdateResult(self._update(filter, replacement, upsert), True)
+
+    async def delete_one(self, filter, **kwargs):
+        await self._tick()
+        return DeleteResult({"n": self._delete(filter)}, True)
+
+    async def delete_many(self, filter, **kwargs):
+        await self._tick()
+        return DeleteResult({"n": self._delete(filter, many=True)}, True)
+
+    async def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False, return_document=ReturnDocument.BEFORE, **kwargs):
+        await self._tick()
+        doc = self._first(filter, sort)
+        if doc is None:
+            if not upsert: return None
+            doc = self._upsert(filter, update)
+            return project(doc, projection) if return_document == ReturnDocument.AFTER else None
+        before = project(doc, projection)
+        self._update_doc(doc, update)
+        return project(self._docs[doc["_id"]], projection) if return_document == ReturnDocument.AFTER else before
+
+    async def find_one_and_replace(self, filter, replacement, projection=None, sort=None, upsert=False, return_document=ReturnDocument.BEFORE, **kwargs):
+        return await self.find_one_and_update(filter, replacement, projection, sort, upsert, return_document)
+
+    async def find_one_and_delete(self, filter, projection=None, sort=None, **kwargs):
+        await self._tick()
+        doc = self._first(filter, sort)
+        if doc is None: return None
+        self._index_remove(doc); del self._docs[doc["_id"]]
+        return project(doc, projection)
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        await self._tick()
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        for i, op in enumerate(requests):
+            try:
+                if isinstance(op, InsertOne): self._insert(op._doc); result["nInserted"] += 1
+                elif isinstance(op, (UpdateOne, UpdateMany, ReplaceOne)):
+                    raw = self._update(op._filter, op._doc, op._upsert, many=isinstance(op, UpdateMany))
+                    if "upserted" in raw: result["nUpserted"] += 1; result["upserted"].append({"index": i, "_id": raw["upserted"]})
+                    else: result["nMatched"] += raw["n"]; result["nModified"] += raw["nModified"]
+                elif isinstance(op, (DeleteOne, DeleteMany)): result["nRemoved"] += self._delete(op._filter, many=isinstance(op, DeleteMany))
+                else: raise OperationFailure(f"operação não suportada: {op!r}")
+            except DuplicateKeyError as e:
+                result["writeErrors"].append({"index": i, "code": 11000, "errmsg": str(e), "op": op})
+                if ordered: break
+        if result["writeErrors"]: raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def aggregate(self, pipeline, **kwargs):
+        return FakeCursor(lambda: aggregate(list(self._docs.values()), pipeline), latency=self.database.latency)
+
+
+class FakeDatabase:
+    def __init__(self, name="ftp", latency=0.0):
+        self.name = name; self.latency = latency
+        self._collections = {}
+
+    def __getitem__(self, name):
+        coll = self._collections.get(name)
+        if coll is None: coll = self._collections[name] = FakeCollection(self, name)
+        return coll
+
+    def __getattr__(self, name):
+        if name.startswith("_"): raise AttributeError(name)
+        return self[name]
+
+    async def list_collection_names(self):
+        return list(self._collections)
+
+
+class FakeClient:
+    """Equivalente a AsyncIOMotorClient: client.<banco> devolve um FakeDatabase."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency; self._databases = {}
+
+    def __getitem__(self, name):
+        db = self._databases.get(name)
+        if db is None: db = self._databases[name] = FakeDatabase(name, self.latency)
+        return db
+
+    def __getattr__(self, name):
+        if name.startswith("_"): raise AttributeError(name)
+        return self[name]
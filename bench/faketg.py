@@ -0,0 +1,146 @@
+"""
+Telegram simulado para o benchmark: clientes com a interface do pyrogram.Client
+usada pelo NebulaFTP (start/stop, get_chat, send_document, get_messages e
+GetFile pela sessão de mídia), guardando os documentos em memória.
+
+Simula latência por requisição, banda por bot (upload e download, fila FIFO)
+e FloodWait, tanto aleatório (`flood_rate`) quanto por excesso de
+requisições por segundo de um bot (`flood_limit`), como o Telegram faz.
+
+Os file_ids são FileId reais e específicos de cada bot (access_hash = bot):
+um file_id de outro bot é recusado com FILE_REFERENCE_INVALID, o que exercita
+o file_id_for do BotPool e o refresh do downloader.
+"""
+from asyncio import sleep as asleep
+from collections import deque
+from random import Random
+from time import monotonic
+from types import SimpleNamespace
+import io
+import os
+
+from pyrogram.errors import FloodWait, FileReferenceInvalid
+from pyrogram.file_id import FileId, FileType
+from pyrogram.raw.functions.upload import GetFile
+
+__all__ = ("FakeTelegram", "FakeBot")
+
+DC_ID = 2
+
+
+class Link:
+    """Banda de uma conexão: transferências saem em fila, uma após a outra."""
+
+    def __init__(self, bandwidth=0):
+        self.bandwidth = bandwidth; self.free_at = 0.0
+
+    async def transfer(self, size):
+        if not self.bandwidth: return
+        now = monotonic()
+        start = max(now, self.free_at)
+        self.free_at = start + size / self.bandwidth
+        await asleep(self.free_at - now)
+
+
+class FakeTelegram:
+    """O "servidor": documentos do canal, compartilhados por todos os bots."""
+
+    def __init__(self, latency=0.05, upload_bandwidth=0, download_bandwidth=0, flood_rate=0.0, flood_limit=0, flood_seconds=3, seed=None):
+        self.latency = latency
+        self.upload_bandwidth = upload_bandwidth; self.download_bandwidth = download_bandwidth
+        self.flood_rate = flood_rate; self.flood_limit = flood_limit; self.flood_seconds = flood_seconds
+        self.rng = Random(seed)
+        self.documents = {}  # media_id -> bytes
+        self.messages = {}  # message_id -> media_id
+        self.next_id = 1
+        self.stats = {"requests": 0, "uploads": 0, "downloads": 0, "bytes_up": 0, "bytes_down": 0, "flood_waits": 0}
+
+    def bots(self, count):
+        return [FakeBot(self, i) for i in range(count)]
+
+    async def request(self, bot, link, size):
+        """Uma chamada à API: FloodWait, latência e o tempo de transferência na banda do bot."""
+        self.stats["requests"] += 1
+        now = monotonic()
+        if self.flood_limit:
+            window = bot.recent
+            while window and now - window[0] > 1: window.popleft()
+            if len(window) >= self.flood_limit: self._flood()
+            window.append(now)
+        if self.flood_rate and self.rng.random() < self.flood_rate: self._flood()
+        if self.latency: await asleep(self.latency)
+        await link.transfer(size)
+
+    def _flood(self):
+        self.stats["flood_waits"] += 1
+        raise FloodWait(value=self.flood_seconds)
+
+    def store(self, data):
+        media_id = message_id = self.next_id; self.next_id += 1
+        self.documents[media_id] = data; self.messages[message_id] = media_id
+        self.stats["uploads"] += 1; self.stats["bytes_up"] += len(data)
+        return message_id, media_id
+
+
+class FakeSession:
+    """Sessão de mídia: responde GetFile com fatias do documento."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def invoke(self, query, retries=None, sleep_threshold=None, **kwargs):
+        if not isinstance(query, GetFile): raise NotImplementedError(type(query).__name__)
+        tg = self.bot.telegram
+        loc = query.location
+        if loc.access_hash != self.bot.index: raise FileReferenceInvalid()
+        data = tg.documents[loc.id][query.offset:query.offset + query.limit]
+        await tg.request(self.bot, self.bot.down, len(data))
+        tg.stats["downloads"] += 1; tg.stats["bytes_down"] += len(data)
+        return SimpleNamespace(bytes=data)
+
+
+class FakeBot:
+    """Substituto do pyrogram.Client (um por token)."""
+
+    def __init__(self, telegram, index):
+        self.telegram = telegram; self.index = index
+        self.name = f"FakeBot{index + 1}"
+        self.me = None
+        self.up = Link(telegram.upload_bandwidth); self.down = Link(telegram.download_bandwidth)
+        self.recent = deque()
+        self.media_sessions = {DC_ID: FakeSession(self)}
+
+    def _file_id(self, media_id):
+        return FileId(file_type=FileType.DOCUMENT, dc_id=DC_ID, media_id=media_id, access_hash=self.index, file_reference=b"").encode()
+
+    def _message(self, chat_id, message_id):
+        media_id = self.telegram.messages.get(message_id)
+        if media_id is None: return None
+        data = self.telegram.documents[media_id]
+        return SimpleNamespace(id=message_id, chat=SimpleNamespace(id=chat_id), document=SimpleNamespace(file_id=self._file_id(media_id), file_size=len(data)))
+
+    async def start(self):
+        self.me = SimpleNamespace(id=1000 + self.index, username=self.name.lower())
+
+    async def stop(self): pass
+
+    async def get_me(self): return self.me
+
+    async def get_chat(self, chat_id):
+        return SimpleNamespace(id=chat_id, title="bench")
+
+    async def send_message(self, chat_id, text, **kwargs): pass
+
+    async def send_document(self, chat_id, document, file_name=None, **kwargs):
+        if isinstance(document, (bytes, bytearray)): data = bytes(document)
+        elif isinstance(document, (str, os.PathLike)):
+            with open(document, "rb") as f: data = f.read()
+        else: data = document.read() if not isinstance(document, io.TextIOBase) else document.read().encode()
+        await self.telegram.request(self, self.up, len(data))
+        message_id, _ = self.telegram.store(data)
+        return self._message(chat_id, message_id)
+
+    async def get_messages(self, chat_id, message_ids):
+        await self.telegram.request(self, self.down, 0)
+        if isinstance(message_ids, (list, tuple)): return [self._message(chat_id, m) for m in message_ids]
+        return self._message(chat_id, message_ids)
@@ -0,0 +1,101 @@
+"""Cliente FTP assíncrono mínimo (modo passivo) usado pelos workloads do benchmark."""
+from asyncio import open_connection
+import re
+
+__all__ = ("FTPClient", "FTPError")
+
+
+class FTPError(Exception):
+    def __init__(self, code, text):
+        super().__init__(f"{code} {text}"); self.code = code; self.text = text
+
+
+class FTPClient:
+    def __init__(self, host, port):
+        self.host = host; self.port = port
+        self.reader = self.writer = None
+
+    async def connect(self, user, password):
+        self.reader, self.writer = await open_connection(self.host, self.port)
+        await self.response("220")
+        code, _ = await self.command(f"USER {user}", "331", "230")
+        if code == "331": await self.command(f"PASS {password}", "230")
+        await self.command("TYPE I", "200")
+
+    async def close(self):
+        if self.writer is None: return
+        try: await self.command("QUIT", "221")
+        except Exception: pass
+        self.writer.close()
+        try: await self.writer.wait_closed()
+        except Exception: pass
+        self.writer = None
+
+    async def response(self, *expected):
+        line = (await self.reader.readline()).decode("utf-8", "replace").rstrip("\r\n")
+        if not line: raise ConnectionResetError("controle fechado pelo servidor")
+        code, sep, text = line[:3], line[3:4], line[4:]
+        lines = [text]
+        if sep == "-":
+            # Resposta multilinha: até "<código> "
+            while True:
+                line = (await self.reader.readline()).decode("utf-8", "replace").rstrip("\r\n")
+                if not line: raise ConnectionResetError("controle fechado pelo servidor")
+                lines.append(line[4:] if line[:4] == code + " " else line.strip())
+                if line[:4] == code + " ": break
+        if expected and code not in expected: raise FTPError(code, "\n".join(lines))
+        return code, "\n".join(lines)
+
+    async def command(self, line, *expected):
+        self.writer.write(line.encode("utf-8") + b"\r\n")
+        await self.writer.drain()
+        return await self.response(*expected)
+
+    async def _data(self):
+        _, text = await self.command("EPSV", "229")
+        port = int(re.search(r"\|\|\|(\d+)\|", text).group(1))
+        return await open_connection(self.host, port)
+
+    async def transfer_in(self, command, offset=0):
+        """Comando com resposta na conexão de dados (LIST, MLSD, RETR): devolve os bytes."""
+        reader, writer = await self._data()
+        try:
+            # REST logo antes do RETR (o servidor zera o offset em qualquer outro comando)
+            if offset: await self.command(f"REST {offset}", "350")
+            await self.command(command, "150", "125")
+            chunks = []
+            while chunk := await reader.read(1024 * 1024): chunks.append(chunk)
+        finally: writer.close()
+        await self.response("226", "250")
+        return b"".join(chunks)
+
+    async def transfer_out(self, command, data, block=1024 * 1024):
+        """STOR/APPE: envia `data` pela conexão de dados."""
+        reader, writer = await self._data()
+        try:
+            await self.command(command, "150", "125")
+            view = memoryview(data)
+            for pos in range(0, len(view), block):
+                writer.write(view[pos:pos + block]); await writer.drain()
+            writer.write_eof() if writer.can_write_eof() else None
+        finally: writer.close()
+        await self.response("226", "250")
+
+    async def list(self, path=""): return await self.transfer_in(f"LIST {path}".rstrip())
+    async def mlsd(self, path=""): return await self.transfer_in(f"MLSD {path}".rstrip())
+    async def stor(self, path, data): await self.transfer_out(f"STOR {path}", data)
+
+    async def retr(self, path, offset=0): return await self.transfer_in(f"RETR {path}", offset)
+
+    async def rename(self, source, destination):
+        await self.command(f"RNFR {source}", "350")
+        await self.command(f"RNTO {destination}", "250")
+
+    async def mkd(self, path):
+        try: await self.command(f"MKD {path}", "257")
+        except FTPError as e:
+            if e.code != "550": raise
+
+    async def cwd(self, path): await self.command(f"CWD {path}", "250")
+    async def dele(self, path): await self.command(f"DELE {path}", "250")
+    async def size(self, path): return int((await self.command(f"SIZE {path}", "213"))[1])
@@ -0,0 +1,394 @@
+"""
+Benchmark de ponta a ponta do NebulaFTP, sem Telegram nem Atlas.
+
+Sobe o Server com MongoDBPathIO, os upload workers e o BotPool como no
+main.py, mas contra um Mongo em memória (ou um mongod local via --mongo) e bots
+simulados (latência, banda e FloodWait configuráveis). Em seguida:
+
+1. seed: envia --seed-files arquivos por STOR e mede o pipeline até todos
+   estarem no "Telegram"; cria uma pasta com --listing-entries entradas;
+2. run: --clients clientes FTP concorrentes executam a mistura --mix
+   (LIST, MLSD, STOR, RETR, REST+RETR, RNFR/RNTO) por --duration segundos.
+
+O relatório sai em JSON (stdout ou --output) com vazão e p50/p90/p99 por
+operação; --compare A.json B.json mostra a diferença entre duas execuções.
+
+    python -m bench.run --clients 16 --duration 30 --output atual.json
+    python -m bench.run --compare base.json atual.json --fail-on-regression 15
+
+As demais configurações (CHUNK_SIZE_MB, GOVERNOR, READAHEAD_*, TRACE_*, ...)
+vêm do ambiente, como em produção.
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path: sys.path.insert(0, str(ROOT))
+
+from bench.ftpclient import FTPClient, FTPError
+
+MB = 1024 * 1024
+CHAT_ID = -1001234567890
+WORKLOADS = ("list", "mlsd", "stor", "retr", "rest", "rename")
+DEFAULT_MIX = "list=2,mlsd=2,stor=2,retr=3,rest=1,rename=1"
+SCHEMA = 1
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m bench.run", description="Benchmark de ponta a ponta do NebulaFTP")
+    p.add_argument("--clients", type=int, default=8, help="clientes FTP concorrentes")
+    p.add_argument("--users", type=int, default=4, help="usuários FTP distintos (fair share da fila)")
+    p.add_argument("--duration", type=float, default=20, help="segundos da fase run")
+    p.add_argument("--mix", default=DEFAULT_MIX, help=f"pesos por operação ({', '.join(WORKLOADS)})")
+    p.add_argument("--file-mb", type=float, default=4, help="tamanho dos arquivos do seed e do STOR")
+    p.add_argument("--seed-files", type=int, default=8, help="arquivos enviados na fase seed (lidos pelo RETR)")
+    p.add_argument("--listing-entries", type=int, default=2000, help="entradas da pasta usada por LIST/MLSD")
+    p.add_argument("--chunk-mb", type=int, help="CHUNK_SIZE_MB (tamanho das partes enviadas)")
+    p.add_argument("--workers", type=int, help="MAX_WORKERS (upload workers)")
+    p.add_argument("--bots", type=int, default=2, help="bots no BotPool")
+    p.add_argument("--mongo", default="fake", help="'fake' (em memória), 'sqlite[:arquivo]' (backend SQLite) ou URI de um mongod local")
+    p.add_argument("--db", default="nebula_bench", help="banco usado com --mongo URI (apagado no início)")
+    p.add_argument("--mongo-latency-ms", type=float, default=0.5, help="RTT simulado do Mongo em memória")
+    p.add_argument("--tg-latency-ms", type=float, default=80, help="latência de cada requisição ao Telegram")
+    p.add_argument("--tg-up-mbps", type=float, default=20, help="banda de upload por bot em MB/s (0 = sem limite)")
+    p.add_argument("--tg-down-mbps", type=float, default=40, help="banda de download por bot em MB/s (0 = sem limite)")
+    p.add_argument("--flood-rate", type=float, default=0.0, help="probabilidade de FloodWait por requisição")
+    p.add_argument("--flood-limit", type=float, default=0, help="requisições/s por bot acima das quais vem FloodWait (0 = sem)")
+    p.add_argument("--flood-seconds", type=int, default=2, help="duração dos FloodWaits simulados")
+    p.add_argument("--drain-timeout", type=float, default=600, help="limite (s) para o pipeline do seed terminar")
+    p.add_argument("--no-verify", action="store_true", help="não confere o conteúdo lido pelo RETR")
+    p.add_argument("--seed", type=int, default=1, help="semente dos geradores aleatórios")
+    p.add_argument("--workdir", help="pasta de trabalho (staging, cache, log); padrão: temporária")
+    p.add_argument("--keep", action="store_true", help="mantém a pasta de trabalho")
+    p.add_argument("--log-level", default="WARNING")
+    p.add_argument("--output", "-o", help="grava o relatório JSON neste arquivo (padrão: stdout)")
+    p.add_argument("--compare", nargs=2, metavar=("BASE", "ATUAL"), help="compara dois relatórios e sai")
+    p.add_argument("--fail-on-regression", type=float, metavar="PCT", help="com --compare: sai com 1 se p99 ou vazão piorar mais que PCT%%")
+    return p.parse_args(argv)
+
+
+def parse_mix(raw):
+    mix = {}
+    for item in raw.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip().lower()
+        if name not in WORKLOADS: raise SystemExit(f"operação desconhecida em --mix: {name}")
+        mix[name] = float(weight or 1)
+    return {k: v for k, v in mix.items() if v > 0}
+
+
+def percentile(values, q):
+    """Percentil por posto mais próximo sobre uma lista já ordenada."""
+    if not values: return None
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}; self.bytes = {}; self.errors = {}; self.samples = {}
+
+    def ok(self, op, seconds, size=0):
+        self.latencies.setdefault(op, []).append(seconds)
+        self.bytes[op] = self.bytes.get(op, 0) + size
+
+    def fail(self, op, error):
+        self.errors[op] = self.errors.get(op, 0) + 1
+        samples = self.samples.setdefault(op, [])
+        if len(samples) < 5: samples.append(f"{type(error).__name__}: {error}")
+
+    def summary(self, seconds):
+        out = {}
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            lat = sorted(self.latencies.get(op, ()))
+            ms = lambda v: None if v is None else round(v * 1000, 3)
+            out[op] = {
+                "count": len(lat), "errors": self.errors.get(op, 0),
+                "ops_per_s": round(len(lat) / seconds, 3) if seconds else None,
+                "mb_per_s": round(self.bytes.get(op, 0) / MB / seconds, 3) if seconds else None,
+                "p50_ms": ms(percentile(lat, 50)), "p90_ms": ms(percentile(lat, 90)), "p99_ms": ms(percentile(lat, 99)),
+                "max_ms": ms(lat[-1] if lat else None), "mean_ms": ms(sum(lat) / len(lat) if lat else None),
+            }
+            if op in self.samples: out[op]["error_samples"] = self.samples[op]
+        return out
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.file_size = int(args.file_mb * MB)
+        self.seed_content = {}  # caminho -> bytes
+        self.report = {}
+        self.sqlite = None
+
+    # --- ambiente --------------------------------------------------------------
+
+    async def start(self):
+        args = self.args
+        # Configuração lida pelos módulos na importação: definida antes do import
+        if args.chunk_mb: os.environ["CHUNK_SIZE_MB"] = str(args.chunk_mb)
+        if args.workers: os.environ["MAX_WORKERS"] = str(args.workers)
+        import main as app
+        from ftp import Server, MongoDBUserManager, MongoDBPathIO
+        from ftp.botpool import BotPool
+        from ftp.common import UPLOAD_QUEUE
+        from ftp.tracing import TRACER, TracedDatabase
+        from ftp.sqlitestore import SQLiteDatabase
+        from bench.faketg import FakeTelegram
+        self.app = app; self.queue = UPLOAD_QUEUE
+        app.logger.setLevel(args.log_level.upper())
+
+        if args.mongo == "fake":
+            from bench.fakemongo import FakeClient
+            self.mongo = FakeClient(latency=args.mongo_latency_ms / 1000).ftp
+        elif args.mongo.split(":")[0] == "sqlite":
+            self.mongo = self.sqlite = SQLiteDatabase(args.mongo[7:] or "bench.db")
+            for name in ("files", "upload_jobs", "blobs", "users", "migrations"): await self.mongo[name].drop()
+        else:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            self.mongo = AsyncIOMotorClient(args.mongo, w="majority")[args.db]
+            for name in ("files", "upload_jobs", "blobs", "users", "migrations"): await self.mongo[name].drop()
+
+        self.telegram = FakeTelegram(
+            latency=args.tg_latency_ms / 1000, upload_bandwidth=args.tg_up_mbps * MB, download_bandwidth=args.tg_down_mbps * MB,
+            flood_rate=args.flood_rate, flood_limit=args.flood_limit, flood_seconds=args.flood_seconds, seed=args.seed,
+        )
+        self.pool = pool = BotPool(self.telegram.bots(args.bots))
+        await pool.start(); await pool.check_chat(CHAT_ID)
+        app.Metrics.pool = pool
+
+        await app.setup_database_indexes(self.mongo)
+        await app.migrate_paths(self.mongo)
+        await UPLOAD_QUEUE.bind(self.mongo)
+        await MongoDBPathIO.staging.load()
+        ftp_db = TracedDatabase(self.mongo) if TRACER.enabled else self.mongo
+        MongoDBPathIO.db = ftp_db; MongoDBPathIO.tg = pool.primary; MongoDBPathIO.bots = pool; MongoDBPathIO.chat_id = CHAT_ID
+        if app.STREAM_UPLOAD:
+            app.StreamingUpload.pool = pool; app.StreamingUpload.target_chat_id = CHAT_ID; app.StreamingUpload.mongo = self.mongo
+            MongoDBPathIO.stream_uploader = app.StreamingUpload
+
+        for u in range(args.users):
+            await self.mongo.users.insert_one({"login": f"bench{u}", "password": "bench", "permissions": [{"path": "/", "readable": True, "writable": True}]})
+
+        self.server = Server(MongoDBUserManager(ftp_db), MongoDBPathIO)
+        await self.server.start("127.0.0.1", 0)
+        self.port = self.server.server.sockets[0].getsockname()[1]
+        self.workers = [asyncio.create_task(app.upload_worker(pool, CHAT_ID, self.mongo, i + 1)) for i in range(app.MAX_WORKERS)]
+        self.report["config"] = dict(
+            {k: v for k, v in vars(args).items() if k not in ("compare", "fail_on_regression", "output", "workdir", "keep", "log_level")},
+            chunk_mb=app.CHUNK_SIZE_MB, workers=app.MAX_WORKERS, stream_upload=app.STREAM_UPLOAD,
+            parts_per_file=app.PARTS_PER_FILE, max_inflight_parts=app.MAX_INFLIGHT_PARTS, tracing=TRACER.enabled,
+        )
+
+    async def stop(self):
+        for t in self.workers: t.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        await self.server.close()
+        await self.pool.stop()
+        if self.sqlite: await self.sqlite.close()
+
+    async def client(self, user=0):
+        c = FTPClient("127.0.0.1", self.port)
+        await c.connect(f"bench{user}", "bench")
+        return c
+
+    def content(self, rng, size):
+        # Conteúdo único por arquivo (o dedup por sha256 não pode encurtar o upload)
+        return rng.randbytes(16) + self.block[:size - 16] if size > 16 else rng.randbytes(size)
+
+    # --- fases -----------------------------------------------------------------
+
+    async def seed(self):
+        args = self.args; rng = random.Random(args.seed)
+        self.block = rng.randbytes(self.file_size)
+        rec = Recorder()
+        c = await self.client()
+        try:
+            await c.mkd("/seed")
+            started = time.perf_counter()
+            for i in range(args.seed_files):
+                path = f"/seed/f{i:04d}.bin"; data = self.content(rng, self.file_size)
+                t = time.perf_counter()
+                await c.stor(path, data)
+                rec.ok("stor", time.perf_counter() - t, len(data))
+                self.seed_content[path] = data
+            stored = time.perf_counter() - started
+        finally: await c.close()
+
+        # Pipeline: do primeiro STOR até todas as partes estarem no Telegram
+        deadline = time.monotonic() + args.drain_timeout
+        while await self.mongo.files.count_documents({"parent": "/seed", "type": "file", "status": {"$ne": "completed"}}):
+            if time.monotonic() > deadline: raise TimeoutError("pipeline do seed não terminou dentro de --drain-timeout")
+            await asyncio.sleep(0.05)
+        drained = time.perf_counter() - started
+        total = len(self.seed_content) * self.file_size
+        self.report["seed"] = {
+            "files": len(self.seed_content), "bytes": total,
+            "stor_seconds": round(stored, 3), "stor": rec.summary(stored).get("stor"),
+            "pipeline_seconds": round(drained, 3), "pipeline_mb_per_s": round(total / MB / drained, 3) if drained else None,
+        }
+
+        # Pasta grande para LIST/MLSD (só metadados, direto no banco)
+        now = int(time.time())
+        await self.mongo.files.insert_one({"type": "dir", "name": "big", "parent": "/seed", "ctime": now, "mtime": now, "size": 0})
+        docs = [{"type": "file", "name": f"e{i:06d}.dat", "parent": "/seed/big", "size": rng.randrange(1, 10 * MB),
+                 "ctime": now, "mtime": now, "status": "completed", "parts": []} for i in range(args.listing_entries)]
+        for i in range(0, len(docs), 1000): await self.mongo.files.insert_many(docs[i:i + 1000])
+
+    async def run(self):
+        args = self.args
+        rec = Recorder()
+        # Pastas de cada cliente criadas antes (MKD concorrente da mesma pasta dá 451)
+        c = await self.client()
+        try:
+            for u in range(args.users): await c.mkd(f"/u{u}")
+            for i in range(args.clients): await c.mkd(f"/u{i % args.users}/c{i}")
+        finally: await c.close()
+        deadline = time.monotonic() + args.duration
+        started = time.perf_counter()
+        await asyncio.gather(*(self.client_loop(i, rec, deadline) for i in range(args.clients)))
+        elapsed = time.perf_counter() - started
+        ops = rec.summary(elapsed)
+        self.report["run"] = {
+            "seconds": round(elapsed, 3), "clients": args.clients,
+            "ops": sum(o["count"] for o in ops.values()), "errors": sum(o["errors"] for o in ops.values()),
+            "ops_per_s": round(sum(o["count"] for o in ops.values()) / elapsed, 3),
+        }
+        self.report["ops"] = ops
+
+    async def client_loop(self, index, rec, deadline):
+        args = self.args; rng = random.Random(args.seed * 1000 + index)
+        user = index % args.users
+        home = f"/u{user}/c{index}"
+        names, weights = zip(*self.mix.items())
+        seeds = sorted(self.seed_content)
+        mine = []; n = 0
+        c = await self.client(user)
+        try:
+            while time.monotonic() < deadline:
+                op = rng.choices(names, weights)[0]; n += 1
+                if op in ("retr", "rest") and not seeds: continue
+                if op == "rename" and not mine: op = "stor"
+                size = 0
+                t = time.perf_counter()
+                try:
+                    if op == "list": size = len(await c.list("/seed/big"))
+                    elif op == "mlsd": size = len(await c.mlsd("/seed/big"))
+                    elif op == "stor":
+                        path = f"{home}/s{n:05d}.bin"; data = self.content(rng, self.file_size)
+                        t = time.perf_counter()
+                        await c.stor(path, data); size = len(data); mine.append(path)
+                    elif op in ("retr", "rest"):
+                        path = rng.choice(seeds); expected = self.seed_content[path]
+                        offset = rng.randrange(1, len(expected)) if op == "rest" else 0
+                        data = await c.retr(path, offset); size = len(data)
+                        if not args.no_verify and data != expected[offset:]:
+                            raise AssertionError(f"{path}@{offset}: conteúdo divergente ({len(data)}/{len(expected) - offset} bytes)")
+                    elif op == "rename":
+                        src = mine.pop(rng.randrange(len(mine))); dst = f"{home}/r{n:05d}.bin"
+                        await c.rename(src, dst); mine.append(dst)
+                    rec.ok(op, time.perf_counter() - t, size)
+                except (FTPError, AssertionError, OSError, asyncio.IncompleteReadError) as e:
+                    rec.fail(op, e)
+                    if isinstance(e, (ConnectionError, asyncio.IncompleteReadError)):
+                        await c.close(); c = await self.client(user)
+        finally: await c.close()
+
+    def finish(self):
+        app = self.app
+        self.report.update({
+            "schema": SCHEMA,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git": git_revision(),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "telegram": dict(self.telegram.stats),
+            "bots": self.pool.stats(),
+            "metadata": self.sqlite.stats() if self.sqlite else None,
+            "uploads": {"completed": app.Metrics.uploads_total, "failed": app.Metrics.uploads_failed, "deduplicated": app.Metrics.dedup_total},
+        })
+        return self.report
+
+
+def git_revision():
+    try: return subprocess.run(["git", "-C", str(ROOT), "describe", "--always", "--dirty"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception: return None
+
+
+def compare(base_path, current_path, threshold=None):
+    with open(base_path) as f: base = json.load(f)
+    with open(current_path) as f: current = json.load(f)
+    regressions = []
+    print(f"{'op':<8} {'métrica':<10} {'base':>12} {'atual':>12} {'Δ%':>8}")
+
+    def row(op, metric, a, b, higher_is_better):
+        if a is None or b is None: return
+        delta = (b - a) / a * 100 if a else 0.0
+        worse = -delta if higher_is_better else delta
+        flag = " !" if threshold is not None and worse > threshold else ""
+        if flag: regressions.append(f"{op} {metric}")
+        print(f"{op:<8} {metric:<10} {a:>12.3f} {b:>12.3f} {delta:>+7.1f}%{flag}")
+
+    for op in sorted(set(base.get("ops", {})) | set(current.get("ops", {}))):
+        a = base.get("ops", {}).get(op, {}); b = current.get("ops", {}).get(op, {})
+        row(op, "ops/s", a.get("ops_per_s"), b.get("ops_per_s"), True)
+        row(op, "p50 ms", a.get("p50_ms"), b.get("p50_ms"), False)
+        row(op, "p99 ms", a.get("p99_ms"), b.get("p99_ms"), False)
+    row("seed", "MB/s", base.get("seed", {}).get("pipeline_mb_per_s"), current.get("seed", {}).get("pipeline_mb_per_s"), True)
+    if regressions:
+        print(f"\nRegressões acima de {threshold}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+def print_summary(report):
+    seed = report.get("seed", {})
+    print(f"seed: {seed.get('files')} arquivos, pipeline {seed.get('pipeline_mb_per_s')} MB/s em {seed.get('pipeline_seconds')} s", file=sys.stderr)
+    run = report.get("run", {})
+    print(f"run: {run.get('ops')} ops em {run.get('seconds')} s ({run.get('ops_per_s')} ops/s, {run.get('errors')} erros)", file=sys.stderr)
+    for op, s in report.get("ops", {}).items():
+        print(f"  {op:<7} n={s['count']:<6} {s['ops_per_s']:>9} ops/s {s['mb_per_s']:>9} MB/s  p50 {s['p50_ms']} ms  p99 {s['p99_ms']} ms  erros {s['errors']}", file=sys.stderr)
+
+
+async def bench(args):
+    b = Bench(args)
+    await b.start()
+    try:
+        await b.seed()
+        await b.run()
+    finally:
+        await b.stop()
+    return b.finish()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare: sys.exit(compare(*args.compare, threshold=args.fail_on_regression))
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="nebula-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    # staging/, cache/ e nebula.log ficam na pasta de trabalho
+    os.chdir(workdir)
+    try: report = asyncio.run(bench(args))
+    finally:
+        os.chdir(cwd)
+        if not args.keep and not args.workdir: shutil.rmtree(workdir, ignore_errors=True)
+    print_summary(report)
+    text = json.dumps(report, indent=2, default=str)
+    if output:
+        with open(output, "w") as f: f.write(text + "\n")
+    else: print(text)
+
+
+if __name__ == "__main__":
+    main()
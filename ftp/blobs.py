@@ -0,0 +1,61 @@
+from collections import Counter
+from time import time
+import logging
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger("NebulaFTP")
+
+__all__ = ("BlobIndex",)
+
+
+class BlobIndex:
+    """
+    Índice de conteúdo (coleção `blobs`): sha256 -> partes já enviadas ao Telegram.
+
+    Cada documento de arquivo que aponta para um blob (campo `blob`) conta uma
+    referência em `refs`. Um upload de conteúdo repetido reaproveita as partes
+    (acquire) em vez de reenviá-las; unlink/rmdir/sobrescrita liberam a
+    referência (release) e o blob sai do índice quando ninguém mais o usa.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    @property
+    def blobs(self): return self.db.blobs
+
+    async def acquire(self, sha256, size):
+        """Blob com o mesmo conteúdo (e tamanho), já com +1 referência; ou None."""
+        return await self.blobs.find_one_and_update(
+            {"_id": sha256, "size": size, "refs": {"$gt": 0}},
+            {"$inc": {"refs": 1}, "$set": {"used_at": time()}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def register(self, sha256, size, parts, part_offsets, file_uuid):
+        """
+        Publica as partes de um upload recém-concluído. Devolve True se este
+        arquivo passou a ser a primeira referência; False se outro upload do
+        mesmo conteúdo chegou antes (o arquivo segue com as próprias partes).
+        """
+        now = time()
+        res = await self.blobs.update_one(
+            {"_id": sha256},
+            {"$setOnInsert": {"size": size, "parts": parts, "part_offsets": part_offsets, "obfuscated_id": file_uuid, "refs": 1, "created_at": now, "used_at": now}},
+            upsert=True
+        )
+        return res.upserted_id is not None
+
+    async def release(self, sha256, count=1):
+        if not sha256: return
+        blob = await self.blobs.find_one_and_update({"_id": sha256}, {"$inc": {"refs": -count}}, return_document=ReturnDocument.AFTER)
+        if blob is not None and blob.get("refs", 0) <= 0:
+            # As mensagens continuam no canal, como em qualquer unlink
+            await self.blobs.delete_one({"_id": sha256, "refs": {"$lte": 0}})
+            logger.info(f"🧬 [DEDUP] Blob sem referências removido: {sha256[:12]}")
+
+    async def release_docs(self, docs):
+        """Libera as referências de vários documentos de arquivo (ex.: rmdir)."""
+        counts = Counter(d["blob"] for d in docs if d.get("blob"))
+        for sha256, count in counts.items(): await self.release(sha256, count)
@@ -0,0 +1,143 @@
+from asyncio import sleep as asleep
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from time import monotonic
+import logging
+
+from pyrogram.errors import FloodWait
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger("NebulaFTP")
+
+__all__ = ("PooledBot", "BotPool", "patiently")
+
+FLOOD_WAIT_SECONDS = REGISTRY.counter("nebula_tg_flood_wait_seconds", "Segundos de FloodWait recebidos por bot", ("bot",))
+
+
+async def patiently(factory, attempts=3):
+    """Chamada de inicialização: os clientes não dormem no FloodWait (sleep_threshold=0), então espera aqui."""
+    for attempt in range(1, attempts + 1):
+        try: return await factory()
+        except FloodWait as e:
+            if attempt == attempts: raise
+            logger.warning(f"⏳ FloodWait de {e.value}s na inicialização, aguardando...")
+            await asleep(e.value)
+
+
+class PooledBot:
+    """Um pyrogram.Client do pool com sua carga atual e estatísticas."""
+
+    def __init__(self, client, index):
+        self.client = client; self.index = index
+        self.id = None
+        self.inflight = 0
+        self.benched_until = 0.0
+        self.requests = 0; self.bytes_up = 0; self.bytes_down = 0
+        self.flood_waits = 0; self.flood_wait_seconds = 0.0
+
+    @property
+    def name(self): return self.client.name
+
+    @property
+    def benched(self): return monotonic() < self.benched_until
+
+
+class BotPool:
+    """
+    Pool de bots (um por token em BOT_TOKENS).
+
+    use() entrega o bot saudável com menos requisições em voo; um FloodWait
+    coloca apenas aquele bot no banco (bench) pelo tempo pedido, e os demais
+    continuam atendendo. Só quando todos estão no banco o chamador espera.
+    Chamadas fora do GetFile/send_document (get_messages) também tratam o
+    FloodWait: o bot vai para o banco e o FloodWait sobe para o chamador
+    escolher outro bot.
+
+    file_ids são específicos de cada bot: file_id_for() obtém o file_id da mesma
+    mensagem do canal visto por outro bot (get_messages), com cache LRU.
+    """
+
+    def __init__(self, clients, file_id_cache_size=10000):
+        self.bots = [PooledBot(c, i) for i, c in enumerate(clients)]
+        self._file_ids = OrderedDict(); self._file_id_cache_size = file_id_cache_size
+
+    @property
+    def primary(self): return self.bots[0].client
+
+    def __len__(self): return len(self.bots)
+
+    async def start(self):
+        started = []
+        for bot in self.bots:
+            try:
+                await bot.client.start()
+                bot.id = bot.client.me.id
+                started.append(bot)
+                logger.info(f"🤖 Bot #{bot.index + 1} conectado: @{bot.client.me.username}")
+            except Exception as e:
+                logger.error(f"❌ Falha ao iniciar bot #{bot.index + 1}: {e}")
+        self.bots = started
+        return bool(started)
+
+    async def check_chat(self, chat_id):
+        """Mantém só os bots com acesso ao canal (o primeiro define o resultado)."""
+        ok = []
+        for bot in self.bots:
+            try: await patiently(lambda: bot.client.get_chat(chat_id)); ok.append(bot)
+            except Exception as e: logger.error(f"❌ Bot #{bot.index + 1} sem acesso ao canal: {e}")
+        if ok: self.bots = ok
+        return bool(ok)
+
+    async def stop(self):
+        for bot in self.bots:
+            try: await bot.client.stop()
+            except Exception: pass
+
+    def pick(self):
+        """Bot saudável menos carregado; se todos estão no banco, o que sai primeiro."""
+        healthy = [b for b in self.bots if not b.benched]
+        if healthy: return min(healthy, key=lambda b: (b.inflight, b.requests))
+        return min(self.bots, key=lambda b: b.benched_until)
+
+    def has_free(self):
+        return any(not b.benched for b in self.bots)
+
+    @asynccontextmanager
+    async def use(self, bot=None):
+        bot = bot or self.pick()
+        wait = bot.benched_until - monotonic()
+        if wait > 0: await asleep(wait)
+        bot.inflight += 1; bot.requests += 1
+        try: yield bot
+        finally: bot.inflight -= 1
+
+    def bench(self, bot, seconds):
+        bot.benched_until = max(bot.benched_until, monotonic() + seconds)
+        bot.flood_waits += 1; bot.flood_wait_seconds += seconds
+        FLOOD_WAIT_SECONDS.inc(seconds, (bot.index + 1,))
+        logger.warning(f"⏳ [POOL] Bot #{bot.index + 1} em FloodWait por {seconds}s ({sum(not b.benched for b in self.bots)} livres)")
+
+    async def file_id_for(self, bot, part, chat_id):
+        """file_id da parte utilizável por `bot` (o gravado se foi ele quem enviou)."""
+        # Partes antigas (sem tg_bot) foram enviadas pelo primeiro token
+        owner = part.get("tg_bot")
+        mine = bot.index == 0 if owner is None else owner == bot.id
+        if mine or chat_id is None or part.get("tg_message") is None: return part["tg_file"]
+        key = (bot.id, part["tg_message"])
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            try: msg = await bot.client.get_messages(chat_id, part["tg_message"])
+            except FloodWait as e: self.bench(bot, e.value); raise
+            file_id = msg.document.file_id if msg and msg.document else part["tg_file"]
+            self._file_ids[key] = file_id
+            while len(self._file_ids) > self._file_id_cache_size: self._file_ids.popitem(last=False)
+        else: self._file_ids.move_to_end(key)
+        return file_id
+
+    def stats(self):
+        return [{
+            "bot": b.index + 1, "name": b.name, "inflight": b.inflight, "requests": b.requests,
+            "bytes_up": b.bytes_up, "bytes_down": b.bytes_down, "benched": b.benched,
+            "flood_waits": b.flood_waits, "flood_wait_seconds": b.flood_wait_seconds,
+        } for b in self.bots]
@@ -0,0 +1,208 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from time import monotonic
+
+__all__ = ("MetadataCache", "ListingCache")
+
+
+def _estimate_size(doc):
+    """Estimativa barata (em bytes) do espaço ocupado por um documento em cache."""
+    if doc is None: return 64
+    size = 240
+    for key, value in doc.items():
+        size += len(key) + (len(value) if isinstance(value, str) else 16)
+    for part in doc.get("parts") or ():
+        size += 160 + len(part.get("tg_file", ""))
+    return size
+
+
+class _PathIndex:
+    """Caminhos em ordem: os que ficam abaixo de um diretório formam uma faixa contígua (bisect)."""
+
+    def __init__(self): self.paths = []
+
+    def add(self, path):
+        i = bisect_left(self.paths, path)
+        if i == len(self.paths) or self.paths[i] != path: self.paths.insert(i, path)
+
+    def remove(self, path):
+        i = bisect_left(self.paths, path)
+        if i < len(self.paths) and self.paths[i] == path: del self.paths[i]
+
+    def tree(self, path):
+        """`path` e os caminhos abaixo dele ("0" vem logo depois de "/")."""
+        prefix = path.rstrip("/") + "/"
+        found = self.paths[bisect_left(self.paths, prefix):bisect_left(self.paths, prefix[:-1] + "0")]
+        i = bisect_left(self.paths, path)
+        if path != prefix and i < len(self.paths) and self.paths[i] == path: found.append(path)
+        return found
+
+
+class MetadataCache:
+    """
+    Cache LRU de metadados (documentos de db.files) com limite por entradas e por bytes.
+
+    - TTL separado para entradas positivas e negativas (caminhos inexistentes).
+    - Leituras e escritas sem lock: nenhuma operação faz await, então cada uma
+      é atômica dentro do event loop.
+    - Contadores de hit/miss/eviction para métricas.
+    - Índice das chaves por diretório pai: discard_tree() só visita a subárvore.
+    """
+    MISSING = object()
+
+    def __init__(self, max_entries=100000, max_bytes=128 * 1024 * 1024, ttl=300, negative_ttl=5):
+        self.max_entries = max_entries; self.max_bytes = max_bytes
+        self.ttl = ttl; self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._children = {}; self._parents = _PathIndex()  # pai -> chaves em cache
+        self.bytes = 0
+        self.hits = 0; self.negative_hits = 0; self.misses = 0
+        self.evictions = 0; self.expirations = 0
+
+    @staticmethod
+    def key(parent, name): return f"{parent}::{name}"
+
+    def __len__(self): return len(self._entries)
+
+    def get(self, parent, name):
+        """Retorna o documento, MetadataCache.MISSING (cache negativo) ou None (miss)."""
+        key = self.key(parent, name)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1; return None
+        expires, size, doc, _ = entry
+        if expires < monotonic():
+            self._drop(key); self.expirations += 1; self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        if doc is None:
+            self.negative_hits += 1; return self.MISSING
+        self.hits += 1
+        return doc
+
+    def set(self, parent, name, doc):
+        self._store(parent, name, doc, self.ttl)
+
+    def set_missing(self, parent, name):
+        if self.negative_ttl > 0: self._store(parent, name, None, self.negative_ttl)
+
+    def update(self, parent, name, **fields):
+        """Atualiza campos de uma entrada positiva existente (sem renovar o TTL)."""
+        entry = self._entries.get(self.key(parent, name))
+        if entry is not None and entry[2] is not None: entry[2].update(fields)
+
+    def discard(self, parent, name):
+        self._drop(self.key(parent, name))
+
+    def discard_tree(self, path):
+        """Remove todas as entradas dentro de `path` (usado em remoções recursivas)."""
+        for parent in self._parents.tree(path):
+            for key in list(self._children.get(parent, ())): self._drop(key)
+
+    def clear(self):
+        self._entries.clear(); self._children.clear(); self._parents = _PathIndex(); self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self._entries), "bytes": self.bytes,
+            "hits": self.hits, "negative_hits": self.negative_hits, "misses": self.misses,
+            "evictions": self.evictions, "expirations": self.expirations,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+    def _store(self, parent, name, doc, ttl):
+        key = self.key(parent, name)
+        self._drop(key)
+        size = _estimate_size(doc)
+        self._entries[key] = (monotonic() + ttl, size, doc, parent)
+        self.bytes += size
+        children = self._children.get(parent)
+        if children is None: children = self._children[parent] = set(); self._parents.add(parent)
+        children.add(key)
+        while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+            self._drop(next(iter(self._entries))); self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None: return
+        self.bytes -= entry[1]
+        parent = entry[3]; children = self._children.get(parent)
+        if children is not None:
+            children.discard(key)
+            if not children: del self._children[parent]; self._parents.remove(parent)
+
+
+class ListingCache:
+    """
+    Cache por diretório das entradas de listagem (nome, Stats) usado por LIST/MLSD.
+
+    Invalidação write-through: toda operação que altera um diretório chama
+    invalidate(parent). Uma listagem lida do banco só é guardada se nenhuma
+    invalidação do diretório aconteceu enquanto o cursor era consumido.
+    """
+
+    def __init__(self, max_dirs=2000, max_entries=200000, ttl=60):
+        self.max_dirs = max_dirs; self.max_entries = max_entries; self.ttl = ttl
+        self._dirs = OrderedDict(); self._paths = _PathIndex()
+        self._scanning = {}; self._invalidated = {}; self._clock = 0
+        self.entries = 0
+        self.hits = 0; self.misses = 0; self.evictions = 0; self.invalidations = 0
+
+    def get(self, path):
+        entry = self._dirs.get(path)
+        if entry is None or entry[0] < monotonic():
+            if entry is not None: self._drop(path)
+            self.misses += 1; return None
+        self._dirs.move_to_end(path)
+        self.hits += 1
+        return entry[1]
+
+    def begin(self, path):
+        """Marca o início de uma leitura do banco; retorna o token para finish()."""
+        self._scanning[path] = self._scanning.get(path, 0) + 1
+        return self._clock
+
+    def finish(self, path, token, entries=None):
+        """Encerra a leitura iniciada em begin(), guardando `entries` se ainda válidas."""
+        if entries is not None and self.ttl > 0 and self._invalidated.get(path, -1) < token and len(entries) <= self.max_entries:
+            self._drop(path)
+            self._dirs[path] = (monotonic() + self.ttl, entries); self._paths.add(path)
+            self.entries += len(entries)
+            while self._dirs and (len(self._dirs) > self.max_dirs or self.entries > self.max_entries):
+                self._drop(next(iter(self._dirs))); self.evictions += 1
+        count = self._scanning.get(path, 0) - 1
+        if count > 0: self._scanning[path] = count
+        else: self._scanning.pop(path, None); self._invalidated.pop(path, None)
+
+    def invalidate(self, path):
+        self.invalidations += 1
+        self._drop(path)
+        if path in self._scanning:
+            self._invalidated[path] = self._clock
+        self._clock += 1
+
+    def invalidate_tree(self, path):
+        """Invalida `path` e todos os diretórios abaixo dele."""
+        prefix = path.rstrip("/") + "/"
+        for p in self._paths.tree(path): self._drop(p)
+        # Só as leituras em andamento (poucas) são percorridas
+        for p in self._scanning:
+            if p == path or p.startswith(prefix): self._invalidated[p] = self._clock
+        self.invalidations += 1; self._clock += 1
+
+    def clear(self):
+        self._dirs.clear(); self._paths = _PathIndex(); self.entries = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "dirs": len(self._dirs), "entries": self.entries,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _drop(self, path):
+        entry = self._dirs.pop(path, None)
+        if entry is not None: self.entries -= len(entry[1]); self._paths.remove(path)
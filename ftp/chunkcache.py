@@ -0,0 +1,123 @@
+from asyncio import create_task, get_running_loop, shield
+from collections import OrderedDict
+from hashlib import sha1
+from uuid import uuid4
+import os
+import logging
+import aiofiles
+
+logger = logging.getLogger("NebulaFTP")
+
+__all__ = ("ChunkCache",)
+
+
+class ChunkCache:
+    """
+    Cache em disco (read-through) dos blocos baixados do Telegram.
+
+    Cada bloco é identificado por (tg_file, offset alinhado) e gravado em
+    `root/<xx>/<hash>_<offset>`. O espaço total é limitado por `max_bytes` com
+    descarte LRU. O índice é reconstruído do disco no primeiro uso (ordem de mtime), no executor.
+    """
+
+    def __init__(self, root="cache/chunks", max_bytes=1024 * 1024 * 1024):
+        self.root = root; self.max_bytes = max_bytes
+        self._index = None; self._loading = None
+        self.bytes = 0
+        self.hits = 0; self.misses = 0; self.bytes_saved = 0; self.evictions = 0
+
+    @property
+    def enabled(self): return self.max_bytes > 0
+
+    def _path(self, tg_file, offset):
+        digest = sha1(tg_file.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], f"{digest}_{offset}")
+
+    def _scan(self):
+        """Blocos em disco do mais antigo ao mais novo (mtime), já descartando o excesso (roda no executor)."""
+        found = []
+        if os.path.isdir(self.root):
+            for sub in os.scandir(self.root):
+                if not sub.is_dir(): continue
+                for entry in os.scandir(sub.path):
+                    if entry.name.endswith(".tmp"):
+                        try: os.remove(entry.path)
+                        except OSError: pass
+                        continue
+                    try: st = entry.stat()
+                    except OSError: continue
+                    found.append((st.st_mtime, entry.path, st.st_size))
+        found.sort()
+        total = sum(size for _, _, size in found); evicted = 0
+        while evicted < len(found) and total > self.max_bytes:
+            _, path, size = found[evicted]
+            total -= size; evicted += 1
+            try: os.remove(path)
+            except OSError: pass
+        return [(path, size) for _, path, size in found[evicted:]], evicted
+
+    async def _ready(self):
+        """Reconstrói o índice do disco no primeiro uso, fora do event loop (uma vez só)."""
+        if self._index is not None: return
+        if self._loading is None: self._loading = create_task(self._load())
+        await shield(self._loading)
+
+    async def _load(self):
+        try: entries, evicted = await get_running_loop().run_in_executor(None, self._scan)
+        except OSError as e:
+            logger.warning(f"⚠️ [CHUNK CACHE] Falha ao ler o cache em disco: {e}"); entries, evicted = [], 0
+        index = OrderedDict(entries)
+        self.bytes = sum(index.values()); self.evictions += evicted
+        self._index = index
+
+    async def get(self, tg_file, offset):
+        if not self.enabled: return None
+        await self._ready()
+        path = self._path(tg_file, offset)
+        if path not in self._index:
+            self.misses += 1; return None
+        try:
+            async with aiofiles.open(path, "rb") as f: data = await f.read()
+        except OSError:
+            self._forget(path); self.misses += 1; return None
+        self._index.move_to_end(path)
+        self.hits += 1; self.bytes_saved += len(data)
+        return data
+
+    async def put(self, tg_file, offset, data):
+        if not self.enabled or not data or len(data) > self.max_bytes: return
+        await self._ready()
+        path = self._path(tg_file, offset)
+        tmp = f"{path}.{uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            async with aiofiles.open(tmp, "wb") as f: await f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"⚠️ [CHUNK CACHE] Falha ao gravar bloco: {e}")
+            try: os.remove(tmp)
+            except OSError: pass
+            return
+        self._forget(path)
+        self._index[path] = len(data); self.bytes += len(data)
+        self._evict()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index or ()), "bytes": self.bytes,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "bytes_saved": self.bytes_saved,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _forget(self, path):
+        size = self._index.pop(path, None)
+        if size is not None: self.bytes -= size
+
+    def _evict(self):
+        while self._index and self.bytes > self.max_bytes:
+            path, size = self._index.popitem(last=False)
+            self.bytes -= size; self.evictions += 1
+            try: os.remove(path)
+            except OSError: pass
@@ -1,10 +1,43 @@
 from locale import LC_ALL, setlocale as _setlocale
 from threading import Lock
 from contextlib import contextmanager
-from asyncio import IncompleteReadError, Queue
+from asyncio import IncompleteReadError
+from os import environ
+import io
+import os
+
+from .jobs import UploadQueue, FairScheduler
+from .governor import RateGovernor
+
+def _priorities(raw):
+    # "/alice/urgente=0,/backup=5"
+    pairs = (item.rsplit("=", 1) for item in raw.split(",") if "=" in item)
+    return {path.strip(): int(priority) for path, priority in pairs}
+
+# Fila Global de Upload (persistida no Mongo após UPLOAD_QUEUE.bind(db))
+UPLOAD_QUEUE = UploadQueue(
+    visibility_timeout=int(environ.get("QUEUE_VISIBILITY_TIMEOUT", 300)),
+    heartbeat_interval=int(environ.get("QUEUE_HEARTBEAT_INTERVAL", 60)),
+    candidate_ttl=float(environ.get("QUEUE_CANDIDATE_TTL", 2)),
+    retry_backoff=float(environ.get("QUEUE_RETRY_BACKOFF", 30)),
+    scheduler=FairScheduler(
+        small=int(environ.get("QUEUE_SMALL_MB", 16)) * 1024 * 1024,
+        medium=int(environ.get("QUEUE_MEDIUM_MB", 1024)) * 1024 * 1024,
+        quantum=int(environ.get("QUEUE_FAIR_QUANTUM_MB", 1024)) * 1024 * 1024,
+        aging=int(environ.get("QUEUE_AGING_SECONDS", 600)),
+        priorities=_priorities(environ.get("UPLOAD_PRIORITIES", "")),
+    ),
+)
+
+def _rate(name, rate, burst, max_rate):
+    # (taxa inicial, burst, mínima, máxima) em requisições/s
+    return (float(environ.get(f"{name}_RATE", rate)), int(environ.get(f"{name}_BURST", burst)), 0.05, float(environ.get(f"{name}_MAX_RATE", max_rate)))
 
-# ADICIONADO: Fila Global de Upload
-UPLOAD_QUEUE = Queue()
+# Limitador AIMD compartilhado de todas as requisições ao Telegram
+GOVERNOR = RateGovernor(
+    {"up": _rate("GOV_UPLOAD", 2, 4, 20), "chat": _rate("GOV_CHAT", 1, 4, 10), "down": _rate("GOV_DOWNLOAD", 20, 20, 100)},
+    enabled=environ.get("GOVERNOR", "true").lower() in ("1", "true", "yes"),
+)
 
 __all__ = (
     "StreamIO",
@@ -12,6 +45,8 @@ __all__ = (
     "AbstractAsyncLister",
     "setlocale",
     "UPLOAD_QUEUE", # Exportar a fila
+    "GOVERNOR",
+    "FileSlice",
 )
 
 class AsyncStreamIterator:
@@ -79,6 +114,46 @@ class StreamIO:
     def iter_by_block(self, count=8192):
         return AsyncStreamIterator(lambda: self.readexactly(count))
 
+class FileSlice(io.RawIOBase):
+    """
+    Visão somente leitura de [offset, offset+length) de um descritor já aberto.
+
+    Lê sob demanda com os.pread (sem mover o cursor do fd, então várias fatias
+    podem compartilhar o mesmo descritor). Quem consome (ex.: Pyrogram) puxa
+    blocos pequenos, então a memória não cresce com o tamanho da fatia.
+    """
+
+    def __init__(self, fd, offset, length, name=None):
+        super().__init__()
+        self.fd = fd; self.start = offset; self.length = length; self.name = name
+        self.pos = 0
+
+    def readable(self): return True
+    def seekable(self): return True
+    def tell(self): return self.pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET: pos = offset
+        elif whence == os.SEEK_CUR: pos = self.pos + offset
+        elif whence == os.SEEK_END: pos = self.length + offset
+        else: raise ValueError(f"whence inválido: {whence}")
+        if pos < 0: raise ValueError("posição negativa")
+        self.pos = pos
+        return pos
+
+    def read(self, size=-1):
+        remaining = self.length - self.pos
+        if remaining <= 0: return b""
+        if size is None or size < 0 or size > remaining: size = remaining
+        data = os.pread(self.fd, size, self.start + self.pos)
+        self.pos += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
 LOCALE_LOCK = Lock()
 
 @contextmanager
@@ -2,6 +2,8 @@ __all__ = (
     "AIOFTPException",
     "PathIOError",
     "NoAvailablePort",
+    "InvalidPartsError",
+    "StagingFullError",
 )
 
 class AIOFTPException(Exception):
@@ -13,4 +15,10 @@ class PathIOError(AIOFTPException):
         self.reason = reason
 
 class NoAvailablePort(AIOFTPException, OSError):
-    pass
\ No newline at end of file
+    pass
+
+class InvalidPartsError(PathIOError):
+    pass
+
+class StagingFullError(PathIOError):
+    pass
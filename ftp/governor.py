@@ -0,0 +1,103 @@
+from asyncio import Lock, sleep as asleep
+from time import monotonic
+import logging
+
+logger = logging.getLogger("NebulaFTP")
+
+__all__ = ("TokenBucket", "RateGovernor")
+
+
+class TokenBucket:
+    """
+    Token bucket com taxa ajustada por AIMD:
+    - sucesso: aumento aditivo (~`increase` req/s a cada segundo de sucesso);
+    - FloodWait: taxa multiplicada por `decrease` e bucket congelado pelo tempo pedido.
+    """
+
+    def __init__(self, rate, burst, min_rate, max_rate, increase, decrease):
+        self.rate = rate; self.burst = burst
+        self.min_rate = min_rate; self.max_rate = max_rate
+        self.increase = increase; self.decrease = decrease
+        self.tokens = float(burst); self.updated = monotonic()
+        self.blocked_until = 0.0
+        self.lock = Lock()
+        self.requests = 0; self.floods = 0; self.waited = 0.0
+
+    def _refill(self, now):
+        if now <= self.updated: return
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # Lock: quem chegou primeiro sai primeiro, sem corrida pelo mesmo token
+        async with self.lock:
+            start = monotonic()
+            while True:
+                now = monotonic()
+                if now < self.blocked_until:
+                    await asleep(self.blocked_until - now); continue
+                self._refill(now)
+                if self.tokens >= 1: break
+                await asleep((1 - self.tokens) / self.rate)
+            self.tokens -= 1; self.requests += 1
+            self.waited += monotonic() - start
+
+    def success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def penalize(self, seconds=0):
+        now = monotonic()
+        self._refill(now)
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        if seconds:
+            self.floods += 1; self.tokens = 0.0
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            # O bucket só volta a encher depois do congelamento
+            self.updated = self.blocked_until
+
+
+class RateGovernor:
+    """
+    Limitador compartilhado das requisições ao Telegram: um bucket por chave
+    (ex.: "up:<bot>", "chat:<bot>:<chat>", "down:<bot>"), criado sob demanda com os
+    parâmetros do seu tipo (prefixo antes de ":").
+
+    acquire(*keys) espera um token em todos os buckets; success() e flood()
+    realimentam a taxa, para operar logo abaixo do limite em vez de alternar
+    entre rajadas e longas esperas.
+    """
+
+    def __init__(self, kinds, increase=0.05, decrease=0.5, enabled=True):
+        # kinds: {"up": (taxa inicial, burst, taxa mínima, taxa máxima), ...}
+        self.kinds = kinds; self.increase = increase; self.decrease = decrease
+        self.enabled = enabled
+        self.buckets = {}
+
+    def bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            rate, burst, min_rate, max_rate = self.kinds[key.split(":", 1)[0]]
+            bucket = self.buckets[key] = TokenBucket(rate, burst, min_rate, max_rate, self.increase, self.decrease)
+        return bucket
+
+    async def acquire(self, *keys):
+        if not self.enabled: return
+        for key in keys: await self.bucket(key).acquire()
+
+    def success(self, *keys):
+        if not self.enabled: return
+        for key in keys: self.bucket(key).success()
+
+    def flood(self, seconds, *keys):
+        """FloodWait: reduz a taxa e congela os buckets envolvidos por `seconds`."""
+        if not self.enabled: return
+        for key in keys: self.bucket(key).penalize(seconds)
+        logger.warning(f"🐢 [GOV] FloodWait {seconds}s: taxa reduzida para " + ", ".join(f"{k}={self.bucket(k).rate:.2f}/s" for k in keys))
+
+    def error(self, *keys):
+        """Erro RPC genérico: só reduz a taxa (sem congelar)."""
+        if not self.enabled: return
+        for key in keys: self.bucket(key).penalize()
+
+    def stats(self):
+        return {key: {"rate": b.rate, "requests": b.requests, "floods": b.floods, "waited": b.waited} for key, b in self.buckets.items()}
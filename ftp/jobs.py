@@ -0,0 +1,373 @@
+from asyncio import Event, wait_for, TimeoutError, sleep as asleep, create_task, CancelledError
+from collections import deque
+from contextlib import asynccontextmanager
+from math import exp, log
+from socket import gethostname
+from time import time
+from uuid import uuid4
+import os
+import re
+import logging
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger("NebulaFTP")
+
+__all__ = ("UploadQueue", "FairScheduler")
+
+# Campos de controle do job que não fazem parte da tarefa entregue ao worker
+_JOB_FIELDS = ("_id", "state", "visible_at", "lease", "owner", "leased_at", "claims", "created_at", "error", "cls", "queued_at")
+
+
+class FairScheduler:
+    """
+    Escolhe o próximo job entre os candidatos visíveis (em vez de FIFO).
+
+    Menor pontuação vence:
+      prioridade  `priority` explícita (do job ou do prefixo de pasta em `priorities`)
+                  ou a classe de tamanho (small=0, medium=1, large=2)
+      + uso       bytes enviados recentemente pelo usuário e pela pasta (decaimento
+                  exponencial com meia-vida `half_life`), em unidades de `quantum`
+      - aging     tempo de espera / `aging`: jobs grandes também acabam saindo
+
+    O usuário é a pasta raiz do caminho (home /<login>).
+    """
+
+    CLASSES = ("small", "medium", "large")
+
+    def __init__(self, small=16 * 1024 * 1024, medium=1024 * 1024 * 1024, quantum=1024 * 1024 * 1024, half_life=300, aging=600, samples=1000, priorities=None):
+        self.small = small; self.medium = medium
+        # {"/alice/urgente": 0, "/backup": 5}: o prefixo mais longo vale
+        self.priorities = sorted((priorities or {}).items(), key=lambda kv: -len(kv[0]))
+        self.quantum = quantum; self.half_life = half_life; self.aging = aging
+        self._usage = {}  # chave -> (bytes decaídos, instante)
+        self._waits = {c: deque(maxlen=samples) for c in self.CLASSES}
+
+    def classify(self, size):
+        if size <= self.small: return "small"
+        return "medium" if size <= self.medium else "large"
+
+    @staticmethod
+    def user_of(parent):
+        parts = [p for p in (parent or "/").split("/") if p]
+        return parts[0] if parts else "/"
+
+    def priority_of(self, parent):
+        parent = (parent or "/").rstrip("/") + "/"
+        for prefix, priority in self.priorities:
+            if parent.startswith(prefix.rstrip("/") + "/"): return priority
+        return None
+
+    def usage(self, key, now):
+        used, at = self._usage.get(key, (0.0, now))
+        return used * exp(-log(2) * (now - at) / self.half_life)
+
+    def score(self, job, now):
+        base = job.get("priority")
+        if base is None: base = self.CLASSES.index(job.get("cls") or self.classify(job.get("size", 0)))
+        share = (self.usage(("user", job.get("user") or self.user_of(job.get("parent"))), now) + self.usage(("dir", job.get("parent")), now)) / self.quantum
+        waited = now - job.get("created_at", now)
+        return base + share - waited / self.aging
+
+    def order(self, jobs, now):
+        return sorted(jobs, key=lambda j: self.score(j, now))
+
+    def served(self, job, now):
+        """Contabiliza o job entregue a um worker (uso por usuário/pasta e tempo de espera)."""
+        size = job.get("size", 0)
+        for key in (("user", job.get("user") or self.user_of(job.get("parent"))), ("dir", job.get("parent"))):
+            self._usage[key] = (self.usage(key, now) + size, now)
+        if len(self._usage) > 10000:
+            # Descarta chaves já praticamente zeradas
+            self._usage = {k: v for k, v in self._usage.items() if self.usage(k, now) > 1024}
+        self._waits[job.get("cls") or self.classify(size)].append(now - job.get("queued_at", now))
+
+    def wait_percentiles(self, cls, points=(50, 95, 99)):
+        waits = sorted(self._waits[cls])
+        if not waits: return {p: 0.0 for p in points}
+        return {p: waits[min(len(waits) - 1, int(len(waits) * p / 100))] for p in points}
+
+
+class UploadQueue:
+    """
+    Fila de upload durável (coleção `upload_jobs` do Mongo), compatível com a
+    interface usada da asyncio.Queue (put/get/task_done/join/empty/qsize).
+
+    - Um job por `path` de staging: put() é idempotente e recoloca o job na fila
+      (um job em lease fica com o worker que o tem).
+    - get() faz o claim atômico (find_one_and_update) com lease e visibility
+      timeout: se o worker morrer, o job volta a ficar visível sozinho.
+    - keep_alive() renova o lease (heartbeat) enquanto o upload está em curso.
+    - retry() devolve à fila, com backoff e a tentativa seguinte, o job que o
+      próprio worker tem em lease (put() não mexe em jobs em lease).
+    - ack()/fail() encerram o job; task_done()/join() contam só o trabalho
+      em andamento neste processo.
+
+    A ordem de entrega é do FairScheduler: prioridade/tamanho, partilha justa por
+    usuário e pasta e aging. O claim avalia o job mais antigo de cada grupo
+    (usuário, pasta, classe) e tenta os melhores até um claim atômico vencer. Os
+    candidatos (um aggregate) ficam em cache por `candidate_ttl` segundos e são
+    consumidos a cada claim; um put() deste processo descarta o cache.
+
+    Antes de bind() (ou sem banco) funciona apenas em memória, como a fila antiga.
+    """
+
+    RECOVER_BATCH = 1000
+
+    def __init__(self, visibility_timeout=300, heartbeat_interval=60, poll_interval=5, scheduler=None, candidates=500, candidate_ttl=2.0, retry_backoff=30):
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.scheduler = scheduler or FairScheduler()
+        self.candidates = candidates; self.candidate_ttl = candidate_ttl
+        self._pool = []; self._pool_at = 0.0
+        self.retry_backoff = retry_backoff
+        self.db = None
+        self.owner = f"{gethostname()}:{os.getpid()}"
+        self._memory = []
+        self._wakeup = Event()
+        self._unfinished = 0
+        self._idle = Event(); self._idle.set()
+
+    @property
+    def jobs(self): return self.db.upload_jobs
+
+    async def bind(self, db):
+        """Passa a persistir os jobs no Mongo, migrando o que estava em memória."""
+        self.db = db
+        await self.jobs.create_index("path", unique=True)
+        await self.jobs.create_index([("state", 1), ("visible_at", 1)])
+        await self.jobs.create_index([("state", 1), ("cls", 1)])
+        await self.jobs.create_index([("state", 1), ("created_at", 1)])
+        pending = list(self._memory); self._memory.clear()
+        for task in pending: await self.put(task)
+
+    @staticmethod
+    def _task(job):
+        return {k: v for k, v in job.items() if k not in _JOB_FIELDS}
+
+    def _prepare(self, task, now):
+        task = self._task(task)
+        task.setdefault("user", self.scheduler.user_of(task.get("parent")))
+        if task.get("priority") is None:
+            priority = self.scheduler.priority_of(task.get("parent"))
+            if priority is not None: task["priority"] = priority
+        return dict(task, cls=self.scheduler.classify(task.get("size", 0)), queued_at=now)
+
+    def _upsert(self, job, now):
+        # Job em lease não casa o filtro: o upsert esbarra no índice único e o job fica intacto
+        return UpdateOne(
+            {"path": job["path"], "state": {"$ne": "leased"}},
+            {"$set": dict(job, state="queued", visible_at=now), "$unset": {"lease": 1, "owner": 1, "error": 1},
+             "$setOnInsert": {"created_at": now}},
+            upsert=True
+        )
+
+    async def put(self, task):
+        await self.put_many([task])
+
+    async def put_many(self, tasks):
+        """Enfileira vários jobs de uma vez (um único bulk_write no Mongo)."""
+        now = time()
+        jobs = [self._prepare(t, now) for t in tasks]
+        if not jobs: return
+        if self.db is None:
+            paths = {j["path"] for j in jobs}
+            self._memory = [t for t in self._memory if t["path"] not in paths]
+            self._memory.extend(dict(j, created_at=now) for j in jobs)
+        else:
+            self._pool = []
+            try: await self.jobs.bulk_write([self._upsert(j, now) for j in jobs], ordered=False)
+            except BulkWriteError as e:
+                # Chave duplicada = job em lease com outro worker; qualquer outro erro sobe
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])): raise
+        self._wakeup.set()
+
+    async def ensure_many(self, tasks):
+        """Cria os jobs que ainda não existem; jobs existentes (ex.: em lease) ficam intactos."""
+        now = time()
+        jobs = [self._prepare(t, now) for t in tasks]
+        if not jobs: return
+        if self.db is None:
+            paths = {t["path"] for t in self._memory}
+            self._memory.extend(dict(j, created_at=now) for j in jobs if j["path"] not in paths)
+        else:
+            self._pool = []
+            await self.jobs.bulk_write([
+                UpdateOne({"path": j["path"]}, {"$setOnInsert": dict(j, state="queued", visible_at=now, created_at=now)}, upsert=True)
+                for j in jobs
+            ], ordered=False)
+        self._wakeup.set()
+
+    async def _candidates(self, now):
+        """Job mais antigo de cada (usuário, pasta, classe) visível agora (em cache por candidate_ttl)."""
+        if self._pool and now - self._pool_at < self.candidate_ttl: return self._pool
+        pipeline = [
+            {"$match": {"state": {"$in": ["queued", "leased"]}, "visible_at": {"$lte": now}}},
+            {"$sort": {"created_at": 1}},
+            {"$group": {
+                "_id": {"user": "$user", "parent": "$parent", "cls": "$cls"},
+                "job": {"$first": "$_id"}, "size": {"$first": "$size"}, "priority": {"$first": "$priority"},
+                "created_at": {"$first": "$created_at"},
+            }},
+            # A saída do $group não tem ordem: os grupos mais antigos entram primeiro no limite
+            {"$sort": {"created_at": 1}},
+            {"$limit": self.candidates},
+        ]
+        out = []
+        async for g in self.jobs.aggregate(pipeline):
+            out.append(dict(g["_id"], _id=g["job"], size=g.get("size") or 0, priority=g.get("priority"), created_at=g.get("created_at", now)))
+        self._pool = out; self._pool_at = now
+        return out
+
+    async def _claim(self):
+        now = time()
+        if self.db is None:
+            if not self._memory: return None
+            task = self.scheduler.order(self._memory, now)[0]
+            self._memory.remove(task)
+            self.scheduler.served(task, now)
+            return self._task(task)
+        for cand in self.scheduler.order(await self._candidates(now), now):
+            # Levado por este claim ou por outro worker/processo: sai do cache de candidatos
+            if cand in self._pool: self._pool.remove(cand)
+            job = await self.jobs.find_one_and_update(
+                {"_id": cand["_id"], "state": {"$in": ["queued", "leased"]}, "visible_at": {"$lte": now}},
+                {"$set": {"state": "leased", "visible_at": now + self.visibility_timeout, "lease": uuid4().hex, "owner": self.owner, "leased_at": now},
+                 "$inc": {"claims": 1}},
+                return_document=ReturnDocument.AFTER
+            )
+            if job is None: continue
+            if job.get("claims", 1) > 1: logger.info(f"♻️ [QUEUE] Job retomado: {job.get('filename')} (claim {job['claims']})")
+            self.scheduler.served(job, now)
+            return dict(self._task(job), _id=job["_id"], lease=job["lease"])
+        return None
+
+    async def get(self):
+        while True:
+            self._wakeup.clear()
+            task = await self._claim()
+            if task is not None:
+                self._unfinished += 1; self._idle.clear()
+                return task
+            try: await wait_for(self._wakeup.wait(), self.poll_interval)
+            except TimeoutError: pass
+
+    def _lease_filter(self, task):
+        return {"_id": task["_id"], "lease": task["lease"]}
+
+    async def heartbeat(self, task):
+        """Estende o visibility timeout do job em posse deste worker."""
+        if self.db is None or "lease" not in task: return True
+        res = await self.jobs.update_one(self._lease_filter(task), {"$set": {"visible_at": time() + self.visibility_timeout}})
+        return res.modified_count > 0
+
+    @asynccontextmanager
+    async def keep_alive(self, task):
+        """Renova o lease periodicamente enquanto o bloco executa."""
+        async def beat():
+            while True:
+                await asleep(self.heartbeat_interval)
+                try:
+                    if not await self.heartbeat(task): logger.warning(f"⚠️ [QUEUE] Lease perdido: {task.get('filename')}")
+                except Exception as e: logger.warning(f"⚠️ [QUEUE] Heartbeat falhou: {e}")
+        beater = create_task(beat())
+        try: yield
+        finally:
+            beater.cancel()
+            try: await beater
+            except CancelledError: pass
+
+    async def retry(self, task, max_attempts, **fields):
+        """
+        Devolve à fila o job deste worker com `attempt` + 1, visível após o backoff
+        (retry_backoff * 2^(tentativa-1)). False se as tentativas acabaram (o chamador usa fail()).
+        """
+        attempt = task.get("attempt", 1)
+        if attempt >= max_attempts: return False
+        if self.db is None or "lease" not in task:
+            await self.put(dict(task, attempt=attempt + 1, **fields)); return True
+        now = time()
+        res = await self.jobs.update_one(
+            self._lease_filter(task),
+            {"$set": dict(fields, state="queued", visible_at=now + self.retry_backoff * 2 ** (attempt - 1), attempt=attempt + 1, queued_at=now),
+             "$unset": {"lease": 1, "owner": 1}}
+        )
+        if not res.modified_count: logger.warning(f"⚠️ [QUEUE] Lease perdido antes do retry: {task.get('filename')}")
+        self._pool = []; self._wakeup.set()
+        return True
+
+    async def ack(self, task):
+        """Job concluído (ou descartado): remove da fila."""
+        if self.db is not None and "lease" in task:
+            await self.jobs.delete_one(self._lease_filter(task))
+
+    async def fail(self, task, error):
+        """Job que esgotou as tentativas: fica registrado como failed."""
+        if self.db is not None and "lease" in task:
+            await self.jobs.update_one(self._lease_filter(task), {"$set": {"state": "failed", "error": str(error)}, "$unset": {"lease": 1}})
+
+    def task_done(self):
+        if self._unfinished <= 0: raise ValueError("task_done() called too many times")
+        self._unfinished -= 1
+        if self._unfinished == 0: self._idle.set()
+
+    async def join(self):
+        await self._idle.wait()
+
+    def empty(self):
+        return self._unfinished == 0 and not self._memory
+
+    def qsize(self):
+        return len(self._memory)
+
+    async def depth(self):
+        if self.db is None: return len(self._memory)
+        return await self.jobs.count_documents({"state": {"$in": ["queued", "leased"]}})
+
+    async def oldest_age(self):
+        """Idade (s) do job mais antigo ainda na fila."""
+        now = time()
+        if self.db is None: return max((now - t.get("created_at", now) for t in self._memory), default=0)
+        job = await self.jobs.find_one({"state": {"$in": ["queued", "leased"]}}, {"created_at": 1}, sort=[("created_at", 1)])
+        return now - job["created_at"] if job and job.get("created_at") else 0
+
+    async def class_stats(self):
+        """Por classe: jobs na fila e percentis (p50/p95/p99) do tempo de espera até o claim."""
+        depth = dict.fromkeys(FairScheduler.CLASSES, 0)
+        if self.db is None:
+            for t in self._memory: depth[t["cls"]] += 1
+        else:
+            for cls in depth: depth[cls] = await self.jobs.count_documents({"state": {"$in": ["queued", "leased"]}, "cls": cls})
+        return {cls: {"depth": depth[cls], "wait": self.scheduler.wait_percentiles(cls)} for cls in depth}
+
+    async def recover(self, files):
+        """
+        Reidrata a fila na partida:
+        - libera leases deixados por um processo anterior nesta mesma máquina;
+        - cria jobs para documentos `status: staging` cujo arquivo ainda existe.
+        """
+        if self.db is None: return 0
+        host = self.owner.split(":")[0]
+        res = await self.jobs.update_many(
+            {"state": "leased", "owner": {"$regex": f"^{re.escape(host)}:", "$ne": self.owner}},
+            {"$set": {"state": "queued", "visible_at": time()}, "$unset": {"lease": 1, "owner": 1}}
+        )
+        released = res.modified_count
+        staged = []
+        async for doc in files.find({"status": "staging", "local_path": {"$exists": True}}, {"name": 1, "parent": 1, "size": 1, "local_path": 1}):
+            path = doc["local_path"]
+            if not path or path.endswith(".partial") or not os.path.exists(path): continue
+            staged.append({"path": path, "filename": doc["name"], "parent": doc["parent"], "size": doc.get("size", 0)})
+        queued = 0
+        # Um find por lote (não um por arquivo) para saber quais já têm job
+        for i in range(0, len(staged), self.RECOVER_BATCH):
+            batch = staged[i:i + self.RECOVER_BATCH]
+            known = {job["path"] async for job in self.jobs.find({"path": {"$in": [t["path"] for t in batch]}}, {"path": 1})}
+            missing = [t for t in batch if t["path"] not in known]
+            await self.ensure_many(missing)
+            queued += len(missing)
+        if released or queued:
+            logger.info(f"♻️ [QUEUE] Recuperação: {released} leases liberados, {queued} arquivos de staging reenfileirados")
+        return released + queued
@@ -0,0 +1,159 @@
+from asyncio import start_server
+from bisect import bisect_left
+import logging
+
+logger = logging.getLogger("NebulaFTP")
+
+__all__ = ("Counter", "Gauge", "Histogram", "Registry", "REGISTRY", "serve_metrics")
+
+# Latências em segundos (comandos FTP, partes enviadas ao Telegram)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _labels(names, values):
+    if not names: return ""
+    pairs = ",".join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _num(v):
+    if v == float("inf"): return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name; self.help = help; self.label_names = tuple(labels)
+
+    def header(self):
+        return [f"# TYPE {self.name} {self.type}", f"# HELP {self.name} {self.help}"]
+
+
+class Counter(_Metric):
+    """Contador monotônico. inc() é só uma soma num dict: barato no caminho quente."""
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels); self.values = {}
+
+    def inc(self, amount=1, labels=()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        return self.header() + [f"{self.name}_total{_labels(self.label_names, k)} {_num(v)}" for k, v in self.values.items()]
+
+
+class Gauge(_Metric):
+    """Valor instantâneo: definido com set() ou lido de `fn()` na hora da coleta."""
+    type = "gauge"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        super().__init__(name, help, labels); self.values = {}; self.fn = fn
+
+    def set(self, value, labels=()):
+        self.values[labels] = value
+
+    def render(self):
+        values = self.values
+        if self.fn is not None:
+            try: values = self.fn()
+            except Exception as e:
+                logger.debug(f"[METRICS] {self.name}: {e}"); values = {}
+            if not isinstance(values, dict): values = {(): values}
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in values.items() if v is not None]
+
+
+class Histogram(_Metric):
+    """Histograma com buckets fixos (bisect + incremento)."""
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets); self.series = {}  # labels -> [contagens..., soma, total]
+
+    def observe(self, value, labels=()):
+        s = self.series.get(labels)
+        if s is None: s = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        s[bisect_left(self.buckets, value)] += 1
+        s[-2] += value; s[-1] += 1
+
+    def render(self):
+        out = self.header()
+        names = self.label_names + ("le",)
+        for k, s in self.series.items():
+            acc = 0
+            for i, bound in enumerate(self.buckets + (float("inf"),)):
+                acc += s[i]
+                out.append(f"{self.name}_bucket{_labels(names, k + (_num(bound),))} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, k)} {_num(s[-2])}")
+            out.append(f"{self.name}_count{_labels(self.label_names, k)} {s[-1]}")
+        return out
+
+
+class Registry:
+    """
+    Conjunto de métricas exportadas em formato OpenMetrics.
+    `refresh` são coroutines chamadas antes de cada coleta (ex.: profundidade da
+    fila no Mongo), para que nada disso rode no caminho quente.
+    """
+
+    def __init__(self):
+        self.metrics = {}; self.refresh = []
+
+    def _add(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()): return self._add(Counter(name, help, labels))
+    def gauge(self, name, help, labels=(), fn=None): return self._add(Gauge(name, help, labels, fn))
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS): return self._add(Histogram(name, help, labels, buckets))
+
+    def on_collect(self, coro_fn):
+        self.refresh.append(coro_fn); return coro_fn
+
+    async def render(self):
+        for fn in self.refresh:
+            try: await fn()
+            except Exception as e: logger.warning(f"⚠️ [METRICS] Coleta falhou: {e}")
+        lines = []
+        for metric in self.metrics.values(): lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Métricas alimentadas pelo servidor FTP e pelo pathio
+FTP_COMMANDS = REGISTRY.counter("nebula_ftp_commands", "Comandos FTP processados", ("command", "status"))
+FTP_COMMAND_LATENCY = REGISTRY.histogram("nebula_ftp_command_seconds", "Latência por comando FTP", ("command",))
+FTP_BYTES = REGISTRY.counter("nebula_ftp_bytes", "Bytes transferidos por usuário", ("user", "direction"))
+
+
+async def serve_metrics(host, port, registry=REGISTRY, routes=None):
+    """
+    Endpoint HTTP mínimo: GET /metrics devolve o texto OpenMetrics.
+    `routes` acrescenta caminhos: {"/trace": coroutine -> (content-type, bytes)}.
+    """
+    async def metrics():
+        return "application/openmetrics-text; version=1.0.0; charset=utf-8", (await registry.render()).encode()
+    routes = {"/metrics": metrics, "/": metrics, **(routes or {})}
+
+    async def handle(reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""): pass
+            parts = request.decode("latin-1").split()
+            route = routes.get(parts[1].split("?")[0]) if len(parts) >= 2 and parts[0] == "GET" else None
+            if route is not None:
+                content_type, body = await route()
+                head = f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\n"
+            else:
+                body = b"not found\n"; head = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+            writer.write(f"{head}Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except Exception as e: logger.debug(f"[METRICS] {e}")
+        finally: writer.close()
+    server = await start_server(handle, host, port)
+    logger.info(f"📈 Métricas em http://{host}:{port}/metrics")
+    return server
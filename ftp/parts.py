@@ -0,0 +1,75 @@
+from bisect import bisect_right
+
+from .errors import InvalidPartsError
+
+__all__ = ("PartIndex",)
+
+
+class PartIndex:
+    """
+    Índice de offsets acumulados das partes de um arquivo no Telegram.
+
+    `offsets[i]` é a posição do primeiro byte da parte i e `offsets[-1]` o tamanho
+    total. O índice é gravado no documento (campo `part_offsets`) ao concluir o
+    upload; documentos antigos têm o índice reconstruído a partir de `file_size`.
+    locate() encontra a parte de um offset por busca binária.
+    """
+
+    def __init__(self, parts, offsets):
+        self.parts = parts; self.offsets = offsets
+
+    @property
+    def size(self): return self.offsets[-1]
+
+    @staticmethod
+    def build_offsets(parts):
+        offsets = [0]
+        for part in parts: offsets.append(offsets[-1] + part["file_size"])
+        return offsets
+
+    @classmethod
+    def from_doc(cls, doc):
+        """Monta e valida o índice de um documento (dict ou Node); InvalidPartsError se inconsistente."""
+        get = doc.get if isinstance(doc, dict) else lambda k, d=None: getattr(doc, k, d)
+        name = get("name"); size = get("size"); parts = list(get("parts") or ())
+
+        # Partes sem part_id vão para o início e falham na validação abaixo (não KeyError)
+        if any(parts[i].get("part_id", -1) > parts[i + 1].get("part_id", -1) for i in range(len(parts) - 1)):
+            parts.sort(key=lambda p: p.get("part_id", -1))
+        for i, part in enumerate(parts):
+            if part.get("part_id") != i:
+                raise InvalidPartsError(f"{name}: parte {i} ausente (encontrado part_id={part.get('part_id')})")
+            if not part.get("tg_file"):
+                raise InvalidPartsError(f"{name}: parte {i} sem tg_file")
+
+        missing = [i for i, p in enumerate(parts) if not isinstance(p.get("file_size"), int) or p["file_size"] <= 0]
+        if missing:
+            # Legado: só a última parte sem tamanho pode ser inferida pelo tamanho total
+            if missing != [len(parts) - 1] or not size:
+                raise InvalidPartsError(f"{name}: partes sem file_size: {missing}")
+            known = sum(p["file_size"] for p in parts[:-1])
+            if size <= known: raise InvalidPartsError(f"{name}: tamanho {size} menor que as partes")
+            parts[-1] = dict(parts[-1], file_size=size - known)
+
+        offsets = get("part_offsets")
+        if not offsets or len(offsets) != len(parts) + 1 or offsets[0] != 0:
+            offsets = cls.build_offsets(parts)
+        elif any(offsets[i + 1] - offsets[i] != p["file_size"] for i, p in enumerate(parts)):
+            raise InvalidPartsError(f"{name}: part_offsets não confere com file_size das partes")
+        if size is not None and parts and offsets[-1] != size:
+            raise InvalidPartsError(f"{name}: soma das partes ({offsets[-1]}) difere do tamanho ({size})")
+        return cls(parts, offsets)
+
+    def locate(self, offset):
+        """Retorna (índice da parte, offset local) do byte `offset`; None se além do fim."""
+        if offset < 0 or offset >= self.size: return None
+        i = bisect_right(self.offsets, offset) - 1
+        return i, offset - self.offsets[i]
+
+    def slices(self, offset=0):
+        """Itera (parte, offset local) a partir de `offset` até o fim do arquivo."""
+        found = self.locate(offset)
+        if found is None: return
+        i, local = found
+        yield self.parts[i], local
+        for part in self.parts[i + 1:]: yield part, 0
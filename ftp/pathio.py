@@ -1,21 +1,34 @@
-from asyncio import CancelledError, get_event_loop, gather, sleep as asleep, Lock
+from asyncio import CancelledError, create_task, get_event_loop, gather, sleep as asleep
 from collections import namedtuple
+from contextlib import aclosing
 from functools import wraps
+from hashlib import sha256
 from io import BytesIO
 from os import environ
 from pathlib import PurePosixPath
 from sys import exc_info
 from time import time
 from uuid import uuid4
+import errno
 import os
 import aiofiles
 import logging
 import unicodedata
 import re
 
-from .errors import PathIOError
-from .tg import File
-from .common import UPLOAD_QUEUE
+from pymongo import UpdateOne
+from pyrogram.errors import FloodWait
+
+from .errors import PathIOError, StagingFullError
+from .tg import File, CHUNK_SIZE as TG_CHUNK_SIZE
+from .common import UPLOAD_QUEUE, GOVERNOR
+from .cache import MetadataCache, ListingCache
+from .chunkcache import ChunkCache
+from .parts import PartIndex
+from .blobs import BlobIndex
+from .staging import StagingBudget
+from .tracing import traced
+from .tree import full_path, descendants, moved
 
 logger = logging.getLogger("NebulaFTP")
 
@@ -25,6 +38,29 @@ CACHE_DIR = "staging"
 if not os.path.exists(CACHE_DIR):
     os.makedirs(CACHE_DIR)
 
+# Limites do cache de metadados (entradas, MB e TTLs em segundos)
+META_CACHE_MAX_ENTRIES = int(environ.get("META_CACHE_MAX_ENTRIES", 100000))
+META_CACHE_MAX_MB = int(environ.get("META_CACHE_MAX_MB", 128))
+META_CACHE_TTL = int(environ.get("META_CACHE_TTL", 300))
+META_CACHE_NEGATIVE_TTL = int(environ.get("META_CACHE_NEGATIVE_TTL", 5))
+# Cache de listagens (LIST/MLSD) por diretório
+LIST_CACHE_MAX_DIRS = int(environ.get("LIST_CACHE_MAX_DIRS", 2000))
+LIST_CACHE_MAX_ENTRIES = int(environ.get("LIST_CACHE_MAX_ENTRIES", 200000))
+LIST_CACHE_TTL = int(environ.get("LIST_CACHE_TTL", 60))
+# Read-ahead do RETR: blocos buscados em paralelo e teto de memória (MB) por download
+READAHEAD_WINDOW = int(environ.get("READAHEAD_WINDOW", 4))
+READAHEAD_MAX_MB = int(environ.get("READAHEAD_MAX_MB", 16))
+# Cache em disco dos blocos baixados (0 desativa)
+CHUNK_CACHE_DIR = environ.get("CHUNK_CACHE_DIR", os.path.join("cache", "chunks"))
+CHUNK_CACHE_MB = int(environ.get("CHUNK_CACHE_MB", 1024))
+
+# Orçamento do staging: limite total (MB, 0 = só o espaço livre do disco), marca alta,
+# espaço livre mínimo e tempo máximo de um STOR pausado
+STAGING_MAX_MB = int(environ.get("STAGING_MAX_MB", 0))
+STAGING_HIGH_RATIO = float(environ.get("STAGING_HIGH_RATIO", 0.8))
+STAGING_MIN_FREE_MB = int(environ.get("STAGING_MIN_FREE_MB", 1024))
+STAGING_MAX_PAUSE = int(environ.get("STAGING_MAX_PAUSE", 300))
+
 def universal_exception(coro):
     @wraps(coro)
     async def wrapper(*args, **kwargs):
@@ -52,7 +88,7 @@ class AbstractPathIO:
         self.connection = connection
 
 class Node:
-    def __init__(self, type, name, ctime=None, mtime=None, size=0, parent="/", parts=None, local_path=None, **k):
+    def __init__(self, type, name, ctime=None, mtime=None, size=0, parent="/", parts=None, local_path=None, part_offsets=None, **k):
         if parts is None: parts = []
         self.type = type
         self.name = name
@@ -63,10 +99,13 @@ class Node:
         self.path = str(PurePosixPath(parent) / name)
         self.parts = parts
         self.local_path = local_path
+        self.part_offsets = part_offsets
 
 class MongoDBMemoryIO:
-    def __init__(self, node, mode, tg, db):
+    def __init__(self, node, mode, tg, db, index=None):
         self._node = node; self._mode = mode; self._tg = tg; self._db = db
+        # PartIndex validado no open() (leitura do Telegram)
+        self._index = index
         self.offset = 0
         self.safe_name = f"{uuid4().hex}_{node.name}"
         self.local_path = os.path.join(CACHE_DIR, self.safe_name)
@@ -77,49 +116,99 @@ class MongoDBMemoryIO:
     async def __aexit__(self, *args, **kwargs): pass
     async def seek(self, offset=0): self.offset = offset
 
+    async def _drop_placeholder(self):
+        """Remove o documento criado pelo open('wb') que ainda não recebeu dados."""
+        parent = self._node.parent; name = self._node.name
+        try: await self._db.files.delete_one({"name": name, "parent": parent, "local_path": {"$exists": False}, "parts": []})
+        except Exception: pass
+        MongoDBPathIO.cache.discard(parent, name)
+        MongoDBPathIO.listings.invalidate(parent)
+
     async def write_stream(self, stream):
+        staging = MongoDBPathIO.staging
+        # Upload em pipeline: cada parte completa segue para o Telegram durante o STOR
+        pipelined = MongoDBPathIO.stream_uploader is not None and self.offset == 0 and not self._node.name.endswith(".partial")
+        session = None; next_part = 0; written = 0
+        # Hash do conteúdo calculado durante a escrita (dedup); só com o arquivo completo.
+        # Roda no executor (hashlib solta o GIL) em paralelo com a leitura do próximo bloco
+        digest = sha256() if self.offset == 0 else None
+        hashing = None; loop = get_event_loop()
         try:
             # Garante que a pasta staging exista
             os.makedirs(os.path.dirname(self.temp_path), exist_ok=True)
             # Escreve no arquivo temporário (.partial)
             async with aiofiles.open(self.temp_path, "wb") as f:
                 if self.offset > 0: await f.seek(self.offset)
+                if pipelined: session = MongoDBPathIO.stream_uploader(self.temp_path)
                 async for data in stream.iter_by_block(1024*1024):
                     await f.write(data)
+                    written += len(data)
+                    staging.reserve(len(data))
+                    if digest is not None:
+                        if hashing is not None: await hashing
+                        hashing = loop.run_in_executor(None, digest.update, data)
+                    if session is not None and written >= (next_part + 1) * session.chunk_size:
+                        await f.flush()
+                        while written >= (next_part + 1) * session.chunk_size:
+                            session.part_ready(next_part, next_part * session.chunk_size, session.chunk_size)
+                            next_part += 1
+                    # Backpressure: não lê o próximo bloco enquanto o staging está cheio
+                    await staging.throttle()
                 await f.flush()
-        except Exception as e:
-            logger.error(f"❌ [WRITE] Erro disco: {e}"); raise
+                if hashing is not None: await hashing
+        except BaseException as e:
+            if session is not None: session.abort()
+            staging.release(written)
+            if isinstance(e, StagingFullError) or (isinstance(e, OSError) and e.errno == errno.ENOSPC):
+                # Sem espaço: descarta o temporário e o documento vazio criado no open
+                logger.error(f"💽 [WRITE] Staging cheio, upload recusado: {self._node.name}")
+                try: os.remove(self.temp_path)
+                except OSError: pass
+                await self._drop_placeholder()
+                if not isinstance(e, StagingFullError): raise StagingFullError("sem espaço no staging", reason="staging") from e
+            elif isinstance(e, Exception): logger.error(f"❌ [WRITE] Erro disco: {e}")
+            raise
 
         try:
             final_size = os.path.getsize(self.temp_path)
             # Rename atômico para o nome final
             os.rename(self.temp_path, self.local_path)
         except Exception as e:
+            if session is not None: session.abort()
+            staging.release(written)
             logger.error(f"❌ [WRITE] Erro ao finalizar arquivo: {e}")
             raise
+        staging.commit(self.local_path, written, final_size)
 
         parent = self._node.parent
         name = self._node.name
-        cache_key = f"{parent}::{name}"
         now = int(time())
 
         doc_cache = {
-            "type": "file", "name": name, "parent": parent, "size": final_size,
+            "type": "file", "name": name, "parent": parent, "path": full_path(parent, name), "size": final_size,
             "status": "staging", "local_path": self.local_path,
             "mtime": now, "ctime": now, "parts": []
         }
+        if digest is not None: doc_cache["sha256"] = digest.hexdigest()
 
         # Atualiza Cache (Prioridade para Rclone)
-        async with MongoDBPathIO._cache_lock:
-            MongoDBPathIO._memory_cache[cache_key] = doc_cache
+        MongoDBPathIO.cache.set(parent, name, doc_cache)
 
         # Atualiza DB em background (best effort)
         try:
-            await self._db.files.replace_one({"name": name, "parent": parent}, doc_cache, upsert=True)
+            old = await self._db.files.find_one_and_replace({"name": name, "parent": parent}, doc_cache, upsert=True)
+            # Sobrescrita: o conteúdo anterior deixa de referenciar seu blob
+            if old and old.get("blob"): await BlobIndex(self._db).release(old["blob"])
         except: pass
+        MongoDBPathIO.listings.invalidate(parent)
 
         # 🛑 GARANTIA: NUNCA enfileira .partial aqui
-        if not name.endswith(".partial") and final_size > 0:
+        if session is not None:
+            if final_size > 0:
+                session.finish(self.local_path, name, parent, final_size, next_part)
+                logger.info(f"🚰 [WRITE] Upload em pipeline concluindo: {name}")
+            else: session.abort()
+        elif not name.endswith(".partial") and final_size > 0:
              await UPLOAD_QUEUE.put({
                 "path": self.local_path, "filename": name, "parent": parent, "size": final_size
             })
@@ -138,25 +227,100 @@ class MongoDBMemoryIO:
                     yield chunk
             return
 
-        parts = self._node.parts
-        if not parts: return
-        parts.sort(key=lambda x: x["part_id"])
-        current_file_pos = 0; start_read_at = self.offset
-
-        for part in parts:
-            part_size = part.get("file_size", 2 * 1024 * 1024 * 1024)
-            part_end = current_file_pos + part_size
-            if part_end <= start_read_at: current_file_pos += part_size; continue
-            local_offset = max(0, start_read_at - current_file_pos)
-            file = File(part["tg_file"], self._tg)
-            async for chunk in file.stream(offset=local_offset): yield chunk
-            current_file_pos += part_size; start_read_at = current_file_pos
+        if not self._node.parts: return
+        slices = list((self._index or PartIndex.from_doc(self._node)).slices(self.offset))
+        # Na cauda de uma parte (a janela já não tem blocos novos para pedir) a próxima
+        # parte começa a baixar, para o read-ahead não esvaziar na fronteira
+        tail = READAHEAD_WINDOW * TG_CHUNK_SIZE
+        upcoming = None  # (gerador, task do primeiro bloco) da próxima parte
+        try:
+            for i, (part, local_offset) in enumerate(slices):
+                if upcoming is not None: chunks, first = upcoming; upcoming = None
+                else: chunks, first = self._part_chunks(part, local_offset), None
+                remaining = part["file_size"] - local_offset
+                async with aclosing(chunks):
+                    if first is not None:
+                        try: chunk = await first
+                        except StopAsyncIteration: continue
+                        remaining -= len(chunk); yield chunk
+                    async for chunk in chunks:
+                        remaining -= len(chunk)
+                        if upcoming is None and remaining <= tail and i + 1 < len(slices):
+                            following = self._part_chunks(*slices[i + 1])
+                            upcoming = (following, create_task(following.__anext__()))
+                        yield chunk
+        finally:
+            if upcoming is not None:
+                following, first = upcoming
+                first.cancel(); await gather(first, return_exceptions=True)
+                await following.aclose()
+
+    async def _part_chunks(self, part, local_offset):
+        pool = MongoDBPathIO.bots
+        if pool is None:
+            async with aclosing(self._stream_part(part, local_offset, self._tg, part["tg_file"], rate_key="down:primary")) as chunks:
+                async for chunk in chunks: yield chunk
+            return
+        # Cada parte vai para o bot menos carregado do pool; num FloodWait o bot vai
+        # para o banco e a parte continua em outro bot a partir do último byte entregue
+        switches = 0
+        while True:
+            try:
+                async with pool.use() as bot:
+                    file_id = await pool.file_id_for(bot, part, MongoDBPathIO.chat_id)
+                    def on_flood(seconds, bot=bot): pool.bench(bot, seconds); return pool.has_free()
+                    async with aclosing(self._stream_part(part, local_offset, bot.client, file_id, on_flood, f"down:{bot.id}")) as chunks:
+                        async for chunk in chunks:
+                            bot.bytes_down += len(chunk); local_offset += len(chunk); yield chunk
+                return
+            except FloodWait:
+                switches += 1
+                if switches > 2 * len(pool): raise
+
+    async def _stream_part(self, part, local_offset, client, file_id, on_flood=None, rate_key=None):
+        file = File(
+            file_id, client, refresh=self._refresher(part, client, on_flood), cache=MongoDBPathIO.chunk_cache, cache_key=part["tg_file"],
+            on_flood=on_flood, governor=GOVERNOR, rate_keys=(rate_key,) if rate_key else ()
+        )
+        stream = file.stream(offset=local_offset, size=part["file_size"], window=READAHEAD_WINDOW, max_bytes=READAHEAD_MAX_MB * 1024 * 1024)
+        async with aclosing(stream) as chunks:
+            async for chunk in chunks: yield chunk
+
+    def _refresher(self, part, client, on_flood=None):
+        """Renova o file_id relendo a mensagem do canal (file_reference expirado)."""
+        chat_id = MongoDBPathIO.chat_id; message_id = part.get("tg_message")
+        if chat_id is None or message_id is None: return None
+        async def refresh():
+            try: msg = await client.get_messages(chat_id, message_id)
+            except FloodWait as e:
+                # Com outro bot livre o FloodWait sobe e a parte troca de bot; senão espera aqui
+                if on_flood is not None and on_flood(e.value): raise
+                await asleep(e.value)
+                msg = await client.get_messages(chat_id, message_id)
+            return msg.document.file_id if msg and msg.document else None
+        return refresh
 
 class MongoDBPathIO(AbstractPathIO):
-    db = None; tg = None
-    _memory_cache = {}
-    _cache_lock = Lock()
+    db = None; tg = None; chat_id = None
+    # BotPool (main.py): downloads distribuídos entre todos os bots; sem ele usa só `tg`
+    bots = None
+    # Fábrica de StreamingUpload (main.py) quando STREAM_UPLOAD está ativo
+    stream_uploader = None
+    # Todos os documentos já têm `path` (migração concluída): subárvores filtram por ele
+    paths_ready = False
+    cache = MetadataCache(
+        max_entries=META_CACHE_MAX_ENTRIES, max_bytes=META_CACHE_MAX_MB * 1024 * 1024,
+        ttl=META_CACHE_TTL, negative_ttl=META_CACHE_NEGATIVE_TTL
+    )
+    chunk_cache = ChunkCache(CHUNK_CACHE_DIR, CHUNK_CACHE_MB * 1024 * 1024)
+    staging = StagingBudget(
+        CACHE_DIR, hard=STAGING_MAX_MB * 1024 * 1024, high_ratio=STAGING_HIGH_RATIO,
+        min_free=STAGING_MIN_FREE_MB * 1024 * 1024, max_pause=STAGING_MAX_PAUSE
+    )
+    listings = ListingCache(max_dirs=LIST_CACHE_MAX_DIRS, max_entries=LIST_CACHE_MAX_ENTRIES, ttl=LIST_CACHE_TTL)
     Stats = namedtuple("Stats", ("st_size", "st_ctime", "st_mtime", "st_nlink", "st_mode"))
+    # Campos necessários para montar um Stats (projeção das listagens)
+    STAT_PROJECTION = {"_id": 0, "name": 1, "type": 1, "size": 1, "ctime": 1, "mtime": 1}
 
     def __init__(self, *args, state=None, cwd=None, **kwargs):
         super().__init__(*args, **kwargs); self.cwd = PurePosixPath("/")
@@ -178,18 +342,18 @@ class MongoDBPathIO(AbstractPathIO):
         if p_str != "/" and p_str.endswith("/"): p_str = p_str[:-1]
         return os.path.dirname(p_str), os.path.basename(p_str)
 
+    @traced("pathio")
     async def get_node(self, path):
         if str(path) in ("/", "."): return Node("dir", "", 0, 0, size=0, parent="/")
         parent, name = self._split_path(path)
-        cache_key = f"{parent}::{name}"
 
-        async with self._cache_lock:
-            if cache_key in self._memory_cache:
-                return Node(**self._memory_cache[cache_key])
+        cached = self.cache.get(parent, name)
+        if cached is MetadataCache.MISSING: return None
+        if cached is not None: return Node(**cached)
 
         node = await self.db.files.find_one({"name": name, "parent": parent})
         if node:
-            async with self._cache_lock: self._memory_cache[cache_key] = node
+            self.cache.set(parent, name, node)
             return Node(**node)
             
         # Fallback
@@ -197,23 +361,28 @@ class MongoDBPathIO(AbstractPathIO):
             alt = parent[1:]
             node = await self.db.files.find_one({"name": name, "parent": alt})
             if node:
-                async with self._cache_lock: self._memory_cache[cache_key] = node
+                self.cache.set(parent, name, node)
                 return Node(**node)
+        self.cache.set_missing(parent, name)
         return None
 
+    @traced("pathio")
     @universal_exception
     async def exists(self, path): return (await self.get_node(self._absolute(path))) is not None
 
+    @traced("pathio")
     @universal_exception
     async def is_dir(self, path):
         node = await self.get_node(self._absolute(path))
         return not (node is None or node.type != "dir")
 
+    @traced("pathio")
     @universal_exception
     async def is_file(self, path):
         node = await self.get_node(self._absolute(path))
         return not (node is None or node.type != "file")
 
+    @traced("pathio")
     @universal_exception
     async def mkdir(self, path, *, exist_ok=False):
         path = self._absolute(path)
@@ -221,40 +390,64 @@ class MongoDBPathIO(AbstractPathIO):
             if not exist_ok: raise FileExistsError
         else:
             parent, name = self._split_path(path)
-            doc = {"type": "dir", "ctime": int(time()), "mtime": int(time()), "name": name, "parent": parent, "size": 0}
+            doc = {"type": "dir", "ctime": int(time()), "mtime": int(time()), "name": name, "parent": parent, "path": full_path(parent, name), "size": 0}
             try:
                 await self.db.files.insert_one(doc)
-                async with self._cache_lock: self._memory_cache[f"{parent}::{name}"] = doc
+                self.cache.set(parent, name, doc)
             except: 
+                self.cache.discard(parent, name)
                 if not exist_ok: raise FileExistsError
+            finally:
+                self.listings.invalidate(parent)
 
+    @traced("pathio")
     @universal_exception
     async def rmdir(self, path):
         path = self._absolute(path)
         parent, name = self._split_path(path)
-        key = f"{parent}::{name}"
-        async with self._cache_lock: self._memory_cache.pop(key, None)
         await self.db.files.delete_one({"name": name, "parent": parent})
-        full = f"{parent}/{name}" if parent != "/" else f"/{name}"
-        await self.db.files.delete_many({"parent": {"$regex": f"^{full}"}})
-
+        full = full_path(parent, name)
+        subtree = descendants(full, self.paths_ready)
+        await BlobIndex(self.db).release_docs(await self.db.files.find(dict(subtree, blob={"$exists": True}), {"blob": 1}).to_list(None))
+        await self.db.files.delete_many(subtree)
+        self.cache.set_missing(parent, name)
+        self.cache.discard_tree(full)
+        self.listings.invalidate(parent)
+        self.listings.invalidate_tree(full)
+
+    @traced("pathio")
     @universal_exception
     async def unlink(self, path):
         path = self._absolute(path)
         node = await self.get_node(path)
         if node:
-            async with self._cache_lock: self._memory_cache.pop(f"{node.parent}::{node.name}", None)
-            raw = await self.db.files.find_one({"name": node.name, "parent": node.parent})
-            if raw and "local_path" in raw and os.path.exists(raw["local_path"]):
-                try: os.remove(raw["local_path"])
+            if node.local_path and os.path.exists(node.local_path):
+                try: os.remove(node.local_path)
                 except: pass
-            await self.db.files.delete_one({"name": node.name, "parent": node.parent})
+            if node.local_path: self.staging.discard(node.local_path)
+            doc = await self.db.files.find_one_and_delete({"name": node.name, "parent": node.parent}, {"blob": 1})
+            if doc and doc.get("blob"): await BlobIndex(self.db).release(doc["blob"])
+            self.cache.set_missing(node.parent, node.name)
+            self.listings.invalidate(node.parent)
 
-    def list(self, path):
-        path = self._absolute(path)
+    def _search_path(self, path):
         search = path.as_posix()
         if not search.startswith("/"): search = "/" + search
         if search != "/" and search.endswith("/"): search = search[:-1]
+        return search
+
+    def _list_cursor(self, search, projection=None):
+        return self.db.files.find({"parent": search, "name": {"$not": {"$regex": r"\.partial$"}}}, projection)
+
+    @staticmethod
+    def _stats_from_doc(doc):
+        mode = (0x8000 | 0o666) if doc.get("type") == "file" else (0x4000 | 0o777)
+        now = int(time())
+        return MongoDBPathIO.Stats(doc.get("size", 0), doc.get("ctime") or now, doc.get("mtime") or now, 1, mode)
+
+    def list(self, path):
+        path = self._absolute(path)
+        search = self._search_path(path)
 
         class Lister:
             iter = None
@@ -262,50 +455,89 @@ class MongoDBPathIO(AbstractPathIO):
             @universal_exception
             async def __anext__(cls):
                 if cls.iter is None:
-                    cls.iter = self.db.files.find({"parent": search, "name": {"$not": {"$regex": r"\.partial$"}}})
+                    cls.iter = self._list_cursor(search, {"_id": 0, "name": 1})
                 try:
                     doc = await cls.iter.__anext__()
                     return path / doc["name"]
                 except StopAsyncIteration: raise
         return Lister()
 
+    @traced("pathio")
+    async def _scan_entries(self, search):
+        entries = self.listings.get(search)
+        if entries is not None: return entries
+        token = self.listings.begin(search); entries = None
+        try:
+            cursor = self._list_cursor(search, MongoDBPathIO.STAT_PROJECTION)
+            entries = [(doc["name"], MongoDBPathIO._stats_from_doc(doc)) async for doc in cursor]
+            return entries
+        finally:
+            self.listings.finish(search, token, entries)
+
+    def scandir(self, path):
+        """
+        Lista o diretório retornando pares (path, Stats) a partir de um único cursor
+        projetado, sem um find_one por entrada (evita N+1 no LIST/MLSD).
+        Diretórios listados recentemente são servidos do ListingCache.
+        """
+        path = self._absolute(path)
+        search = self._search_path(path)
+
+        class Scanner:
+            iter = None
+            def __aiter__(self): return self
+            @universal_exception
+            async def __anext__(cls):
+                if cls.iter is None:
+                    cls.iter = iter(await self._scan_entries(search))
+                try: name, stats = next(cls.iter)
+                except StopIteration: raise StopAsyncIteration
+                return path / name, stats
+        return Scanner()
+
+    @traced("pathio")
     @universal_exception
     async def stat(self, path):
         node = await self.get_node(self._absolute(path))
         if node is None: raise FileNotFoundError
-        mode = (0x8000 | 0o666) if node.type == "file" else (0x4000 | 0o777)
-        return MongoDBPathIO.Stats(node.size, node.ctime, node.mtime, 1, mode)
+        return MongoDBPathIO._stats_from_doc(vars(node))
 
+    @traced("pathio")
     @universal_exception
     async def open(self, path, mode="rb", *args, **kwargs):
         path = self._absolute(path)
         parent, name = self._split_path(path)
         if mode == "wb":
-            doc = {"type": "file", "ctime": int(time()), "mtime": int(time()), "name": name, "parent": parent, "size": 0, "parts": []}
-            async with self._cache_lock: self._memory_cache[f"{parent}::{name}"] = doc
-            await self.db.files.replace_one({"name": name, "parent": parent}, doc, upsert=True)
+            doc = {"type": "file", "ctime": int(time()), "mtime": int(time()), "name": name, "parent": parent, "path": full_path(parent, name), "size": 0, "parts": []}
+            self.cache.set(parent, name, doc)
+            old = await self.db.files.find_one_and_replace({"name": name, "parent": parent}, doc, upsert=True)
+            if old and old.get("blob"): await BlobIndex(self.db).release(old["blob"])
+            self.listings.invalidate(parent)
         
         node = await self.get_node(path)
         if not node and mode == "rb": raise FileNotFoundError
-        return MongoDBMemoryIO(node, mode, self.tg, self.db)
+        # Partes inconsistentes falham já na abertura (InvalidPartsError), antes de transferir
+        index = None
+        if mode == "rb" and node.parts and not (node.local_path and os.path.exists(node.local_path)):
+            index = PartIndex.from_doc(node)
+        return MongoDBMemoryIO(node, mode, self.tg, self.db, index)
 
+    @traced("pathio")
     @universal_exception
     async def set_mtime(self, path, mtime):
         """Define a data de modificação de um arquivo"""
         path = self._absolute(path)
         parent, name = self._split_path(path)
-        cache_key = f"{parent}::{name}"
         
         # Atualiza no cache
-        async with self._cache_lock:
-            if cache_key in self._memory_cache:
-                self._memory_cache[cache_key]["mtime"] = mtime
+        self.cache.update(parent, name, mtime=mtime)
         
         # Atualiza no DB
         await self.db.files.update_one(
             {"name": name, "parent": parent},
             {"$set": {"mtime": mtime}}
         )
+        self.listings.invalidate(parent)
         
         # Se existir arquivo local, atualiza também
         node = await self.get_node(path)
@@ -315,6 +547,31 @@ class MongoDBPathIO(AbstractPathIO):
             except:
                 pass  # Não é crítico se falhar
     
+    async def _move_tree(self, old, new, batch=1000):
+        """Leva os descendentes de uma pasta renomeada para o novo caminho (parent e path)."""
+        ops = []
+        async for doc in self.db.files.find(descendants(old, self.paths_ready), {"parent": 1, "name": 1, "path": 1}):
+            # Pelo caminho completo: o parent de documentos antigos pode vir sem a "/" inicial
+            path = moved(doc.get("path") or full_path(doc["parent"], doc["name"]), old, new)
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"parent": os.path.dirname(path), "path": path}}))
+            if len(ops) >= batch: await self.db.files.bulk_write(ops, ordered=False); ops = []
+        if ops: await self.db.files.bulk_write(ops, ordered=False)
+        self.cache.discard_tree(new)
+        self.listings.invalidate_tree(new)
+
+    @traced("pathio")
+    @universal_exception
+    async def usage(self, path):
+        """Arquivos e bytes da subárvore de `path` (agregação sobre a faixa do índice)."""
+        full = self._search_path(self._absolute(path))
+        pipeline = [
+            {"$match": dict(descendants(full, self.paths_ready), type="file")},
+            {"$group": {"_id": None, "files": {"$sum": 1}, "bytes": {"$sum": "$size"}}},
+        ]
+        async for row in self.db.files.aggregate(pipeline): return row["files"], row["bytes"]
+        return 0, 0
+
+    @traced("pathio")
     @universal_exception
     async def rename(self, source, destination):
         source = self._absolute(source); destination = self._absolute(destination)
@@ -324,12 +581,8 @@ class MongoDBPathIO(AbstractPathIO):
         dst_p, dst_n = self._split_path(destination)
         
         # 1. BUSCA ORIGEM NO CACHE PRIMEIRO
-        old_key = f"{src_p}::{src_n}"
-        new_key = f"{dst_p}::{dst_n}"
-        src_doc = None
-
-        async with self._cache_lock:
-            src_doc = self._memory_cache.get(old_key)
+        src_doc = self.cache.get(src_p, src_n)
+        if src_doc is MetadataCache.MISSING: src_doc = None
         
         if not src_doc:
             src_doc = await self.db.files.find_one({"name": src_n, "parent": src_p})
@@ -338,21 +591,27 @@ class MongoDBPathIO(AbstractPathIO):
             logger.warning(f"⚠️ [RENAME] Origem não encontrada: {source}")
             return 
 
-        # 2. Atualiza Cache Atomicamente
-        async with self._cache_lock:
-            self._memory_cache.pop(old_key, None)
-            
-            src_doc["name"] = dst_n
-            src_doc["parent"] = dst_p
-            src_doc["mtime"] = int(time())
-            
-            self._memory_cache[new_key] = src_doc
+        # 2. Atualiza Cache (sem await entre as operações: atômico no event loop)
+        src_doc = dict(src_doc)
+        src_doc["name"] = dst_n
+        src_doc["parent"] = dst_p
+        src_doc["path"] = full_path(dst_p, dst_n)
+        src_doc["mtime"] = int(time())
+        src_full = full_path(src_p, src_n)
+        self.cache.set_missing(src_p, src_n)
+        self.cache.set(dst_p, dst_n, src_doc)
+        if src_doc.get("type") == "dir":
+            self.cache.discard_tree(src_full)
+            self.listings.invalidate_tree(src_full)
 
         # 3. Atualiza DB
+        src_filter = {"_id": src_doc["_id"]} if "_id" in src_doc else {"name": src_n, "parent": src_p}
         await self.db.files.update_one(
-            {"_id": src_doc["_id"]}, 
-            {"$set": {"name": dst_n, "parent": dst_p, "mtime": int(time())}}
+            src_filter, 
+            {"$set": {"name": dst_n, "parent": dst_p, "path": src_doc["path"], "mtime": int(time())}}
         )
+        if src_doc.get("type") == "dir": await self._move_tree(src_full, src_doc["path"])
+        self.listings.invalidate(src_p); self.listings.invalidate(dst_p)
 
         # 4. Dispara Upload (Partial -> Final)
         if src_n.endswith(".partial") and not dst_n.endswith(".partial"):
@@ -0,0 +1,271 @@
+"""
+Avaliação de filtros, atualizações, projeções, ordenação e aggregate do Mongo
+sobre documentos em memória (dicts).
+
+É o motor comum dos bancos que imitam o motor sem um mongod: o SQLite embutido
+(sqlitestore) e o Mongo em memória do benchmark. Cobre o que o NebulaFTP usa:
+$eq/$ne/$gt/$gte/$lt/$lte/$in/$nin/$exists/$regex/$not/$size/$all/$elemMatch,
+$and/$or/$nor; $set/$unset/$inc/$setOnInsert/$addToSet/$push/$pull/$min/$max;
+e os estágios $match, $sort, $skip, $limit, $project, $count e $group.
+"""
+import re
+
+from pymongo.errors import OperationFailure
+
+__all__ = (
+    "MISSING", "clone", "hashable", "get_field", "set_field", "unset_field", "is_ops",
+    "match", "project", "sort_spec", "sort_key", "apply_update", "upsert_doc", "aggregate",
+)
+
+# Campo ausente (diferente de um campo com valor None)
+MISSING = object()
+
+
+def clone(value):
+    if isinstance(value, dict): return {k: clone(v) for k, v in value.items()}
+    if isinstance(value, list): return [clone(v) for v in value]
+    return value
+
+
+def hashable(value):
+    if isinstance(value, list): return tuple(hashable(v) for v in value)
+    if isinstance(value, dict): return tuple((k, hashable(v)) for k, v in value.items())
+    return value
+
+
+def get_field(doc, path):
+    cur = doc
+    for key in path.split("."):
+        if isinstance(cur, dict):
+            if key not in cur: return MISSING
+            cur = cur[key]
+        elif isinstance(cur, list) and key.isdigit() and int(key) < len(cur): cur = cur[int(key)]
+        else: return MISSING
+    return cur
+
+
+def set_field(doc, path, value):
+    keys = path.split(".")
+    for key in keys[:-1]:
+        if isinstance(doc, list) and key.isdigit(): doc = doc[int(key)]
+        else: doc = doc.setdefault(key, {})
+    if isinstance(doc, list) and keys[-1].isdigit(): doc[int(keys[-1])] = value
+    else: doc[keys[-1]] = value
+
+
+def unset_field(doc, path):
+    keys = path.split(".")
+    for key in keys[:-1]:
+        doc = doc.get(key) if isinstance(doc, dict) else None
+        if not isinstance(doc, dict): return
+    doc.pop(keys[-1], None)
+
+
+def is_ops(cond):
+    return isinstance(cond, dict) and bool(cond) and all(k.startswith("$") for k in cond)
+
+
+def _candidates(value):
+    """Valores comparáveis de um campo (arrays casam por elemento ou por inteiro)."""
+    if value is MISSING: return [None]
+    if isinstance(value, list): return value + [value]
+    return [value]
+
+
+def _eq(value, arg):
+    return any(v == arg for v in _candidates(value))
+
+
+def _cmp(value, arg, op):
+    for v in _candidates(value):
+        if v is None or isinstance(v, list) and not isinstance(arg, list): continue
+        try:
+            if op(v, arg): return True
+        except TypeError: continue
+    return False
+
+
+def _regex(arg, options=""):
+    if isinstance(arg, re.Pattern): return arg
+    flags = 0
+    if "i" in options: flags |= re.I
+    if "m" in options: flags |= re.M
+    if "s" in options: flags |= re.S
+    return re.compile(arg, flags)
+
+
+def _match_ops(value, cond):
+    for op, arg in cond.items():
+        if op == "$eq": ok = _eq(value, arg)
+        elif op == "$ne": ok = not _eq(value, arg)
+        elif op == "$gt": ok = _cmp(value, arg, lambda a, b: a > b)
+        elif op == "$gte": ok = _cmp(value, arg, lambda a, b: a >= b)
+        elif op == "$lt": ok = _cmp(value, arg, lambda a, b: a < b)
+        elif op == "$lte": ok = _cmp(value, arg, lambda a, b: a <= b)
+        elif op == "$in": ok = any(_eq(value, a) for a in arg)
+        elif op == "$nin": ok = not any(_eq(value, a) for a in arg)
+        elif op == "$exists": ok = (value is not MISSING) == bool(arg)
+        elif op == "$regex":
+            pattern = _regex(arg, cond.get("$options", ""))
+            ok = any(isinstance(v, str) and pattern.search(v) for v in _candidates(value))
+        elif op == "$options": continue
+        elif op == "$not":
+            ok = not (_match_ops(value, arg) if isinstance(arg, dict) else _match_ops(value, {"$regex": arg}))
+        elif op == "$size": ok = isinstance(value, list) and len(value) == arg
+        elif op == "$all": ok = all(_eq(value, a) for a in arg)
+        elif op == "$elemMatch": ok = isinstance(value, list) and any(isinstance(v, dict) and match(v, arg) for v in value)
+        else: raise OperationFailure(f"operador não suportado: {op}")
+        if not ok: return False
+    return True
+
+
+def match(doc, filter):
+    """Avalia um filtro do Mongo sobre um documento."""
+    for key, cond in (filter or {}).items():
+        if key == "$and":
+            if not all(match(doc, f) for f in cond): return False
+        elif key == "$or":
+            if not any(match(doc, f) for f in cond): return False
+        elif key == "$nor":
+            if any(match(doc, f) for f in cond): return False
+        elif isinstance(cond, re.Pattern):
+            if not _match_ops(get_field(doc, key), {"$regex": cond}): return False
+        elif is_ops(cond):
+            if not _match_ops(get_field(doc, key), cond): return False
+        elif not _eq(get_field(doc, key), cond): return False
+    return True
+
+
+def project(doc, projection):
+    """Cópia do documento com a projeção (inclusão ou exclusão) aplicada."""
+    if not projection: return clone(doc)
+    if isinstance(projection, (list, tuple)): projection = dict.fromkeys(projection, 1)
+    include = {k for k, v in projection.items() if v and k != "_id"}
+    if include:
+        out = {}
+        if projection.get("_id", 1) and "_id" in doc: out["_id"] = doc["_id"]
+        for path in include:
+            value = get_field(doc, path)
+            if value is not MISSING: set_field(out, path, clone(value))
+        return out
+    out = clone(doc)
+    for path, v in projection.items():
+        if not v: unset_field(out, path)
+    return out
+
+
+def sort_spec(key, direction=None):
+    """Normaliza "campo", [("campo", 1), ...] ou {"campo": -1} para [(campo, direção)]."""
+    if isinstance(key, str): return [(key, direction or 1)]
+    if isinstance(key, dict): return list(key.items())
+    return list(key or ())
+
+
+def sort_key(fields):
+    def key(doc):
+        out = []
+        for field, direction in fields:
+            v = get_field(doc, field)
+            k = (0,) if v is MISSING or v is None else (1, v)
+            out.append(_Reverse(k) if direction < 0 else k)
+        return out
+    return key
+
+
+class _Reverse:
+    __slots__ = ("k",)
+    def __init__(self, k): self.k = k
+    def __lt__(self, other): return other.k < self.k
+    def __eq__(self, other): return self.k == other.k
+
+
+def apply_update(doc, update, inserting=False):
+    """Aplica `update` (operadores ou documento de substituição) em `doc`, no lugar."""
+    if not any(k.startswith("$") for k in update):
+        # Documento de substituição (mantém o _id)
+        _id = doc.get("_id"); doc.clear(); doc.update(clone(update))
+        if _id is not None: doc["_id"] = _id
+        return
+    for op, fields in update.items():
+        for path, arg in fields.items():
+            if op == "$set": set_field(doc, path, clone(arg))
+            elif op == "$setOnInsert":
+                if inserting: set_field(doc, path, clone(arg))
+            elif op == "$unset": unset_field(doc, path)
+            elif op == "$inc":
+                current = get_field(doc, path)
+                set_field(doc, path, (0 if current is MISSING else current) + arg)
+            elif op in ("$addToSet", "$push"):
+                current = get_field(doc, path)
+                if current is MISSING: current = []; set_field(doc, path, current)
+                items = arg["$each"] if isinstance(arg, dict) and "$each" in arg else [arg]
+                for item in items:
+                    if op == "$push" or item not in current: current.append(clone(item))
+            elif op == "$pull":
+                current = get_field(doc, path)
+                if isinstance(current, list):
+                    current[:] = [v for v in current if not (match(v, arg) if isinstance(arg, dict) and isinstance(v, dict) else v == arg)]
+            elif op == "$min":
+                current = get_field(doc, path)
+                if current is MISSING or arg < current: set_field(doc, path, arg)
+            elif op == "$max":
+                current = get_field(doc, path)
+                if current is MISSING or arg > current: set_field(doc, path, arg)
+            else: raise OperationFailure(f"operador de atualização não suportado: {op}")
+
+
+def upsert_doc(filter, update):
+    """Documento criado por um upsert: igualdades do filtro + a atualização (com $setOnInsert)."""
+    doc = {}
+    for key, cond in (filter or {}).items():
+        if key.startswith("$"): continue
+        if is_ops(cond):
+            if "$eq" in cond: set_field(doc, key, clone(cond["$eq"]))
+        elif not isinstance(cond, re.Pattern): set_field(doc, key, clone(cond))
+    apply_update(doc, update, inserting=True)
+    return doc
+
+
+def _expr(doc, expr):
+    if isinstance(expr, str) and expr.startswith("$"):
+        v = get_field(doc, expr[1:])
+        return None if v is MISSING else v
+    if isinstance(expr, dict): return {k: _expr(doc, v) for k, v in expr.items()}
+    return expr
+
+
+def _group(docs, spec):
+    groups = {}
+    for d in docs:
+        key = _expr(d, spec["_id"])
+        acc = groups.get(hashable(key))
+        if acc is None: acc = groups[hashable(key)] = {"_id": key}; first = True
+        else: first = False
+        for field, op in spec.items():
+            if field == "_id": continue
+            (name, expr), = op.items()
+            v = _expr(d, expr)
+            if name == "$first":
+                if first: acc[field] = v
+            elif name == "$last": acc[field] = v
+            elif name == "$sum": acc[field] = acc.get(field, 0) + (v or 0)
+            elif name == "$min": acc[field] = v if first or v < acc[field] else acc[field]
+            elif name == "$max": acc[field] = v if first or v > acc[field] else acc[field]
+            elif name == "$push": acc.setdefault(field, []).append(v)
+            else: raise OperationFailure(f"acumulador não suportado: {name}")
+    return list(groups.values())
+
+
+def aggregate(docs, pipeline):
+    """Executa os estágios do pipeline sobre `docs` (não altera os documentos de entrada)."""
+    for stage in pipeline:
+        (op, arg), = stage.items()
+        if op == "$match": docs = [d for d in docs if match(d, arg)]
+        elif op == "$sort": docs = sorted(docs, key=sort_key(sort_spec(arg)))
+        elif op == "$limit": docs = docs[:arg]
+        elif op == "$skip": docs = docs[arg:]
+        elif op == "$project": docs = [project(d, arg) for d in docs]
+        elif op == "$count": docs = [{arg: len(docs)}]
+        elif op == "$group": docs = _group(docs, arg)
+        else: raise OperationFailure(f"estágio não suportado: {op}")
+    return [clone(d) for d in docs]
@@ -0,0 +1,39 @@
+from asyncio import create_task, wait, gather, FIRST_COMPLETED
+from collections import deque
+
+__all__ = ("read_ahead",)
+
+
+async def read_ahead(jobs, window=4, max_bytes=16 * 1024 * 1024):
+    """
+    Executa os jobs em paralelo e entrega os resultados NA ORDEM em que foram gerados.
+
+    `jobs` é um iterável de pares (factory, size): `factory()` devolve a coroutine que
+    busca o bloco e `size` é o tamanho esperado, usado para respeitar `max_bytes`
+    (bytes em voo + bytes prontos ainda não consumidos). No máximo `window` jobs
+    ficam em voo. Ao encerrar o gerador (fim, erro ou cancelamento, ex.: ABOR),
+    todas as buscas pendentes são canceladas.
+    """
+    jobs = iter(jobs)
+    queue = deque()  # (task, size) na ordem de entrega
+    budget = 0; exhausted = False
+    try:
+        while True:
+            while not exhausted and len(queue) < max(1, window) and (not queue or budget < max_bytes):
+                try: factory, size = next(jobs)
+                except StopIteration: exhausted = True; break
+                queue.append((create_task(factory()), size)); budget += size
+            if not queue: return
+            task, size = queue[0]
+            if not task.done():
+                await wait([task], return_when=FIRST_COMPLETED)
+            queue.popleft()
+            data = task.result()
+            budget -= size
+            yield data
+    finally:
+        pending = [t for t, _ in queue if not t.done()]
+        for t in pending: t.cancel()
+        if pending: await gather(*pending, return_exceptions=True)
+        for t, _ in queue:
+            if t.done() and not t.cancelled(): t.exception()  # evita "exception never retrieved"
@@ -1,21 +1,25 @@
 from asyncio import Future, wait_for, gather, TimeoutError, shield, CancelledError, start_server, create_task, wait, Queue, current_task, get_running_loop, FIRST_COMPLETED
 from collections import defaultdict
+from contextvars import ContextVar
+from contextlib import aclosing
 from enum import Enum
 from functools import wraps, partial
 from pathlib import PurePosixPath, Path
 from socket import AF_INET, AF_INET6
 import socket
 from stat import filemode
-from time import strftime, gmtime, time, localtime
+from time import strftime, gmtime, time, localtime, perf_counter
 import logging
 import unicodedata # <--- Importante para normalização de nomes
 
 logger = logging.getLogger("NebulaFTP")
 
 
-from .errors import PathIOError, NoAvailablePort
+from .errors import PathIOError, NoAvailablePort, StagingFullError
 from .pathio import PathIONursery
 from .common import StreamIO, setlocale, wrap_with_container
+from .metrics import FTP_COMMANDS, FTP_COMMAND_LATENCY, FTP_BYTES
+from .tracing import TRACER, current_trace
 
 __all__ = (
     "Permission", "User", "AbstractUserManager", "MongoDBUserManager",
@@ -67,15 +71,15 @@ class MongoDBUserManager(AbstractUserManager):
             if u: user = u[0].update(user)
             else: self.users.append(user)
             if user.login not in self.available_connections:
-                self.available_connections[user] = AvailableConnections(100)
+                self.available_connections[user.login] = AvailableConnections(100)
         if not user: state, info = AbstractUserManager.GetUserResponse.ERROR, "no such username"
-        elif self.available_connections[user].locked(): state, info = AbstractUserManager.GetUserResponse.ERROR, f"too much connections"
+        elif self.available_connections[user.login].locked(): state, info = AbstractUserManager.GetUserResponse.ERROR, f"too much connections"
         else: state, info = AbstractUserManager.GetUserResponse.PASSWORD_REQUIRED, "password required"
-        if state != AbstractUserManager.GetUserResponse.ERROR: self.available_connections[user].acquire()
+        if state != AbstractUserManager.GetUserResponse.ERROR: self.available_connections[user.login].acquire()
         return state, user, info
     async def authenticate(self, user, password): return user.password == password
     async def notify_logout(self, user):
-        if user in self.available_connections: self.available_connections[user].release()
+        if user.login in self.available_connections: self.available_connections[user.login].release()
 
 class Connection(defaultdict):
     __slots__ = ("future",)
@@ -141,9 +145,10 @@ class PathConditions:
         @wraps(f)
         async def wrapper(cls, connection, rest, *args):
             real_path, virtual_path = cls.get_paths(connection, rest)
-            for name, fail, message in self.conditions:
-                if await getattr(connection.path_io, name)(real_path) == fail:
-                    connection.response("550", message); return True
+            with TRACER.span("path_conditions"):
+                for name, fail, message in self.conditions:
+                    if await getattr(connection.path_io, name)(real_path) == fail:
+                        connection.response("550", message); return True
             return await f(cls, connection, rest, *args)
         return wrapper
 
@@ -160,11 +165,34 @@ class PathPermissions:
             return await f(cls, connection, rest, *args)
         return wrapper
 
+class CountedStream:
+    """Repassa iter_by_block da conexão de dados contando os bytes recebidos."""
+    def __init__(self, stream, labels): self.stream = stream; self.labels = labels
+    async def iter_by_block(self, block_size):
+        async for data in self.stream.iter_by_block(block_size):
+            FTP_BYTES.inc(len(data), self.labels); yield data
+
+# Comando em execução (nome, início) visto pelos workers que ele cria
+_command = ContextVar("ftp_command", default=None)
+
+def record_command(cmd, status, start):
+    FTP_COMMANDS.inc(1, (cmd, status)); FTP_COMMAND_LATENCY.observe(perf_counter() - start, (cmd,))
+
 def worker(f):
+    async def run(command, cls, connection, rest):
+        status = "ok"
+        try:
+            with TRACER.command(f.__name__, connection.trace_tid): await f(cls, connection, rest)
+        except CancelledError: status = "error"; connection.response("426", "transfer aborted"); connection.response("226", "abort successful")
+        except BaseException: status = "error"; raise
+        finally:
+            if command is not None: record_command(command["cmd"], status, command["start"])
     @wraps(f)
-    async def wrapper(cls, connection, rest):
-        try: await f(cls, connection, rest)
-        except CancelledError: connection.response("426", "transfer aborted"); connection.response("226", "abort successful")
+    def wrapper(cls, connection, rest):
+        # Criado pelo comando (STOR/RETR/LIST/MLSD): latência e status passam a contar até o fim da transferência
+        command = _command.get()
+        if command is not None: command["deferred"] = True
+        return run(command, cls, connection, rest)
     return wrapper
 
 class Server:
@@ -249,8 +277,11 @@ class Server:
 
     async def response_writer(self, stream, queue):
         while True:
-            args = await queue.get()
-            try: await self.write_response(stream, *args)
+            trace, queued, args = await queue.get()
+            try:
+                start = perf_counter()
+                await self.write_response(stream, *args)
+                if trace is not None: TRACER.add(trace, f"response {args[0]}", "response", queued, perf_counter(), {"queued_ms": round((start - queued) * 1000, 3)})
             finally: queue.task_done()
 
     async def dispatcher(self, reader, writer):
@@ -264,9 +295,10 @@ class Server:
             command_connection=stream,
             path_io_factory=self.path_io_factory,
             extra_workers=set(),
-            response=lambda *args: queue.put_nowait(args),
-            acquired=False, restart_offset=0, _dispatcher=current_task()
+            response=lambda *args: queue.put_nowait((current_trace(), perf_counter(), args)),
+            acquired=False, restart_offset=0, _dispatcher=current_task(), trace_tid=port or 0
         )
+        TRACER.name_thread(port or 0, f"{host}:{port}")
         conn.path_io = self.path_io_factory(connection=conn)
         pending = {create_task(self.greeting(conn, "")), create_task(self.response_writer(stream, queue)), create_task(self.parse_command(stream))}
         self.connections[key] = conn
@@ -290,7 +322,7 @@ class Server:
                         cmd, rest = res
                         f = self.commands_mapping.get(cmd)
                         if f:
-                            pending.add(create_task(f(conn, rest)))
+                            pending.add(create_task(self.timed(cmd, f(conn, rest), conn.trace_tid, rest)))
                             if cmd not in ("retr", "stor", "appe"): conn.restart_offset = 0
                         else: conn.response("502", "not implemented")
         except CancelledError: raise
@@ -309,6 +341,20 @@ class Server:
             if key in self.connections: self.connections.pop(key)
             if tasks: await wait(tasks)
 
+    @staticmethod
+    async def timed(cmd, coro, tid=0, rest=""):
+        """Executa o comando registrando contagem e latência (métricas) e o trace."""
+        start = perf_counter(); status = "ok"
+        command = {"cmd": cmd, "start": start, "deferred": False}; token = _command.set(command)
+        try:
+            # A senha do PASS não vai para o trace
+            with TRACER.command(cmd, tid, {"arg": rest} if rest and cmd != "pass" else None): return await coro
+        except BaseException: status = "error"; raise
+        finally:
+            _command.reset(token)
+            # Se o comando criou um worker, quem registra é o worker, no fim da transferência
+            if not command["deferred"]: record_command(cmd, status, start)
+
     @staticmethod
     def get_paths(connection, path):
         virtual = PurePosixPath(path)
@@ -375,21 +421,24 @@ class Server:
     @PathConditions(PathConditions.path_must_exists)
     @PathPermissions(PathPermissions.readable)
     async def list(self, conn, rest):
-        @ConnectionConditions(ConnectionConditions.data_connection_made, wait=True, fail_code="425")
         @worker
+        @ConnectionConditions(ConnectionConditions.data_connection_made, wait=True, fail_code="425")
         async def list_worker(self, conn, rest):
             stream = conn.data_connection; del conn.data_connection
             async with stream:
-                async for path in conn.path_io.list(real):
-                    s = await self.build_list_string(conn, path)
-                    await stream.write((s + "\r\n").encode("utf-8"))
+                buf = bytearray()
+                async for path, stats in conn.path_io.scandir(real):
+                    s = await self.build_list_string(conn, path, stats)
+                    buf += (s + "\r\n").encode("utf-8")
+                    if len(buf) >= 65536: await stream.write(bytes(buf)); buf.clear()
+                if buf: await stream.write(bytes(buf))
             conn.response("226", "done"); return True
         real, virt = self.get_paths(conn, rest)
         t = create_task(list_worker(self, conn, rest)); conn.extra_workers.add(t)
         conn.response("150", "listing"); return True
 
-    async def build_list_string(self, conn, path):
-        stats = await conn.path_io.stat(path)
+    async def build_list_string(self, conn, path, stats=None):
+        if stats is None: stats = await conn.path_io.stat(path)
         mtime = localtime(stats.st_mtime)
         with setlocale("C"):
             s = strftime("%b %e %H:%M", mtime) if time() - 15778476 < stats.st_mtime <= time() else strftime("%b %e  %Y", mtime)
@@ -399,22 +448,25 @@ class Server:
     @PathConditions(PathConditions.path_must_exists)
     @PathPermissions(PathPermissions.readable)
     async def mlsd(self, conn, rest):
-        @ConnectionConditions(ConnectionConditions.data_connection_made, wait=True, fail_code="425")
         @worker
+        @ConnectionConditions(ConnectionConditions.data_connection_made, wait=True, fail_code="425")
         async def mlsd_worker(self, conn, rest):
             stream = conn.data_connection; del conn.data_connection
             async with stream:
-                async for path in conn.path_io.list(real):
-                    s = await self.build_mlsd_string(conn, path)
-                    await stream.write((s + "\r\n").encode("utf-8"))
+                buf = bytearray()
+                async for path, stats in conn.path_io.scandir(real):
+                    s = await self.build_mlsd_string(conn, path, stats)
+                    buf += (s + "\r\n").encode("utf-8")
+                    if len(buf) >= 65536: await stream.write(bytes(buf)); buf.clear()
+                if buf: await stream.write(bytes(buf))
             conn.response("226", "done"); return True
             
         real, virt = self.get_paths(conn, rest)
         t = create_task(mlsd_worker(self, conn, rest)); conn.extra_workers.add(t)
         conn.response("150", "listing"); return True
 
-    async def build_mlsd_string(self, conn, path):
-        stats = await conn.path_io.stat(path)
+    async def build_mlsd_string(self, conn, path, stats=None):
+        if stats is None: stats = await conn.path_io.stat(path)
         t = gmtime(stats.st_mtime)
         modify = strftime("%Y%m%d%H%M%S", t)
         type_ = "dir" if (stats.st_mode & 0o40000) else "file"
@@ -436,17 +488,23 @@ class Server:
     @ConnectionConditions(ConnectionConditions.login_required, ConnectionConditions.passive_server_started)
     @PathPermissions(PathPermissions.writable)
     async def stor(self, conn, rest, mode="wb"):
-        @ConnectionConditions(ConnectionConditions.data_connection_made, wait=True, fail_code="425")
         @worker
+        @ConnectionConditions(ConnectionConditions.data_connection_made, wait=True, fail_code="425")
         async def stor_worker(self, conn, rest):
             stream = conn.data_connection; del conn.data_connection
             mode_ = "r+b" if conn.restart_offset else mode
             file_out = await conn.path_io.open(real, mode=mode_)
-            async with file_out, stream:
-                if conn.restart_offset: await file_out.seek(conn.restart_offset)
-                await file_out.write_stream(stream)
+            try:
+                async with file_out, stream:
+                    if conn.restart_offset: await file_out.seek(conn.restart_offset)
+                    await file_out.write_stream(CountedStream(stream, (conn.user.login, "in")))
+            except StagingFullError:
+                conn.response("452", "insufficient storage space"); return True
             conn.response("226", "transfer complete"); return True
         real, virt = self.get_paths(conn, rest)
+        staging = getattr(conn.path_io, "staging", None)
+        if staging is not None and not staging.admit():
+            conn.response("452", "insufficient storage space"); return True
         if await conn.path_io.is_dir(real.parent):
             t = create_task(stor_worker(self, conn, rest)); conn.extra_workers.add(t)
             conn.response("150", "upload starting")
@@ -457,15 +515,18 @@ class Server:
     @PathConditions(PathConditions.path_must_exists, PathConditions.path_must_be_file)
     @PathPermissions(PathPermissions.readable)
     async def retr(self, conn, rest):
-        @ConnectionConditions(ConnectionConditions.data_connection_made, wait=True, fail_code="425")
         @worker
+        @ConnectionConditions(ConnectionConditions.data_connection_made, wait=True, fail_code="425")
         async def retr_worker(self, conn, rest):
             stream = conn.data_connection; del conn.data_connection
             file_in = await conn.path_io.open(real, mode="rb")
             async with file_in, stream:
                 if conn.restart_offset: await file_in.seek(conn.restart_offset)
-                async for data in file_in.iter_by_block(1024 * 512):
-                    await stream.write(data)
+                labels = (conn.user.login, "out")
+                async with aclosing(file_in.iter_by_block(1024 * 512)) as blocks:
+                    async for data in blocks:
+                        await stream.write(data)
+                        FTP_BYTES.inc(len(data), labels)
             conn.response("226", "transfer complete"); return True
         real, virt = self.get_paths(conn, rest)
         t = create_task(retr_worker(self, conn, rest)); conn.extra_workers.add(t)
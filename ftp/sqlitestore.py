@@ -0,0 +1,645 @@
+"""
+Banco de metadados embutido: SQLite (WAL) com a interface do motor usada pelo NebulaFTP.
+
+Para instalações de um nó só, sem a ida e volta de rede (e o w="majority") a cada
+get_node, listagem ou rename. Server, MongoDBPathIO, UPLOAD_QUEUE, BlobIndex,
+folder_watcher e upload_worker recebem um SQLiteDatabase no lugar do banco do
+motor e fazem as mesmas chamadas (find/find_one, insert_*, update_*, delete_*,
+find_one_and_*, bulk_write, aggregate, count_documents, create_index).
+
+Armazenamento: uma tabela por coleção com o documento em JSON e uma coluna por
+campo indexado (create_index cria a coluna e o índice SQL; unique vira UNIQUE e
+levanta DuplicateKeyError como o Mongo). Os filtros viram um WHERE sobre essas
+colunas (igualdade, $in, faixas e regex com prefixo fixo, como "^/pasta/") que
+pré-seleciona as linhas; o filtro completo é avaliado em ftp.query. Um campo
+indexado que recebe array ou subdocumento deixa de ser usado no WHERE (como o
+índice multikey do Mongo), sem perder resultados.
+
+O SQL é fixo por formato de consulta, então as sentenças preparadas ficam no
+cache da conexão. Todo acesso passa por uma única thread (a conexão não bloqueia
+o event loop) e as escritas são confirmadas em grupo: cada uma espera o COMMIT
+do lote, feito até SQLITE_COMMIT_MS depois da primeira ou ao juntar
+SQLITE_COMMIT_BATCH escritas.
+
+SQLiteStore é a versão síncrona (estilo pymongo), usada pelo accounts_manager.
+"""
+from asyncio import get_running_loop
+from base64 import b64encode, b64decode
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import logging
+import os
+import sqlite3
+
+from bson import ObjectId
+from pymongo import ReturnDocument, InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+
+from .query import MISSING, clone, get_field, is_ops, match, project, sort_spec, sort_key, apply_update, upsert_doc, aggregate
+
+logger = logging.getLogger("NebulaFTP")
+
+__all__ = ("SQLiteStore", "SQLiteDatabase")
+
+# Janela (ms) e tamanho máximo do lote de escritas confirmado por um único COMMIT
+SQLITE_COMMIT_MS = float(os.environ.get("SQLITE_COMMIT_MS", 2))
+SQLITE_COMMIT_BATCH = int(os.environ.get("SQLITE_COMMIT_BATCH", 256))
+# NORMAL: no WAL, um crash do processo não perde nada; queda de energia pode perder os últimos commits
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+
+# Documentos lidos por vez pelos cursores sem sort (paginação por rowid)
+BATCH_SIZE = 1000
+# Valores de um $in acima disso não entram no WHERE (limite de parâmetros do SQLite)
+MAX_IN = 900
+# Valor de campo indexado que não cabe numa coluna (array/subdocumento)
+_MULTI = object()
+_REGEX_META = frozenset(".^$*+?{}[]\\|()")
+
+
+def _default(value):
+    if isinstance(value, ObjectId): return {"$oid": str(value)}
+    if isinstance(value, datetime): return {"$date": value.isoformat()}
+    if isinstance(value, (bytes, bytearray)): return {"$bytes": b64encode(value).decode()}
+    raise TypeError(f"tipo não serializável: {type(value).__name__}")
+
+
+def _hook(d):
+    if len(d) == 1:
+        key = next(iter(d))
+        if key == "$oid": return ObjectId(d[key])
+        if key == "$date": return datetime.fromisoformat(d[key])
+        if key == "$bytes": return b64decode(d[key])
+    return d
+
+
+def _encode(doc): return json.dumps(doc, default=_default, ensure_ascii=False, separators=(",", ":"))
+def _decode(text): return json.loads(text, object_hook=_hook)
+
+
+def _id_key(value):
+    """Chave primária textual do _id (o tipo entra na chave: ObjectId("..") != "..")."""
+    if isinstance(value, ObjectId): return "o" + str(value)
+    if isinstance(value, str): return "s" + value
+    if isinstance(value, int) and not isinstance(value, bool): return f"i{value}"
+    return "j" + _encode(value)
+
+
+def _scalar(value):
+    """Valor de coluna: None para ausente/null, _MULTI para array/subdocumento."""
+    if value is MISSING or value is None: return None
+    if isinstance(value, (str, int, float)): return value
+    if isinstance(value, ObjectId): return str(value)
+    if isinstance(value, datetime): return value.isoformat()
+    return _MULTI
+
+
+def _column_value(doc, field):
+    cur = doc
+    for key in field.split("."):
+        if isinstance(cur, list): return _MULTI  # caminho que atravessa array: multikey
+        if not isinstance(cur, dict) or key not in cur: return None
+        cur = cur[key]
+    return _scalar(cur)
+
+
+def _regex_prefix(pattern, options=""):
+    """Prefixo literal de um regex ancorado ("^/a/b/" -> "/a/b/"); "" se não houver."""
+    if not isinstance(pattern, str) or not pattern.startswith("^") or "|" in pattern or options: return ""
+    out = []; i = 1
+    while i < len(pattern):
+        c = pattern[i]; step = 1
+        if c == "\\":
+            if i + 1 < len(pattern) and not pattern[i + 1].isalnum(): c = pattern[i + 1]; step = 2
+            else: break
+        elif c in _REGEX_META: break
+        following = pattern[i + step:i + step + 1]
+        if following and following in "*?{": break  # caractere opcional
+        out.append(c)
+        if following == "+": break
+        i += step
+    return "".join(out)
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _duplicate(collection, error):
+    return DuplicateKeyError(f"E11000 duplicate key error collection: {collection} ({error})", 11000)
+
+
+class SQLiteCollection:
+    """Coleção síncrona sobre uma tabela (chamada sempre da mesma thread)."""
+
+    def __init__(self, store, name):
+        self.store = store; self.name = name
+        self.conn = store.conn
+        self.table = _quote("c_" + name)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (rowid INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, doc TEXT NOT NULL)")
+        self.indexes = {}; self.columns = []; self.multikey = set()
+        for name_, fields, unique, sparse in self.conn.execute("SELECT name, fields, is_unique, sparse FROM _indexes WHERE collection = ?", (name,)):
+            self.indexes[name_] = (tuple(json.loads(fields)), bool(unique), bool(sparse))
+        self.columns = [row[1][2:] for row in self.conn.execute(f"PRAGMA table_info({self.table})") if row[1].startswith("k.")]
+        self.multikey = {row[0] for row in self.conn.execute("SELECT field FROM _multikey WHERE collection = ?", (name,))}
+        self._statements()
+
+    def _statements(self):
+        cols = "".join(f", {_quote('k.' + c)}" for c in self.columns)
+        marks = ", ?" * len(self.columns)
+        self._insert_sql = f"INSERT INTO {self.table} (id, doc{cols}) VALUES (?, ?{marks})"
+        sets = "".join(f", {_quote('k.' + c)} = ?" for c in self.columns)
+        self._update_sql = f"UPDATE {self.table} SET doc = ?{sets} WHERE id = ?"
+
+    # --- índices -------------------------------------------------------------
+
+    def _values(self, doc):
+        out = []
+        for field in self.columns:
+            v = _column_value(doc, field)
+            if v is _MULTI:
+                if field not in self.multikey:
+                    self.multikey.add(field)
+                    self.conn.execute("INSERT OR IGNORE INTO _multikey (collection, field) VALUES (?, ?)", (self.name, field))
+                    logger.info(f"🗃️ [SQLITE] {self.name}.{field} recebeu array/subdocumento: consultas nele passam a filtrar em memória")
+                v = None
+            out.append(v)
+        return out
+
+    def create_index(self, keys, unique=False, sparse=False, name=None, **kwargs):
+        spec = sort_spec(keys)
+        fields = tuple(f for f, _ in spec)
+        name = name or "_".join(f"{f}_{d}" for f, d in spec)
+        if name in self.indexes: return name
+        new = [f for f in fields if f not in self.columns]
+        for field in new:
+            self.conn.execute(f"ALTER TABLE {self.table} ADD COLUMN {_quote('k.' + field)}")
+            self.columns.append(field)
+        if new:
+            self._statements()
+            rows = self.conn.execute(f"SELECT rowid, doc FROM {self.table}").fetchall()
+            sets = ", ".join(f"{_quote('k.' + f)} = ?" for f in new)
+            for rowid, text in rows:
+                doc = _decode(text)
+                values = self._values(doc)
+                self.conn.execute(f"UPDATE {self.table} SET {sets} WHERE rowid = ?", [values[self.columns.index(f)] for f in new] + [rowid])
+        cols = ", ".join(_quote("k." + f) for f in fields)
+        where = " WHERE " + " OR ".join(f"{_quote('k.' + f)} IS NOT NULL" for f in fields) if sparse else ""
+        try:
+            self.conn.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {_quote(self.name + '.' + name)} ON {self.table} ({cols}){where}")
+        except sqlite3.IntegrityError as e: raise _duplicate(self.name, e)
+        self.conn.execute("INSERT OR REPLACE INTO _indexes (collection, name, fields, is_unique, sparse) VALUES (?, ?, ?, ?, ?)", (self.name, name, json.dumps(fields), int(unique), int(sparse)))
+        self.indexes[name] = (fields, unique, sparse)
+        self.store.written()
+        return name
+
+    def drop(self):
+        self.conn.execute(f"DELETE FROM {self.table}")
+        self.store.written()
+
+    # --- consulta ------------------------------------------------------------
+
+    def _field_sql(self, field, cond, out, params):
+        if field == "_id": column, value_of = "id", _id_key
+        elif field in self.columns and field not in self.multikey: column, value_of = _quote("k." + field), _scalar
+        else: return
+        ops = cond if is_ops(cond) else {"$eq": cond}
+        for op, arg in ops.items():
+            if op == "$eq":
+                v = value_of(arg) if arg is not None else None
+                if v is not None and v is not _MULTI: out.append(f"{column} = ?"); params.append(v)
+            elif op == "$in":
+                values = [value_of(a) for a in arg] if len(arg) <= MAX_IN and None not in arg else None
+                if values is None or _MULTI in values: continue
+                if not values: out.append("0"); continue
+                out.append(f"{column} IN ({', '.join('?' * len(values))})"); params.extend(values)
+            elif op in ("$gt", "$gte", "$lt", "$lte") and column != "id":
+                v = _scalar(arg)
+                if v is None or v is _MULTI or isinstance(arg, bool): continue
+                out.append(f"{column} {'>' if op[1] == 'g' else '<'}{'=' if op.endswith('e') else ''} ?"); params.append(v)
+            elif op == "$regex" and column != "id":
+                prefix = _regex_prefix(arg, ops.get("$options", ""))
+                if not prefix: continue
+                out.append(f"{column} >= ?"); params.append(prefix)
+                if ord(prefix[-1]) < 0x10FFFF:
+                    out.append(f"{column} < ?"); params.append(prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+    def _where(self, filter, params):
+        """WHERE que pré-seleciona (superconjunto de) os documentos do filtro."""
+        out = []
+        for key, cond in (filter or {}).items():
+            if key == "$and":
+                for sub in cond:
+                    clause = self._where(sub, params)
+                    if clause != "1": out.append(clause)
+            elif key == "$or":
+                branch_params = []; branches = []
+                for sub in cond:
+                    clause = self._where(sub, branch_params)
+                    if clause == "1": branches = None; break
+                    branches.append(clause)
+                if branches: out.append("(" + " OR ".join(branches) + ")"); params.extend(branch_params)
+            elif not key.startswith("$"): self._field_sql(key, cond, out, params)
+        return " AND ".join(out) if out else "1"
+
+    def scan(self, filter, limit=0):
+        """Documentos que casam com o filtro (até `limit`, 0 = todos)."""
+        out = []
+        params = []
+        where = self._where(filter, params)
+        cur = self.conn.execute(f"SELECT doc FROM {self.table} WHERE {where}", params)
+        try:
+            for text, in cur:
+                doc = _decode(text)
+                if match(doc, filter):
+                    out.append(doc)
+                    if limit and len(out) >= limit: break
+        finally: cur.close()
+        return out
+
+    def page(self, filter, after, count, projection=None):
+        """Próximos `count` documentos depois do rowid `after`: (docs, último rowid, fim)."""
+        out = []; last = after
+        params = []
+        where = self._where(filter, params)
+        cur = self.conn.execute(f"SELECT rowid, doc FROM {self.table} WHERE rowid > ? AND {where} ORDER BY rowid", [after] + params)
+        try:
+            for rowid, text in cur:
+                last = rowid
+                doc = _decode(text)
+                if match(doc, filter):
+                    out.append(project(doc, projection) if projection else doc)
+                    if len(out) >= count: return out, last, False
+        finally: cur.close()
+        return out, last, True
+
+    def _first(self, filter, sort=None):
+        if not sort:
+            docs = self.scan(filter, 1)
+            return docs[0] if docs else None
+        docs = self.scan(filter)
+        return min(docs, key=sort_key(sort_spec(sort))) if docs else None
+
+    def find(self, filter=None, projection=None, sort=None, skip=0, limit=0, **kwargs):
+        docs = self.scan(filter)
+        if sort: docs.sort(key=sort_key(sort_spec(sort)))
+        if skip: docs = docs[skip:]
+        if limit: docs = docs[:limit]
+        return [project(d, projection) for d in docs] if projection else docs
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict): filter = {"_id": filter}
+        doc = self._first(filter, sort)
+        return project(doc, projection) if doc is not None and projection else doc
+
+    def count_documents(self, filter, **kwargs):
+        if not filter: return self.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        return len(self.scan(filter))
+
+    def estimated_document_count(self, **kwargs):
+        return self.count_documents({})
+
+    def distinct(self, key, filter=None, **kwargs):
+        out = []
+        for d in self.scan(filter):
+            value = get_field(d, key)
+            for v in value if isinstance(value, list) else [value]:
+                if v is not MISSING and v not in out: out.append(v)
+        return out
+
+    def aggregate(self, pipeline, **kwargs):
+        pipeline = list(pipeline)
+        # $match inicial usa o WHERE; o resto do pipeline roda em memória
+        if pipeline and "$match" in pipeline[0]: docs = self.scan(pipeline.pop(0)["$match"])
+        else: docs = self.scan({})
+        return aggregate(docs, pipeline)
+
+    # --- escrita -------------------------------------------------------------
+
+    def _insert(self, doc):
+        if "_id" not in doc: doc["_id"] = ObjectId()
+        try: self.conn.execute(self._insert_sql, [_id_key(doc["_id"]), _encode(doc)] + self._values(doc))
+        except sqlite3.IntegrityError as e: raise _duplicate(self.name, e)
+        return doc
+
+    def _replace(self, old, new):
+        if new == old: return False
+        try: self.conn.execute(self._update_sql, [_encode(new)] + self._values(new) + [_id_key(old["_id"])])
+        except sqlite3.IntegrityError as e: raise _duplicate(self.name, e)
+        return True
+
+    def _delete_doc(self, doc):
+        self.conn.execute(f"DELETE FROM {self.table} WHERE id = ?", (_id_key(doc["_id"]),))
+
+    def _upsert(self, filter, update):
+        doc = upsert_doc(filter, update)
+        if "_id" not in doc and "_id" in (filter or {}) and not is_ops(filter["_id"]): doc["_id"] = filter["_id"]
+        return self._insert(doc)
+
+    def _update(self, filter, update, upsert=False, many=False):
+        docs = self.scan(filter, 0 if many else 1)
+        if not docs:
+            if not upsert: return {"n": 0, "nModified": 0, "updatedExisting": False}
+            doc = self._upsert(filter, update)
+            return {"n": 1, "nModified": 0, "upserted": doc["_id"], "updatedExisting": False}
+        modified = 0
+        for doc in docs:
+            new = clone(doc); apply_update(new, update)
+            modified += self._replace(doc, new)
+        return {"n": len(docs), "nModified": modified, "updatedExisting": True}
+
+    def _delete(self, filter, many=False):
+        docs = self.scan(filter, 0 if many else 1)
+        for doc in docs: self._delete_doc(doc)
+        return len(docs)
+
+    def insert_one(self, document, **kwargs):
+        doc = self._insert(document); self.store.written()
+        return InsertOneResult(doc["_id"], True)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        ids = []; errors = []
+        for i, document in enumerate(documents):
+            try: ids.append(self._insert(document)["_id"])
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e), "op": document})
+                if ordered: break
+        self.store.written()
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [], "nInserted": len(ids), "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []})
+        return InsertManyResult(ids, True)
+
+    def update_one(self, filter, update, upsert=False, **kwargs):
+        try: return UpdateResult(self._update(filter, update, upsert), True)
+        finally: self.store.written()
+
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        try: return UpdateResult(self._update(filter, update, upsert, many=True), True)
+        finally: self.store.written()
+
+    def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        return self.update_one(filter, replacement, upsert)
+
+    def delete_one(self, filter, **kwargs):
+        try: return DeleteResult({"n": self._delete(filter)}, True)
+        finally: self.store.written()
+
+    def delete_many(self, filter, **kwargs):
+        try: return DeleteResult({"n": self._delete(filter, many=True)}, True)
+        finally: self.store.written()
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False, return_document=ReturnDocument.BEFORE, **kwargs):
+        try:
+            doc = self._first(filter, sort)
+            if doc is None:
+                if not upsert: return None
+                doc = self._upsert(filter, update)
+                return project(doc, projection) if return_document == ReturnDocument.AFTER else None
+            new = clone(doc); apply_update(new, update)
+            self._replace(doc, new)
+            result = new if return_document == ReturnDocument.AFTER else doc
+            return project(result, projection) if projection else result
+        finally: self.store.written()
+
+    def find_one_and_replace(self, filter, replacement, projection=None, sort=None, upsert=False, return_document=ReturnDocument.BEFORE, **kwargs):
+        return self.find_one_and_update(filter, replacement, projection, sort, upsert, return_document)
+
+    def find_one_and_delete(self, filter, projection=None, sort=None, **kwargs):
+        try:
+            doc = self._first(filter, sort)
+            if doc is None: return None
+            self._delete_doc(doc)
+            return project(doc, projection) if projection else doc
+        finally: self.store.written()
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        try:
+            for i, op in enumerate(requests):
+                try:
+                    if isinstance(op, InsertOne): self._insert(op._doc); result["nInserted"] += 1
+                    elif isinstance(op, (UpdateOne, UpdateMany, ReplaceOne)):
+                        raw = self._update(op._filter, op._doc, op._upsert, many=isinstance(op, UpdateMany))
+                        if "upserted" in raw: result["nUpserted"] += 1; result["upserted"].append({"index": i, "_id": raw["upserted"]})
+                        else: result["nMatched"] += raw["n"]; result["nModified"] += raw["nModified"]
+                    elif isinstance(op, (DeleteOne, DeleteMany)): result["nRemoved"] += self._delete(op._filter, many=isinstance(op, DeleteMany))
+                    else: raise OperationFailure(f"operação não suportada: {op!r}")
+                except DuplicateKeyError as e:
+                    result["writeErrors"].append({"index": i, "code": 11000, "errmsg": str(e), "op": op})
+                    if ordered: break
+        finally: self.store.written()
+        if result["writeErrors"]: raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+
+class SQLiteStore:
+    """
+    Conexão SQLite com coleções estilo pymongo (store.users, store["files"]).
+
+    `autocommit=False` deixa as escritas na transação aberta até commit() (o
+    SQLiteDatabase confirma em lote); com True cada escrita é confirmada na hora.
+    """
+
+    def __init__(self, path, synchronous=SQLITE_SYNCHRONOUS, autocommit=True):
+        folder = os.path.dirname(path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        self.path = path; self.autocommit = autocommit
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, cached_statements=512)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={synchronous}")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS _indexes (collection TEXT, name TEXT, fields TEXT, is_unique INTEGER, sparse INTEGER, PRIMARY KEY (collection, name))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS _multikey (collection TEXT, field TEXT, PRIMARY KEY (collection, field))")
+        self._collections = {}
+
+    def __getitem__(self, name):
+        coll = self._collections.get(name)
+        if coll is None: coll = self._collections[name] = SQLiteCollection(self, name)
+        return coll
+
+    def __getattr__(self, name):
+        if name.startswith("_"): raise AttributeError(name)
+        return self[name]
+
+    def begin(self):
+        if not self.conn.in_transaction: self.conn.execute("BEGIN IMMEDIATE")
+
+    def written(self):
+        if self.autocommit: self.commit()
+
+    def commit(self):
+        if not self.conn.in_transaction: return
+        try: self.conn.execute("COMMIT")
+        except Exception:
+            if self.conn.in_transaction: self.conn.execute("ROLLBACK")
+            raise
+
+    def list_collection_names(self):
+        return [row[0][2:] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'c\\_%' ESCAPE '\\'")]
+
+    def close(self):
+        self.commit(); self.conn.close()
+
+
+class SQLiteCursor:
+    """Cursor assíncrono: sem sort busca em lotes (por rowid); com sort ordena o resultado inteiro."""
+
+    def __init__(self, collection, filter=None, projection=None, sort=None, skip=0, limit=0, loader=None):
+        self._collection = collection; self._filter = filter; self._projection = projection
+        self._sort = sort_spec(sort) if sort else None; self._skip = skip; self._limit = limit
+        self._loader = loader  # resultado pronto (aggregate)
+        self._batch = BATCH_SIZE
+        self._buffer = []; self._after = 0; self._done = False; self._returned = 0
+
+    def sort(self, key, direction=None): self._sort = sort_spec(key, direction); return self
+    def skip(self, n): self._skip = n; return self
+    def limit(self, n): self._limit = n; return self
+    def batch_size(self, n): self._batch = max(1, n); return self
+
+    async def _fill(self):
+        coll = self._collection
+        if self._loader is not None:
+            self._buffer = await coll._database._run(self._loader); self._done = True
+        elif self._sort or self._skip:
+            self._buffer = await coll._database._run(lambda: coll._sync().find(self._filter, self._projection, self._sort, self._skip, self._limit))
+            self._done = True
+        else:
+            docs, self._after, self._done = await coll._database._run(lambda: coll._sync().page(self._filter, self._after, self._batch, self._projection))
+            self._buffer = docs
+        self._buffer.reverse()
+
+    async def __anext__(self):
+        if self._limit and self._returned >= self._limit: raise StopAsyncIteration
+        while not self._buffer:
+            if self._done: raise StopAsyncIteration
+            await self._fill()
+        self._returned += 1
+        return self._buffer.pop()
+
+    def __aiter__(self): return self
+
+    async def to_list(self, length=None):
+        out = []
+        async for doc in self:
+            out.append(doc)
+            if length and len(out) >= length: break
+        return out
+
+
+class AsyncSQLiteCollection:
+    """Coleção com a interface assíncrona do motor; cada chamada roda na thread do banco."""
+
+    def __init__(self, database, name):
+        self._database = database; self.name = name
+
+    def _sync(self):
+        return self._database._store[self.name]
+
+    def _read(self, method, *args, **kwargs):
+        return self._database._run(lambda: getattr(self._sync(), method)(*args, **kwargs))
+
+    def _write(self, method, *args, **kwargs):
+        return self._database._write(lambda: getattr(self._sync(), method)(*args, **kwargs))
+
+    def find(self, filter=None, projection=None, sort=None, skip=0, limit=0, **kwargs):
+        return SQLiteCursor(self, filter, projection, sort, skip, limit)
+
+    def aggregate(self, pipeline, **kwargs):
+        return SQLiteCursor(self, loader=lambda: self._sync().aggregate(pipeline))
+
+    async def find_one(self, *args, **kwargs): return await self._read("find_one", *args, **kwargs)
+    async def count_documents(self, *args, **kwargs): return await self._read("count_documents", *args, **kwargs)
+    async def estimated_document_count(self, **kwargs): return await self._read("estimated_document_count")
+    async def distinct(self, *args, **kwargs): return await self._read("distinct", *args, **kwargs)
+
+    async def insert_one(self, document, **kwargs):
+        # Como o pymongo: o _id é gerado aqui e fica no documento do chamador
+        document.setdefault("_id", ObjectId())
+        return await self._write("insert_one", document)
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        documents = list(documents)
+        for d in documents: d.setdefault("_id", ObjectId())
+        return await self._write("insert_many", documents, ordered)
+
+    async def create_index(self, *args, **kwargs): return await self._write("create_index", *args, **kwargs)
+    async def drop(self): return await self._write("drop")
+    async def update_one(self, *args, **kwargs): return await self._write("update_one", *args, **kwargs)
+    async def update_many(self, *args, **kwargs): return await self._write("update_many", *args, **kwargs)
+    async def replace_one(self, *args, **kwargs): return await self._write("replace_one", *args, **kwargs)
+    async def delete_one(self, *args, **kwargs): return await self._write("delete_one", *args, **kwargs)
+    async def delete_many(self, *args, **kwargs): return await self._write("delete_many", *args, **kwargs)
+    async def find_one_and_update(self, *args, **kwargs): return await self._write("find_one_and_update", *args, **kwargs)
+    async def find_one_and_replace(self, *args, **kwargs): return await self._write("find_one_and_replace", *args, **kwargs)
+    async def find_one_and_delete(self, *args, **kwargs): return await self._write("find_one_and_delete", *args, **kwargs)
+    async def bulk_write(self, *args, **kwargs): return await self._write("bulk_write", *args, **kwargs)
+
+
+class SQLiteDatabase:
+    """Substituto do banco do motor (mongo.files, mongo["users"]) sobre um arquivo SQLite."""
+
+    def __init__(self, path, commit_ms=SQLITE_COMMIT_MS, commit_batch=SQLITE_COMMIT_BATCH, synchronous=SQLITE_SYNCHRONOUS):
+        self.path = path
+        self.commit_delay = commit_ms / 1000; self.commit_batch = commit_batch
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="sqlite")
+        self._store = SQLiteStore(path, synchronous, autocommit=False)
+        self._collections = {}
+        self._waiters = []; self._flush_handle = None
+        self.commits = 0; self.writes = 0
+
+    def __getitem__(self, name):
+        coll = self._collections.get(name)
+        if coll is None: coll = self._collections[name] = AsyncSQLiteCollection(self, name)
+        return coll
+
+    def __getattr__(self, name):
+        if name.startswith("_"): raise AttributeError(name)
+        return self[name]
+
+    def _run(self, fn):
+        return get_running_loop().run_in_executor(self._executor, fn)
+
+    def _begin_and(self, fn):
+        self._store.begin()
+        return fn()
+
+    async def _write(self, fn):
+        """Executa a escrita na transação em aberto e espera o COMMIT do lote."""
+        loop = get_running_loop()
+        error = None
+        try: result = await loop.run_in_executor(self._executor, self._begin_and, fn)
+        except Exception as e: error = e; result = None
+        waiter = loop.create_future()
+        self._waiters.append(waiter); self.writes += 1
+        if len(self._waiters) >= self.commit_batch: self._flush()
+        elif self._flush_handle is None: self._flush_handle = loop.call_later(self.commit_delay, self._flush)
+        await waiter
+        if error is not None: raise error
+        return result
+
+    def _flush(self):
+        if self._flush_handle is not None: self._flush_handle.cancel(); self._flush_handle = None
+        waiters, self._waiters = self._waiters, []
+        if not waiters: return
+        # Executor de uma thread: o COMMIT roda depois de todas as escritas já submetidas
+        self.commits += 1
+        done = get_running_loop().run_in_executor(self._executor, self._store.commit)
+        def notify(f):
+            error = f.exception()
+            for w in waiters:
+                if w.done(): continue
+                if error is not None: w.set_exception(error)
+                else: w.set_result(None)
+        done.add_done_callback(notify)
+
+    async def list_collection_names(self):
+        return await self._run(self._store.list_collection_names)
+
+    def stats(self):
+        return {"path": self.path, "writes": self.writes, "commits": self.commits, "writes_per_commit": round(self.writes / self.commits, 2) if self.commits else 0.0}
+
+    async def close(self):
+        self._flush()
+        await self._run(self._store.close)
+        self._executor.shutdown(wait=False)
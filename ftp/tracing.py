@@ -0,0 +1,266 @@
+from asyncio import get_event_loop, sleep as asleep
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from random import random
+from time import perf_counter, time
+import json
+import os
+import logging
+
+logger = logging.getLogger("NebulaFTP")
+
+__all__ = ("Tracer", "TracedDatabase", "TRACER", "traced", "current_trace")
+
+# Fração dos comandos exportados (0-1) e limiar (ms) do log de comandos lentos; 0 desliga
+TRACE_SAMPLE = float(os.environ.get("TRACE_SAMPLE", 0))
+TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", 0))
+# Eventos mantidos no buffer circular exportado
+TRACE_MAX_EVENTS = int(os.environ.get("TRACE_MAX_EVENTS", 50000))
+
+# Trace do comando em execução na task atual (herdado pelas tasks filhas)
+_current = ContextVar("nebula_trace", default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+class Trace:
+    """Um comando FTP: o span raiz e os spans filhos (path IO, Mongo, ...)."""
+    __slots__ = ("name", "tid", "start", "end", "sampled", "args", "spans", "dropped", "kept")
+
+    def __init__(self, name, tid, sampled, args=None):
+        self.name = name; self.tid = tid; self.sampled = sampled; self.args = args or {}
+        self.start = perf_counter(); self.end = None
+        self.spans = []  # (nome, categoria, início, fim, args)
+        self.dropped = 0; self.kept = False
+
+
+class Tracer:
+    """
+    Tracing por comando no formato Chrome Trace (chrome://tracing, Perfetto).
+
+    Cada comando vira um span raiz na linha (tid) da sua conexão, com spans
+    filhos para as chamadas de path IO e do Mongo feitas dentro dele (o trace
+    atual segue pelo ContextVar, inclusive nas tasks criadas pelo comando).
+
+    - `sample`: fração dos comandos exportados;
+    - `slow_ms`: comandos mais lentos que isso são logados com o resumo dos
+      spans e sempre exportados, mesmo fora da amostra.
+
+    Os eventos ficam num buffer circular (`max_events`), servido em /trace e
+    gravado periodicamente em arquivo. Com os dois desligados nada é registrado.
+    """
+
+    def __init__(self, sample=0.0, slow_ms=0, max_events=50000, max_spans=2000):
+        self.sample = sample; self.slow_ms = slow_ms
+        self.enabled = sample > 0 or slow_ms > 0
+        self.max_spans = max_spans
+        self.events = deque(maxlen=max_events)
+        self.threads = {}  # tid -> nome da linha (conexão)
+        self.pid = os.getpid()
+        self.epoch = time() - perf_counter()
+        self.version = 0; self.traces = 0; self.slow = 0
+
+    def _us(self, t):
+        return int((t + self.epoch) * 1_000_000)
+
+    @contextmanager
+    def command(self, name, tid=0, args=None):
+        """Abre o trace de um comando (ou de um worker, que herda a amostragem do comando)."""
+        if not self.enabled:
+            yield None; return
+        parent = _current.get()
+        sampled = parent.sampled if parent is not None else random() < self.sample
+        if parent is not None: args = dict(args or {}, parent=parent.name)
+        trace = Trace(name, tid, sampled, args)
+        token = _current.set(trace); status = "ok"
+        try: yield trace
+        except BaseException: status = "error"; raise
+        finally:
+            _current.reset(token)
+            self._finish(trace, status)
+
+    @contextmanager
+    def span(self, name, cat="app", **args):
+        trace = _current.get()
+        if trace is None:
+            yield; return
+        start = perf_counter()
+        try: yield
+        finally: self.add(trace, name, cat, start, perf_counter(), args)
+
+    def add(self, trace, name, cat, start, end, args=None):
+        if trace.end is not None:
+            # Span tardio (ex.: resposta escrita depois do fim do comando)
+            if trace.kept: self._emit(trace.tid, name, cat, start, end, args)
+            return
+        if len(trace.spans) >= self.max_spans: trace.dropped += 1; return
+        trace.spans.append((name, cat, start, end, args))
+
+    def name_thread(self, tid, name):
+        if not self.enabled: return
+        self.threads[tid] = name
+        if len(self.threads) > 4096: self.threads.pop(next(iter(self.threads)))
+
+    def _emit(self, tid, name, cat, start, end, args):
+        event = {"name": name, "cat": cat, "ph": "X", "ts": self._us(start), "dur": max(0, int((end - start) * 1_000_000)), "pid": self.pid, "tid": tid}
+        if args: event["args"] = args
+        self.events.append(event); self.version += 1
+
+    def _finish(self, trace, status):
+        trace.end = end = perf_counter()
+        self.traces += 1
+        elapsed = (end - trace.start) * 1000
+        slow = self.slow_ms and elapsed >= self.slow_ms
+        if slow:
+            self.slow += 1
+            logger.warning(f"🐌 [TRACE] {trace.name} lento: {elapsed:.0f} ms ({self.summary(trace)})")
+        if not (trace.sampled or slow): return
+        trace.kept = True
+        args = dict(trace.args, status=status)
+        if trace.dropped: args["dropped_spans"] = trace.dropped
+        self._emit(trace.tid, trace.name, "ftp", trace.start, end, args)
+        for name, cat, start, stop, span_args in trace.spans: self._emit(trace.tid, name, cat, start, stop, span_args)
+        trace.spans = []
+
+    @staticmethod
+    def summary(trace, top=4):
+        """Tempo total e chamadas por nome de span, dos mais caros para os mais baratos."""
+        totals = defaultdict(lambda: [0, 0.0])
+        for name, _, start, end, _ in trace.spans:
+            t = totals[name]; t[0] += 1; t[1] += end - start
+        ranked = sorted(totals.items(), key=lambda kv: -kv[1][1])[:top]
+        return ", ".join(f"{name} {n}x {total * 1000:.0f} ms" for name, (n, total) in ranked) or "sem spans"
+
+    def document(self):
+        meta = [{"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0, "args": {"name": "NebulaFTP"}}]
+        meta += [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}} for tid, name in self.threads.items()]
+        return {"traceEvents": meta + list(self.events), "displayTimeUnit": "ms"}
+
+    async def http(self):
+        """Rota /trace do endpoint de métricas (JSON serializado fora do loop)."""
+        doc = self.document()
+        body = await get_event_loop().run_in_executor(None, json.dumps, doc)
+        return "application/json", body.encode()
+
+    async def dump_forever(self, path, interval=10):
+        """Regrava `path` com os eventos do buffer sempre que houver novos."""
+        dumped = 0
+        while True:
+            await asleep(interval)
+            if self.version == dumped: continue
+            dumped = self.version; doc = self.document()
+            try: await get_event_loop().run_in_executor(None, self._write, path, doc)
+            except Exception as e: logger.warning(f"⚠️ [TRACE] Falha ao gravar {path}: {e}")
+
+    @staticmethod
+    def _write(path, doc):
+        folder = os.path.dirname(path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f: json.dump(doc, f)
+        os.replace(tmp, path)
+
+
+def traced(cat):
+    """Decorator de métodos async: um span "<cat>.<método>" por chamada (só com trace ativo)."""
+    def decorator(f):
+        name = f"{cat}.{f.__name__}"
+        @wraps(f)
+        async def wrapper(*args, **kwargs):
+            trace = _current.get()
+            if trace is None: return await f(*args, **kwargs)
+            start = perf_counter()
+            try: return await f(*args, **kwargs)
+            finally:
+                path = args[1] if len(args) > 1 else None
+                TRACER.add(trace, name, cat, start, perf_counter(), {"path": str(path)} if path is not None else None)
+        return wrapper
+    return decorator
+
+
+class TracedCursor:
+    """Cursor do Mongo que registra um span com o tempo gasto buscando documentos."""
+
+    def __init__(self, cursor, name):
+        self._cursor = cursor; self._name = name
+        self._trace = _current.get()
+        self._start = None; self._busy = 0.0; self._docs = 0
+
+    def __getattr__(self, attr):
+        value = getattr(self._cursor, attr)
+        if attr in ("sort", "limit", "skip", "batch_size", "hint"):
+            def chain(*args, **kwargs): value(*args, **kwargs); return self
+            return chain
+        return value
+
+    async def to_list(self, length=None):
+        if self._trace is None: return await self._cursor.to_list(length)
+        start = perf_counter()
+        try:
+            docs = await self._cursor.to_list(length); return docs
+        finally: TRACER.add(self._trace, self._name, "mongo", start, perf_counter())
+
+    def __aiter__(self): return self
+
+    async def __anext__(self):
+        if self._trace is None: return await self._cursor.__anext__()
+        start = perf_counter()
+        if self._start is None: self._start = start
+        try: doc = await self._cursor.__anext__()
+        except StopAsyncIteration:
+            self._busy += perf_counter() - start
+            # Um span por cursor: duração = tempo de busca (o consumo entre lotes fica de fora)
+            TRACER.add(self._trace, self._name, "mongo", self._start, self._start + self._busy, {"docs": self._docs, "wall_ms": round((perf_counter() - self._start) * 1000, 3)})
+            raise
+        self._busy += perf_counter() - start; self._docs += 1
+        return doc
+
+
+class TracedCollection:
+    """Proxy de uma coleção: cada operação vira um span "mongo" do trace atual."""
+    ASYNC = frozenset((
+        "find_one", "find_one_and_update", "find_one_and_replace", "find_one_and_delete",
+        "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+        "delete_one", "delete_many", "count_documents", "distinct", "bulk_write",
+    ))
+    CURSORS = frozenset(("find", "aggregate"))
+
+    def __init__(self, collection, name):
+        self._collection = collection; self._name = name
+
+    def __getattr__(self, attr):
+        value = getattr(self._collection, attr)
+        name = f"{self._name}.{attr}"
+        if attr in self.CURSORS:
+            return lambda *args, **kwargs: TracedCursor(value(*args, **kwargs), name)
+        if attr not in self.ASYNC: return value
+        async def call(*args, **kwargs):
+            trace = _current.get()
+            if trace is None: return await value(*args, **kwargs)
+            start = perf_counter()
+            try: return await value(*args, **kwargs)
+            finally: TRACER.add(trace, name, "mongo", start, perf_counter())
+        return call
+
+
+class TracedDatabase:
+    """Proxy do banco (db.files, db["users"], ...) com coleções rastreadas."""
+
+    def __init__(self, db):
+        self._db = db; self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"): return getattr(self._db, name)
+        return self[name]
+
+    def __getitem__(self, name):
+        coll = self._collections.get(name)
+        if coll is None: coll = self._collections[name] = TracedCollection(self._db[name], name)
+        return coll
+
+
+TRACER = Tracer(sample=TRACE_SAMPLE, slow_ms=TRACE_SLOW_MS, max_events=TRACE_MAX_EVENTS)
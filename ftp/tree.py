@@ -0,0 +1,39 @@
+"""
+Caminho materializado dos documentos de `files`.
+
+Cada documento guarda `path` (caminho completo, "/a/b/arquivo") além de
+`parent` e `name`. Como "0" vem logo depois de "/", os descendentes de "/a/b"
+são exatamente os caminhos na faixa ["/a/b/", "/a/b0"): uma varredura de faixa
+no índice de `path`, sem regex e sem pegar pastas vizinhas como "/a/bc".
+
+Enquanto a migração dos documentos antigos (sem `path`) não termina, a mesma
+faixa é aplicada a `parent` (filhos diretos ou netos em diante), que também é
+exata e indexada.
+"""
+
+__all__ = ("full_path", "subtree", "descendants", "moved")
+
+
+def full_path(parent, name):
+    parent = parent or "/"
+    if not parent.startswith("/"): parent = "/" + parent
+    if not name: return parent
+    return f"/{name}" if parent == "/" else f"{parent}/{name}"
+
+
+def subtree(full, field="path"):
+    """Filtro dos caminhos abaixo de `full` (sem ele mesmo)."""
+    prefix = full if full.endswith("/") else full + "/"
+    return {field: {"$gte": prefix, "$lt": prefix[:-1] + "0"}}
+
+
+def descendants(full, paths_ready=True):
+    """Filtro exato dos descendentes de `full`; sem a migração concluída, usa `parent`."""
+    if paths_ready: return subtree(full)
+    return {"$or": [{"parent": full}, subtree(full, "parent")]}
+
+
+def moved(value, old, new):
+    """Troca o prefixo `old` de um caminho por `new` (mover uma pasta)."""
+    if value == old: return new
+    return (new.rstrip("/") if new != "/" else "") + value[len(old):]
@@ -0,0 +1,212 @@
+from asyncio import Lock, Queue, create_task, get_event_loop, sleep as asleep
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import logging
+
+logger = logging.getLogger("NebulaFTP")
+
+__all__ = ("Inotify", "StagingWatcher")
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+_EVENT = struct.Struct("iIII")
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+
+class Inotify:
+    """
+    inotify via ctypes (sem dependências). Os eventos são lidos com
+    loop.add_reader e entregues numa asyncio.Queue como (caminho, máscara).
+    Levanta OSError fora do Linux ou se a libc não expõe inotify.
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"): raise OSError(errno.ENOSYS, "inotify indisponível")
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno(); raise OSError(err, os.strerror(err))
+        self.fd = fd
+        self.events = Queue()
+        self._paths = {}  # wd -> diretório
+        self._loop = None
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno(); raise OSError(err, f"inotify_add_watch({path}): {os.strerror(err)}")
+        self._paths[wd] = path
+        return wd
+
+    def start(self):
+        self._loop = get_event_loop()
+        self._loop.add_reader(self.fd, self._read)
+
+    def _read(self):
+        try: buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError: return
+        pos = 0
+        while pos + _EVENT.size <= len(buf):
+            wd, mask, _cookie, length = _EVENT.unpack_from(buf, pos)
+            pos += _EVENT.size
+            name = buf[pos:pos + length].rstrip(b"\0"); pos += length
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None); continue
+            base = self._paths.get(wd)
+            if mask & IN_Q_OVERFLOW or base is None:
+                self.events.put_nowait((None, mask)); continue
+            self.events.put_nowait((os.path.join(base, os.fsdecode(name)) if name else base, mask))
+
+    def close(self):
+        if self._loop is not None: self._loop.remove_reader(self.fd)
+        os.close(self.fd)
+
+
+class StagingWatcher:
+    """
+    Descobre arquivos novos em `root` (recursivo) e chama `on_files(lista de
+    (caminho, tamanho))` quando cada um fica estável.
+
+    - Linux: inotify (IN_CLOSE_WRITE / IN_MOVED_TO; pastas novas ganham watch e
+      são varridas uma vez). Overflow da fila do kernel força uma nova varredura.
+    - Fora do Linux (ou sem watches disponíveis): varredura periódica, que só
+      considera caminhos ainda não conhecidos.
+    - A estabilidade (mesmo tamanho após `settle` segundos) é verificada em
+      paralelo para todos os candidatos; um arquivo já conhecido não é reavaliado
+      até ser removido/movido para fora.
+    - Os arquivos prontos são entregues em lotes de até `batch_size` (ou após
+      `batch_delay` segundos), um lote por vez, para registro em massa.
+    """
+
+    def __init__(self, root, on_files, settle=2, poll_interval=5, skip=None, batch_size=1000, batch_delay=0.5):
+        self.root = root; self.on_files = on_files
+        self.settle = settle; self.poll_interval = poll_interval
+        self.skip = skip or (lambda path: False)
+        self.batch_size = batch_size; self.batch_delay = batch_delay
+        self.known = set()
+        self._pending = {}  # caminho -> task de estabilização
+        self._ready = []; self._flusher = None; self._deliver_lock = Lock()
+
+    def _ignored(self, path):
+        return path.endswith(".partial") or self.skip(path)
+
+    def _candidate(self, path):
+        if path in self.known or path in self._pending or self._ignored(path): return
+        self._pending[path] = create_task(self._settle(path))
+
+    def _forget(self, path):
+        self.known.discard(path)
+        task = self._pending.pop(path, None)
+        if task: task.cancel()
+
+    async def _settle(self, path):
+        try:
+            try: size = os.path.getsize(path)
+            except OSError: return
+            while True:
+                await asleep(self.settle)
+                try: now = os.path.getsize(path)
+                except OSError: return
+                if now == size: break
+                size = now
+            if size == 0 or not os.path.isfile(path): return
+            self.known.add(path)
+        finally:
+            self._pending.pop(path, None)
+        self._ready.append((path, size))
+        if len(self._ready) >= self.batch_size: self._flush()
+        elif self._flusher is None: self._flusher = get_event_loop().call_later(self.batch_delay, self._flush)
+
+    def _flush(self):
+        if self._flusher is not None: self._flusher.cancel(); self._flusher = None
+        batch, self._ready = self._ready, []
+        if batch: create_task(self._deliver(batch))
+
+    async def _deliver(self, batch):
+        async with self._deliver_lock:
+            try: await self.on_files(batch)
+            except Exception as e:
+                # Nova tentativa depois de poll_interval (ou no próximo evento)
+                logger.warning(f"⚠️ Erro registro de {len(batch)} arquivos: {e}")
+                for path, _ in batch:
+                    self.known.discard(path)
+                    get_event_loop().call_later(self.poll_interval, self._candidate, path)
+
+    async def _scan(self, top, watch=None):
+        """Varredura completa de `top` no executor; com inotify adiciona watch em cada pasta (no loop)."""
+        found = set()
+        # `top` ganha watch antes da varredura (arquivos gravados durante ela geram evento);
+        # repetir inotify_add_watch no mesmo caminho só devolve o mesmo wd
+        tree = [(top, None)] if watch is not None else []
+        tree += await get_event_loop().run_in_executor(None, self._tree, top)
+        for root, files in tree:
+            if watch is not None:
+                try: watch.add_watch(root)
+                except OSError as e: logger.warning(f"⚠️ Watcher: {e}")
+            if files is None: continue
+            for f in files:
+                path = os.path.join(root, f); found.add(path)
+                self._candidate(path)
+        return found
+
+    @staticmethod
+    def _tree(top):
+        return [(root, files) for root, _, files in os.walk(top)]
+
+    async def run(self):
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            watch = Inotify()
+        except OSError as e:
+            logger.info(f"👀 inotify indisponível ({e}); usando varredura a cada {self.poll_interval}s")
+            return await self._poll()
+        logger.info("👀 Watcher com inotify")
+        try:
+            watch.start()
+            await self._scan(self.root, watch)
+            while True:
+                path, mask = await watch.events.get()
+                if path is None:
+                    logger.warning("⚠️ Watcher: fila do inotify transbordou, varrendo novamente")
+                    await self._scan(self.root, watch); continue
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO): await self._scan(path, watch)
+                    elif mask & (IN_MOVED_FROM | IN_DELETE): self._forget_tree(path)
+                    continue
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO): self._candidate(path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM): self._forget(path)
+        finally:
+            for task in list(self._pending.values()): task.cancel()
+            watch.close()
+
+    def _forget_tree(self, top):
+        prefix = top.rstrip(os.sep) + os.sep
+        for path in [p for p in self.known | set(self._pending) if p.startswith(prefix)]: self._forget(path)
+
+    async def _poll(self):
+        while True:
+            try:
+                found = await get_event_loop().run_in_executor(None, self._walk)
+                for path in self.known - found: self.known.discard(path)
+                for path in found: self._candidate(path)
+            except Exception as e:
+                logger.error(f"❌ Erro Watcher: {e}")
+            await asleep(self.poll_interval)
+
+    def _walk(self):
+        return {os.path.join(root, f) for root, _, files in os.walk(self.root) for f in files}
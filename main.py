@@ -3,8 +3,8 @@ import os
 import time
 import logging
 import uuid
-import io
 import aiofiles
+import resource
 import signal
 from logging.handlers import RotatingFileHandler
 from os import environ
@@ -12,28 +12,70 @@ from os.path import exists
 from motor.motor_asyncio import AsyncIOMotorClient
 from pyrogram import Client
 from pyrogram.errors import FloodWait, RPCError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
-# Imports locais
-from ftp import Server, MongoDBUserManager, MongoDBPathIO
-from ftp.common import UPLOAD_QUEUE
-
+# O .env precisa estar carregado antes dos imports locais: os módulos de ftp/ leem a configuração ao importar
 if exists(".env"):
     from dotenv import load_dotenv
     load_dotenv()
 
+# Imports locais
+from ftp import Server, MongoDBUserManager, MongoDBPathIO
+from ftp.common import UPLOAD_QUEUE, GOVERNOR, FileSlice
+from ftp.parts import PartIndex
+from ftp.botpool import BotPool, patiently
+from ftp.blobs import BlobIndex
+from ftp.watcher import StagingWatcher
+from ftp.metrics import REGISTRY, serve_metrics
+from ftp.tracing import TRACER, TracedDatabase
+from ftp.sqlitestore import SQLiteDatabase
+from ftp.tree import full_path
+
 # --- CARREGAMENTO DE CONFIGURAÇÕES DO .ENV ---
 LOG_LEVEL = environ.get("LOG_LEVEL", "INFO")
 CHUNK_SIZE_MB = int(environ.get("CHUNK_SIZE_MB", 64))
 CHUNK_SIZE = CHUNK_SIZE_MB * 1024 * 1024 
 MAX_RETRIES = int(environ.get("MAX_RETRIES", 5))
 MAX_STAGING_AGE = int(environ.get("MAX_STAGING_AGE", 3600))
+# GC: intervalo entre rodadas, reconciliação completa disco <-> Mongo e tamanho dos lotes
+GC_INTERVAL = int(environ.get("GC_INTERVAL", 60))
+GC_RECONCILE_INTERVAL = int(environ.get("GC_RECONCILE_INTERVAL", 3600))
+GC_BATCH = int(environ.get("GC_BATCH", 500))
 MAX_WORKERS = int(environ.get("MAX_WORKERS", 4))
+# Watcher do staging: segundos sem mudar de tamanho para considerar o arquivo pronto
+# e intervalo da varredura quando inotify não está disponível
+WATCHER_SETTLE = float(environ.get("WATCHER_SETTLE", 2))
+WATCHER_POLL_INTERVAL = float(environ.get("WATCHER_POLL_INTERVAL", 5))
+# Arquivos registrados por lote (bulk_write / insert_many / fila)
+WATCHER_BATCH_SIZE = int(environ.get("WATCHER_BATCH_SIZE", 1000))
+# Endpoint OpenMetrics (Prometheus); porta 0 desativa
+METRICS_HOST = environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(environ.get("METRICS_PORT", 9100))
+# Arquivo Chrome Trace regravado a cada TRACE_DUMP_INTERVAL segundos (vazio = só o endpoint /trace)
+TRACE_FILE = environ.get("TRACE_FILE", os.path.join("traces", "trace.json"))
+TRACE_DUMP_INTERVAL = int(environ.get("TRACE_DUMP_INTERVAL", 10))
+# Banco de metadados: "mongo" (MONGODB) ou "sqlite" (arquivo local, para um nó só)
+METADATA_BACKEND = environ.get("METADATA_BACKEND", "mongo").lower()
+SQLITE_PATH = environ.get("SQLITE_PATH", os.path.join("data", "nebula.db"))
+# Envia as partes ao Telegram enquanto o STOR ainda está recebendo
+STREAM_UPLOAD = environ.get("STREAM_UPLOAD", "false").lower() in ("1", "true", "yes")
+# Partes do mesmo arquivo enviadas em paralelo e limite global de partes em voo
+PARTS_PER_FILE = int(environ.get("PARTS_PER_FILE", 4))
+MAX_INFLIGHT_PARTS = int(environ.get("MAX_INFLIGHT_PARTS", 8))
+# Tentativas de um arquivo (reaproveitando as partes já enviadas) antes de desistir
+MAX_FILE_ATTEMPTS = int(environ.get("MAX_FILE_ATTEMPTS", 3))
+# Migração do campo `path` (caminho materializado): documentos por bulk_write
+PATH_MIGRATION_BATCH = int(environ.get("PATH_MIGRATION_BATCH", 1000))
 
 # --- CONTROLE DE LOCKS (PROTEÇÃO) ---
 # Conjunto para armazenar caminhos de arquivos que estão sendo enviados agora.
 # O Garbage Collector NÃO pode tocar nestes arquivos.
 ACTIVE_UPLOADS = set()
 
+# Limite global de send_document em voo (somando todos os arquivos)
+PART_SLOTS = asyncio.Semaphore(MAX_INFLIGHT_PARTS)
+
 # --- LOGGING ---
 log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 log_handler = RotatingFileHandler('nebula.log', maxBytes=5*1024*1024, backupCount=2)
@@ -62,19 +104,106 @@ if FTP_MASQUERADE_ADDRESS:
     logger.info(f"📡 Masquerade Address definido: {FTP_MASQUERADE_ADDRESS}")
 
 # --- MÉTRICAS ---
+UPLOADS = REGISTRY.counter("nebula_uploads", "Arquivos concluídos por resultado", ("result",))
+UPLOAD_BYTES = REGISTRY.counter("nebula_upload_bytes", "Bytes de arquivos concluídos", ("result",))
+PART_LATENCY = REGISTRY.histogram("nebula_upload_part_seconds", "Latência do envio de uma parte ao Telegram")
+PART_RETRIES = REGISTRY.counter("nebula_upload_part_retries", "Tentativas de envio de parte que falharam", ("reason",))
+QUEUE_DEPTH = REGISTRY.gauge("nebula_upload_queue_depth", "Jobs na fila de upload por classe", ("class",))
+QUEUE_WAIT = REGISTRY.gauge("nebula_upload_queue_wait_seconds", "Espera até o claim por classe (percentis recentes)", ("class", "quantile"))
+QUEUE_AGE = REGISTRY.gauge("nebula_upload_queue_oldest_seconds", "Idade do job mais antigo na fila")
+
 class Metrics:
     uploads_total = 0; uploads_failed = 0; bytes_uploaded = 0
+    dedup_total = 0; bytes_deduped = 0
+    pool = None
+    @classmethod
+    def log_success(cls, size):
+        cls.uploads_total += 1; cls.bytes_uploaded += size
+        UPLOADS.inc(1, ("uploaded",)); UPLOAD_BYTES.inc(size, ("uploaded",))
     @classmethod
-    def log_success(cls, size): cls.uploads_total += 1; cls.bytes_uploaded += size
+    def log_dedup(cls, size):
+        cls.dedup_total += 1; cls.bytes_deduped += size
+        UPLOADS.inc(1, ("deduplicated",)); UPLOAD_BYTES.inc(size, ("deduplicated",))
     @classmethod
-    def log_fail(cls): cls.uploads_failed += 1
+    def log_fail(cls): cls.uploads_failed += 1; UPLOADS.inc(1, ("failed",))
     @classmethod
-    def report(cls):
+    def export(cls, server):
+        """Registra as métricas lidas na hora da coleta (endpoint OpenMetrics)."""
+        REGISTRY.gauge("nebula_ftp_connections", "Conexões FTP ativas", fn=lambda: len(getattr(server, "connections", ())))
+        REGISTRY.gauge("nebula_ftp_user_connections", "Conexões FTP ativas por usuário", ("user",), fn=lambda: {
+            (login,): c.maximum_value - c.value for login, c in server.user_manager.available_connections.items() if c.value is not None
+        })
+        REGISTRY.gauge("nebula_staging_bytes", "Bytes no staging (reservados por STOR, aguardando upload, livres no disco)", ("kind",), fn=lambda: {
+            ("reserved",): (st := MongoDBPathIO.staging.stats())["reserved"], ("pending",): st["pending"], ("free",): st["free"]
+        })
+        REGISTRY.gauge("nebula_cache_hit_ratio", "Taxa de acerto dos caches", ("cache",), fn=lambda: {
+            ("metadata",): MongoDBPathIO.cache.stats()["hit_rate"], ("listings",): MongoDBPathIO.listings.stats()["hit_rate"],
+            ("chunks",): MongoDBPathIO.chunk_cache.stats()["hit_rate"],
+        })
+        REGISTRY.gauge("nebula_cache_entries", "Entradas nos caches", ("cache",), fn=lambda: {
+            ("metadata",): MongoDBPathIO.cache.stats()["entries"], ("listings",): MongoDBPathIO.listings.stats()["dirs"],
+            ("chunks",): MongoDBPathIO.chunk_cache.stats()["entries"],
+        })
+        REGISTRY.gauge("nebula_tg_bot_inflight", "Requisições em voo por bot", ("bot",), fn=lambda: {
+            (b["bot"],): b["inflight"] for b in (cls.pool.stats() if cls.pool else ())
+        })
+        REGISTRY.gauge("nebula_tg_bot_bytes", "Bytes enviados/recebidos por bot", ("bot", "direction"), fn=lambda: {
+            k: v for b in (cls.pool.stats() if cls.pool else ()) for k, v in (((b["bot"], "up"), b["bytes_up"]), ((b["bot"], "down"), b["bytes_down"]))
+        })
+        REGISTRY.gauge("nebula_tg_rate", "Taxa atual do governor (req/s)", ("bucket",), fn=lambda: {
+            (k,): g["rate"] for k, g in GOVERNOR.stats().items()
+        })
+
+        @REGISTRY.on_collect
+        async def queue_stats():
+            for name, q in (await UPLOAD_QUEUE.class_stats()).items():
+                QUEUE_DEPTH.set(q["depth"], (name,))
+                for quantile, value in q["wait"].items(): QUEUE_WAIT.set(value, (name, quantile / 100))
+            QUEUE_AGE.set(await UPLOAD_QUEUE.oldest_age())
+    @staticmethod
+    def peak_rss_mb():
+        # ru_maxrss: high-water mark do processo (KB no Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    @classmethod
+    def report(cls, queue=None):
         mb = cls.bytes_uploaded / (1024*1024)
         logger.info(f"📊 Stats: ⬆️ {cls.uploads_total} uploads ({mb:.2f} MB) | ❌ {cls.uploads_failed} falhas")
+        logger.info(f"🧬 Dedup: {cls.dedup_total} arquivos reaproveitados ({cls.bytes_deduped/(1024*1024):.2f} MB não reenviados)")
+        for name, q in (queue or {}).items():
+            w = q["wait"]
+            logger.info(f"📥 Fila {name}: {q['depth']} jobs | espera p50 {w[50]:.0f}s p95 {w[95]:.0f}s p99 {w[99]:.0f}s")
+        logger.info(f"🧠 Memória: pico RSS {cls.peak_rss_mb():.1f} MB")
+        st = MongoDBPathIO.staging.stats()
+        logger.info(
+            f"💽 Staging: {st['used']/(1024*1024):.1f} MB em uso ({st['files']} arquivos aguardando, {st['reserved']/(1024*1024):.1f} MB em STOR) | "
+            f"livre {(st['free'] or 0)/(1024*1024):.0f} MB | pausados {st['paused']} | recusados {st['refused']}"
+        )
+        c = MongoDBPathIO.cache.stats()
+        logger.info(
+            f"🗂️ Cache: {c['entries']} entradas ({c['bytes']/(1024*1024):.1f} MB) | "
+            f"hit {c['hit_rate']*100:.1f}% | miss {c['misses']} | evict {c['evictions']}"
+        )
+        l = MongoDBPathIO.listings.stats()
+        logger.info(f"📂 Listagens: {l['dirs']} pastas em cache | hit {l['hit_rate']*100:.1f}% | invalidações {l['invalidations']}")
+        k = MongoDBPathIO.chunk_cache.stats()
+        logger.info(
+            f"💾 Chunks: {k['bytes']/(1024*1024):.1f} MB em disco | hit {k['hit_rate']*100:.1f}% | "
+            f"economizado {k['bytes_saved']/(1024*1024):.1f} MB"
+        )
+        for key, g in sorted(GOVERNOR.stats().items()):
+            logger.info(f"🐢 Governor {key}: {g['rate']:.2f} req/s | {g['requests']} req | FloodWait {g['floods']}x | espera {g['waited']:.0f}s")
+        for b in cls.pool.stats() if cls.pool else ():
+            logger.info(
+                f"🤖 Bot #{b['bot']}: {b['requests']} req | ⬆️ {b['bytes_up']/(1024*1024):.1f} MB | ⬇️ {b['bytes_down']/(1024*1024):.1f} MB | "
+                f"em voo {b['inflight']} | FloodWait {b['flood_waits']}x ({b['flood_wait_seconds']:.0f}s){' | 🪑 no banco' if b['benched'] else ''}"
+            )
 
 async def stats_reporter():
-    while True: await asyncio.sleep(300); Metrics.report()
+    while True:
+        await asyncio.sleep(300)
+        try: queue = await UPLOAD_QUEUE.class_stats()
+        except Exception as e: logger.warning(f"⚠️ Stats da fila indisponíveis: {e}"); queue = None
+        Metrics.report(queue)
 
 async def setup_database_indexes(mongo):
     logger.info("🔧 Verificando índices do Banco de Dados...")
@@ -84,35 +213,160 @@ async def setup_database_indexes(mongo):
         await mongo.files.create_index("uploadId", sparse=True)
         await mongo.files.create_index("uploaded_at")
         await mongo.files.create_index("status") 
+        await mongo.files.create_index("local_path", sparse=True)
+        await mongo.files.create_index("blob", sparse=True)
+        await mongo.files.create_index("path")
         logger.info("✅ Índices verificados.")
     except Exception as e: logger.warning(f"⚠️ Aviso índices: {e}")
 
-async def garbage_collector():
+async def migrate_paths(mongo):
+    """Preenche `path` nos documentos antigos (uma vez, em segundo plano).
+
+    Até terminar, as subárvores filtram por `parent`; depois passam para a faixa de `path`.
+    """
+    if await mongo.migrations.find_one({"_id": "files.path"}):
+        MongoDBPathIO.paths_ready = True; return
+    logger.info("🧭 Migrando documentos para o campo path...")
+    ops = []; migrated = 0
+    try:
+        async for d in mongo.files.find({"path": {"$exists": False}}, {"parent": 1, "name": 1}).batch_size(PATH_MIGRATION_BATCH):
+            # O filtro por `parent` evita sobrescrever um documento movido durante a migração
+            ops.append(UpdateOne({"_id": d["_id"], "parent": d.get("parent"), "path": {"$exists": False}},
+                                 {"$set": {"path": full_path(d.get("parent"), d.get("name"))}}))
+            if len(ops) >= PATH_MIGRATION_BATCH:
+                migrated += (await mongo.files.bulk_write(ops, ordered=False)).modified_count; ops = []
+                await asyncio.sleep(0)
+        if ops: migrated += (await mongo.files.bulk_write(ops, ordered=False)).modified_count
+        # Documentos movidos no meio da passada ficaram de fora: confere antes de marcar
+        if await mongo.files.find_one({"path": {"$exists": False}}, {"_id": 1}):
+            logger.warning("⚠️ Migração do path incompleta; nova tentativa no próximo início"); return
+        await mongo.migrations.update_one({"_id": "files.path"}, {"$set": {"done_at": int(time.time()), "migrated": migrated}}, upsert=True)
+        MongoDBPathIO.paths_ready = True
+        logger.info(f"✅ Migração do path concluída ({migrated} documentos)")
+    except Exception as e: logger.error(f"❌ Erro na migração do path: {e}")
+
+def scan_staging(staging_dir="staging"):
+    """Lista (caminho, tamanho, mtime) do staging; roda fora do event loop."""
+    found = []
+    for root, dirs, files in os.walk(staging_dir):
+        for f in files:
+            fp = os.path.join(root, f)
+            try: st = os.stat(fp)
+            except OSError: continue
+            found.append((fp, st.st_size, st.st_mtime))
+    return found
+
+def remove_staging_file(fp):
+    try:
+        os.remove(fp)
+        logger.warning(f"🧹 GC: Lixo removido: {os.path.basename(fp)}")
+        return True
+    except FileNotFoundError: return True
+    except Exception as e:
+        logger.error(f"❌ GC Erro {os.path.basename(fp)}: {e}"); return False
+    finally: MongoDBPathIO.staging.discard(fp)
+
+def staging_task(doc):
+    return {"path": doc["local_path"], "filename": doc["name"], "parent": doc["parent"], "size": doc.get("size", 0)}
+
+async def drop_partials(mongo, docs):
+    """Temporários do cliente (*.partial) nunca renomeados: lixo, não vão para o Telegram."""
+    for d in docs: remove_staging_file(d["local_path"])
+    await mongo.files.delete_many({"_id": {"$in": [d["_id"] for d in docs]}, "status": "staging"})
+    for d in docs:
+        MongoDBPathIO.cache.discard(d["parent"], d["name"])
+        MongoDBPathIO.listings.invalidate(d["parent"])
+    return len(docs)
+
+async def collect_expired(mongo):
+    """
+    GC incremental: consulta só os arquivos mais antigos do índice de idade
+    (alimentado por STOR, watcher e uploads), confrontando-os com o Mongo em lote.
+    Arquivo com documento em staging não é lixo: garante o job e volta ao heap
+    (exceto *.partial do cliente, que nunca são enviados e expiram como lixo).
+    """
+    staging = MongoDBPathIO.staging; removed = 0
+    while paths := staging.expired(MAX_STAGING_AGE, GC_BATCH):
+        docs = {}
+        async for d in mongo.files.find({"local_path": {"$in": paths}}, {"local_path": 1, "name": 1, "parent": 1, "size": 1, "status": 1}):
+            docs[d["local_path"]] = d
+        stuck = []; partials = []
+        for fp in paths:
+            doc = docs.get(fp)
+            if doc and fp not in ACTIVE_UPLOADS and doc.get("status") == "staging" and doc["name"].endswith(".partial"):
+                partials.append(doc); continue
+            if fp in ACTIVE_UPLOADS or doc:
+                if doc and fp not in ACTIVE_UPLOADS and doc.get("status") == "staging": stuck.append(staging_task(doc))
+                staging.touch(fp); continue
+            if remove_staging_file(fp): removed += 1
+        if partials: removed += await drop_partials(mongo, partials)
+        if stuck: await UPLOAD_QUEUE.ensure_many(stuck)
+        await asyncio.sleep(0)
+    return removed
+
+async def reconcile_staging(mongo):
+    """
+    Reconciliação disco <-> db.files, em lotes de GC_BATCH (cede o loop entre eles):
+    - arquivo sem documento e mais velho que MAX_STAGING_AGE (inclui .partial
+      abandonados): removido; com documento em staging: job garantido na fila,
+      exceto *.partial do cliente, removidos (arquivo e documento) depois de MAX_STAGING_AGE;
+    - documento em staging cujo arquivo sumiu: removido (entrada quebrada).
+    """
+    staging = MongoDBPathIO.staging; loop = asyncio.get_event_loop(); now = time.time()
+    orphan_files = 0; orphan_docs = 0
+    entries = await loop.run_in_executor(None, scan_staging)
+    for i in range(0, len(entries), GC_BATCH):
+        batch = entries[i:i + GC_BATCH]
+        docs = {}
+        async for d in mongo.files.find({"local_path": {"$in": [fp for fp, _, _ in batch]}}, {"local_path": 1, "name": 1, "parent": 1, "size": 1, "status": 1}):
+            docs[d["local_path"]] = d
+        stuck = []; partials = []
+        for fp, size, mtime in batch:
+            doc = docs.get(fp)
+            if doc and fp not in ACTIVE_UPLOADS and doc.get("status") == "staging" and doc["name"].endswith(".partial"):
+                if now - mtime > MAX_STAGING_AGE: partials.append(doc)
+                elif fp not in staging.pending: staging.add(fp, size, mtime)
+                continue
+            if doc or fp in ACTIVE_UPLOADS:
+                if doc and doc.get("status") == "staging" and fp not in ACTIVE_UPLOADS:
+                    stuck.append(staging_task(doc))
+                    if fp not in staging.pending: staging.add(fp, size, mtime)
+                continue
+            if now - mtime > MAX_STAGING_AGE and remove_staging_file(fp): orphan_files += 1
+        if partials: orphan_files += await drop_partials(mongo, partials)
+        if stuck: await UPLOAD_QUEUE.ensure_many(stuck)
+        await asyncio.sleep(0)
+
+    batch = []
+    async def repair(batch):
+        exists_ = await loop.run_in_executor(None, lambda: [os.path.exists(d["local_path"]) for d in batch])
+        broken = [d for d, ok in zip(batch, exists_) if not ok and d["local_path"] not in ACTIVE_UPLOADS]
+        if not broken: return 0
+        await mongo.files.delete_many({"_id": {"$in": [d["_id"] for d in broken]}, "status": "staging"})
+        for d in broken:
+            logger.warning(f"🧹 GC: Entrada sem arquivo removida: {d['parent']}/{d['name']}")
+            MongoDBPathIO.cache.discard(d["parent"], d["name"])
+            MongoDBPathIO.listings.invalidate(d["parent"])
+            staging.discard(d["local_path"])
+        return len(broken)
+    async for doc in mongo.files.find({"status": "staging", "local_path": {"$exists": True}}, {"local_path": 1, "name": 1, "parent": 1}).batch_size(GC_BATCH):
+        batch.append(doc)
+        if len(batch) >= GC_BATCH: orphan_docs += await repair(batch); batch = []
+    if batch: orphan_docs += await repair(batch)
+
+    if orphan_files or orphan_docs:
+        logger.info(f"🧹 GC: Reconciliação removeu {orphan_files} arquivos órfãos e {orphan_docs} entradas sem arquivo")
+
+async def garbage_collector(mongo):
     logger.info(f"🧹 Garbage Collector Iniciado (Max Age: {MAX_STAGING_AGE}s)")
-    staging_dir = "staging"
+    last_reconcile = 0
     while True:
+        await asyncio.sleep(GC_INTERVAL)
         try:
-            now = time.time()
-            if os.path.exists(staging_dir):
-                for root, dirs, files in os.walk(staging_dir):
-                    for f in files:
-                        if f.endswith(".partial"): continue
-                        fp = os.path.join(root, f)
-                        
-                        # --- PROTEÇÃO CRÍTICA ---
-                        # Se o arquivo estiver sendo enviado, PULA.
-                        if fp in ACTIVE_UPLOADS:
-                            continue
-                        # ------------------------
-
-                        if now - os.path.getmtime(fp) > MAX_STAGING_AGE:
-                            try: 
-                                os.remove(fp) 
-                                logger.warning(f"🧹 GC: Lixo removido: {f}")
-                            except Exception as e: 
-                                logger.error(f"❌ GC Erro {f}: {e}")
+            await collect_expired(mongo)
+            if time.time() - last_reconcile >= GC_RECONCILE_INTERVAL:
+                await reconcile_staging(mongo); last_reconcile = time.time()
         except Exception as e: logger.error(f"❌ GC Falha Geral: {e}")
-        await asyncio.sleep(600)
 
 async def folder_watcher(mongo):
     """
@@ -134,78 +388,291 @@ async def folder_watcher(mongo):
     except Exception as e:
         logger.error(f"❌ Erro ao buscar utilizador: {e}")
 
-    while True:
+    def parent_of(fp):
+        rel_dir = os.path.relpath(os.path.dirname(fp), staging_dir)
+        if rel_dir == ".": return target_root
+        normalized_rel = rel_dir.replace(os.sep, "/")
+        if target_root == "/": return f"/{normalized_rel}"
+        return f"{target_root}/{normalized_rel}"
+
+    async def register(found):
+        """Registra um lote de arquivos: poucas idas ao Mongo, qualquer que seja o tamanho do lote."""
+        # Ignora se já estiver sendo enviado (evita duplicar na fila)
+        batch = {}
+        for fp, size in found:
+            if fp in ACTIVE_UPLOADS: continue
+            batch.setdefault(parent_of(fp), {})[os.path.basename(fp)] = (fp, size)
+        if not batch: return
+
+        # Arquivos do STOR (staging/<uuid>_<nome>) e os já registrados têm documento
+        # próprio apontando para eles: uma consulta por local_path para o lote todo
+        paths = [fp for entries in batch.values() for fp, _ in entries.values()]
+        known = set()
+        async for doc in mongo.files.find({"local_path": {"$in": paths}}, {"_id": 0, "local_path": 1}):
+            known.add(doc["local_path"])
+        batch = {p: {f: v for f, v in e.items() if v[0] not in known} for p, e in batch.items()}
+        batch = {p: e for p, e in batch.items() if e}
+        if not batch: return
+
+        # Pastas ancestrais: deduplicadas e criadas num único bulk_write
+        now = int(time.time())
+        ancestors = set()
+        for parent_path in batch:
+            current_parent = "/"
+            for part in parent_path.strip("/").split("/") if parent_path != "/" else ():
+                ancestors.add((current_parent, part))
+                current_parent = f"/{part}" if current_parent == "/" else f"{current_parent}/{part}"
+        if ancestors:
+            try:
+                await mongo.files.bulk_write([
+                    UpdateOne({"name": part, "parent": parent}, {"$setOnInsert": {"type": "dir", "path": full_path(parent, part), "ctime": now, "mtime": now, "size": 0}}, upsert=True)
+                    for parent, part in ancestors
+                ], ordered=False)
+            except BulkWriteError as e:
+                # Upsert concorrente da mesma pasta (chave duplicada) não é erro
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])): raise
+
+        docs = [
+            {"type": "file", "name": f, "parent": parent_path, "path": full_path(parent_path, f), "size": size,
+             "status": "staging", "local_path": fp, "mtime": now, "ctime": now, "parts": []}
+            for parent_path, entries in batch.items() for f, (fp, size) in entries.items()
+        ]
+        # Inserção não ordenada: um duplicado (corrida com o STOR) não barra o resto
+        failed = set()
+        try: await mongo.files.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            failed = {err["index"] for err in e.details.get("writeErrors", [])}
+            logger.warning(f"⚠️ {len(failed)} arquivos já registrados por outro caminho")
+        inserted = [d for i, d in enumerate(docs) if i not in failed]
+        for d in inserted: MongoDBPathIO.staging.add(d["local_path"], d["size"])
+
+        for parent, part in ancestors:
+            MongoDBPathIO.cache.discard(parent, part)
+            MongoDBPathIO.listings.invalidate(parent)
+        for d in inserted: MongoDBPathIO.cache.discard(d["parent"], d["name"])
+        for parent_path in batch: MongoDBPathIO.listings.invalidate(parent_path)
+
+        await UPLOAD_QUEUE.put_many([
+            {"path": d["local_path"], "filename": d["name"], "parent": d["parent"], "size": d["size"]} for d in inserted
+        ])
+        logger.info(f"📤 Enfileirados: {len(inserted)} arquivos em {len(batch)} pastas")
+
+    # inotify (close-write / moved-to) com varredura periódica como alternativa
+    watcher = StagingWatcher(
+        staging_dir, register, settle=WATCHER_SETTLE, poll_interval=WATCHER_POLL_INTERVAL,
+        skip=lambda fp: fp in ACTIVE_UPLOADS, batch_size=WATCHER_BATCH_SIZE
+    )
+    await watcher.run()
+
+async def send_part(pool, target_chat_id, fd, part_num, offset, length, chunk_name, tag):
+    """
+    Envia uma parte do arquivo de staging ao Telegram com retries; retorna seus metadados.
+    Cada tentativa usa o bot menos carregado do pool: um FloodWait só afasta aquele bot.
+    O GOVERNOR dosa os envios por bot e por (bot, canal), aprendendo a taxa com os FloodWaits.
+    """
+    on_disk = os.fstat(fd).st_size
+    if on_disk < offset + length: raise Exception(f"Parte {part_num} incompleta no disco ({max(0, on_disk - offset)}/{length})")
+    # Fatia do staging lida sob demanda: sem cópia da parte inteira em memória
+    part_file = FileSlice(fd, offset, length, chunk_name)
+    sent_msg = None; sender = None
+
+    for attempt in range(1, MAX_RETRIES + 1):
+        w = 0
+        async with pool.use() as bot:
+            keys = (f"up:{bot.id}", f"chat:{bot.id}:{target_chat_id}")
+            await GOVERNOR.acquire(*keys)
+            try:
+                part_file.seek(0); started = time.perf_counter()
+                sent_msg = await bot.client.send_document(
+                    chat_id=target_chat_id,
+                    document=part_file,
+                    file_name=chunk_name,
+                    force_document=True,
+                    caption=""
+                )
+                GOVERNOR.success(*keys); PART_LATENCY.observe(time.perf_counter() - started)
+                bot.bytes_up += length; sender = bot
+                break
+            except FloodWait as e:
+                # Próxima tentativa vai para outro bot (ou espera se todos estão no banco)
+                pool.bench(bot, e.value + 2); GOVERNOR.flood(e.value + 2, *keys)
+                PART_RETRIES.inc(1, ("flood_wait",))
+            except RPCError as e:
+                logger.error(f"❌ [{tag}] Erro TG ({attempt}): {e}"); PART_RETRIES.inc(1, ("rpc",))
+                # O governor só reduz a taxa (o burst continua no bucket): o backoff exponencial vale sempre
+                GOVERNOR.error(*keys); w = (2 ** attempt)
+            except Exception as e:
+                w = 5; logger.error(f"❌ [{tag}] Erro: {e}"); PART_RETRIES.inc(1, ("other",))
+        if w: await asyncio.sleep(w)
+
+    if not sent_msg: raise Exception(f"Falha upload parte {part_num}")
+
+    return {
+        "part_id": part_num, "tg_file": sent_msg.document.file_id,
+        "tg_message": sent_msg.id, "tg_bot": sender.id, "file_size": length,
+        "chunk_name": chunk_name
+    }
+
+async def complete_upload(mongo, file_doc, real_size, parts_metadata, file_uuid, local_path, blob=None, deduped=False):
+    """
+    Marca o arquivo como concluído, invalida os caches e remove o staging.
+    Com sha256 no documento, as partes novas são publicadas no índice de blobs
+    (`blob` já vem preenchido quando as partes foram reaproveitadas de lá).
+    """
+    part_offsets = PartIndex.build_offsets(parts_metadata)
+    if blob is None and file_doc.get("sha256"):
         try:
-            for root, dirs, files in os.walk(staging_dir):
-                for f in files:
-                    if f.endswith(".partial"): continue
-                    fp = os.path.join(root, f)
-                    
-                    if not os.path.isfile(fp): continue
-                    
-                    # Ignora se já estiver sendo enviado (evita duplicar na fila)
-                    if fp in ACTIVE_UPLOADS: continue
-
-                    size_t1 = os.path.getsize(fp)
-                    if size_t1 == 0: continue
-
-                    rel_dir = os.path.relpath(root, staging_dir)
-                    
-                    if rel_dir == ".":
-                        parent_path = target_root
-                    else:
-                        normalized_rel = rel_dir.replace(os.sep, "/")
-                        if target_root == "/": parent_path = f"/{normalized_rel}"
-                        else: parent_path = f"{target_root}/{normalized_rel}"
-
-                    doc = await mongo.files.find_one({"name": f, "parent": parent_path})
-                    
-                    if not doc:
-                        await asyncio.sleep(2)
-                        if os.path.getsize(fp) != size_t1: continue
-
-                        logger.info(f"👀 Detectado: {f} -> {parent_path}")
-                        
-                        if parent_path != "/":
-                            parts = parent_path.strip("/").split("/")
-                            current_parent = "/"
-                            for part in parts:
-                                await mongo.files.update_one(
-                                    {"name": part, "parent": current_parent},
-                                    {"$setOnInsert": {"type": "dir", "ctime": int(time.time()), "mtime": int(time.time()), "size": 0}},
-                                    upsert=True
-                                )
-                                if current_parent == "/": current_parent = "/" + part
-                                else: current_parent = f"{current_parent}/{part}"
-
-                        file_doc = {
-                            "type": "file", "name": f, "parent": parent_path, "size": size_t1,
-                            "status": "staging", "local_path": fp,
-                            "mtime": int(time.time()), "ctime": int(time.time()), "parts": []
-                        }
-                        
-                        try:
-                            await mongo.files.insert_one(file_doc)
-                            await UPLOAD_QUEUE.put({
-                                "path": fp, "filename": f, "parent": parent_path, "size": size_t1
-                            })
-                            logger.info(f"📤 Enfileirado: {f}")
-                        except Exception as e:
-                            logger.warning(f"⚠️ Erro registro {f}: {e}")
+            if await BlobIndex(mongo).register(file_doc["sha256"], real_size, parts_metadata, part_offsets, file_uuid): blob = file_doc["sha256"]
+        except Exception as e: logger.warning(f"⚠️ [DEDUP] Falha ao registrar blob: {e}")
+    fields = {"size": real_size, "uploaded_at": int(time.time()), "parts": parts_metadata, "part_offsets": part_offsets, "obfuscated_id": file_uuid, "status": "completed"}
+    if blob: fields["blob"] = blob
+    await mongo.files.update_one(
+        {"_id": file_doc["_id"]},
+        {"$set": fields,
+         "$unset": {"uploadId": 1, "local_path": 1, "upload_uuid": 1, "upload_size": 1, "upload_parts": 1}}
+    )
+    # Descarta o documento em cache (ainda aponta para o staging, sem parts)
+    MongoDBPathIO.cache.discard(file_doc["parent"], file_doc["name"])
+    MongoDBPathIO.listings.invalidate(file_doc["parent"])
+    if deduped: Metrics.log_dedup(real_size)
+    else: Metrics.log_success(real_size)
+    # Agora sim o GC ou nós mesmos podemos remover
+    try: os.remove(local_path)
+    except: pass
+    MongoDBPathIO.staging.discard(local_path)
+
+async def checkpoint_parts(mongo, doc_filter, parts):
+    """Grava partes confirmadas no documento ($addToSet: idempotente e sem depender da ordem)."""
+    await mongo.files.update_one(doc_filter, {"$addToSet": {"upload_parts": {"$each": parts}}})
 
+def resumable_parts(file_doc, real_size):
+    """
+    Retoma um upload interrompido: devolve (file_uuid, partes já confirmadas) se o
+    checkpoint do documento corresponde ao arquivo atual, senão None.
+    """
+    file_uuid = file_doc.get("upload_uuid")
+    if not file_uuid or file_doc.get("upload_size") != real_size: return None
+    parts = {}
+    for p in file_doc.get("upload_parts") or ():
+        offset = p.get("part_id", -1) * CHUNK_SIZE
+        if 0 <= offset < real_size and p.get("file_size") == min(CHUNK_SIZE, real_size - offset):
+            parts.setdefault(p["part_id"], p)
+    return file_uuid, list(parts.values())
+
+class PartBatch:
+    """
+    Envia as partes de um arquivo em paralelo: até PARTS_PER_FILE por arquivo e
+    MAX_INFLIGHT_PARTS no total. Uma parte que falha não cancela as demais;
+    as concluídas ficam em `parts` (por part_id) e, com `checkpoint` definido
+    (filtro do documento), são gravadas em `upload_parts` assim que confirmadas.
+    """
+
+    def __init__(self, pool, target_chat_id, fd, file_uuid, tag, parts=None, mongo=None, checkpoint=None):
+        self.pool = pool; self.target_chat_id = target_chat_id; self.fd = fd
+        self.file_uuid = file_uuid; self.tag = tag
+        self.parts = {p["part_id"]: p for p in parts or ()}; self.errors = {}
+        self.mongo = mongo; self.checkpoint = checkpoint
+        self._tasks = set(); self._local = asyncio.Semaphore(PARTS_PER_FILE)
+
+    def submit(self, part_num, offset, length):
+        if part_num in self.parts: return
+        self._tasks.add(asyncio.create_task(self._send(part_num, offset, length)))
+
+    async def _send(self, part_num, offset, length):
+        chunk_name = f"{self.file_uuid}.part_{part_num:03d}"
+        async with self._local, PART_SLOTS:
+            try: self.parts[part_num] = meta = await send_part(self.pool, self.target_chat_id, self.fd, part_num, offset, length, chunk_name, self.tag)
+            except Exception as e:
+                logger.error(f"❌ [{self.tag}] Parte {part_num} falhou: {e}"); self.errors[part_num] = e; return
+        if self.checkpoint is not None:
+            try: await checkpoint_parts(self.mongo, self.checkpoint, [meta])
+            except Exception as e: logger.warning(f"⚠️ [{self.tag}] Checkpoint da parte {part_num} falhou: {e}")
+
+    async def wait(self):
+        if self._tasks: await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def cancel(self):
+        for t in self._tasks: t.cancel()
+
+    def ordered(self, count):
+        """Partes 0..count-1 em ordem, ou None se alguma estiver faltando."""
+        if any(i not in self.parts for i in range(count)): return None
+        return [self.parts[i] for i in range(count)]
+
+class StreamingUpload:
+    """
+    Upload em pipeline (STREAM_UPLOAD): o STOR entrega cada parte assim que
+    CHUNK_SIZE bytes chegam ao staging, e ela já segue para o Telegram enquanto
+    o restante ainda está sendo recebido.
+
+    O arquivo de staging continua sendo a fonte segura: só é removido depois que
+    todas as partes foram confirmadas. Se alguma falhar, o arquivo cai na
+    UPLOAD_QUEUE e o upload_worker refaz o envio normalmente.
+    """
+    pool = None; target_chat_id = None; mongo = None
+
+    def __init__(self, path):
+        self.chunk_size = CHUNK_SIZE
+        self.fd = os.open(path, os.O_RDONLY)
+        self.file_uuid = str(uuid.uuid4())
+        self.batch = PartBatch(self.pool, self.target_chat_id, self.fd, self.file_uuid, "STREAM")
+
+    def part_ready(self, part_num, offset, length):
+        self.batch.submit(part_num, offset, length)
+
+    def abort(self):
+        self.batch.cancel()
+        asyncio.create_task(self._close_after_cancel())
+
+    async def _close_after_cancel(self):
+        await self.batch.wait()
+        try: os.close(self.fd)
+        except OSError: pass
+
+    def finish(self, local_path, filename, parent, size, next_part):
+        """Chamado pelo STOR ao terminar: envia a cauda e conclui em segundo plano."""
+        tail = next_part * self.chunk_size
+        if size > tail: self.part_ready(next_part, tail, size - tail)
+        ACTIVE_UPLOADS.add(local_path)
+        asyncio.create_task(self._finalize(local_path, filename, parent, size))
+
+    async def _finalize(self, local_path, filename, parent, size):
+        try:
+            # A partir daqui o documento existe: grava o checkpoint das partes já
+            # confirmadas e passa a gravar as próximas assim que chegarem
+            doc_filter = {"local_path": local_path}
+            self.batch.mongo = self.mongo; self.batch.checkpoint = doc_filter
+            done = list(self.batch.parts.values())
+            await self.mongo.files.update_one(doc_filter, {"$set": {"upload_uuid": self.file_uuid, "upload_size": size}, "$addToSet": {"upload_parts": {"$each": done}}})
+            await self.batch.wait()
+            expected = (size + self.chunk_size - 1) // self.chunk_size
+            parts = self.batch.ordered(expected)
+            if parts is None:
+                # O upload_worker retoma a partir do checkpoint no documento
+                logger.warning(f"⚠️ [STREAM] Pipeline incompleto, reenfileirando: {filename}")
+                await UPLOAD_QUEUE.put({"path": local_path, "filename": filename, "parent": parent, "size": size})
+                return
+            # Busca pelo local_path: o arquivo pode ter sido renomeado durante o envio
+            file_doc = await self.mongo.files.find_one({"local_path": local_path})
+            if not file_doc:
+                logger.warning(f"⚠️ [STREAM] Metadados não encontrados: {filename}"); return
+            await complete_upload(self.mongo, file_doc, size, parts, self.file_uuid, local_path)
+            logger.info(f"✅ [STREAM] Concluído: {file_doc['name']}")
         except Exception as e:
-            logger.error(f"❌ Erro Watcher: {e}")
-        
-        await asyncio.sleep(5)
+            logger.error(f"❌ [STREAM] Falha ao concluir {filename}: {e}"); Metrics.log_fail()
+        finally:
+            try: os.close(self.fd)
+            except OSError: pass
+            ACTIVE_UPLOADS.discard(local_path)
 
-async def upload_worker(bot, target_chat_id, mongo, worker_id):
+async def upload_worker(pool, target_chat_id, mongo, worker_id):
     logger.info(f"👷 Worker #{worker_id} Pronto")
     
     while True:
-        try: task = await asyncio.wait_for(UPLOAD_QUEUE.get(), timeout=2.0)
-        except asyncio.TimeoutError: continue
-            
+        task = await UPLOAD_QUEUE.get()
         local_path = task["path"]; filename = task["filename"]; parent = task["parent"]
+        # ack: remove o job | requeued/retry: job continua na fila | failed: registra a falha
+        outcome = "ack"
         
         # --- LOCK: Bloqueia o arquivo para o GC não apagar ---
         ACTIVE_UPLOADS.add(local_path)
@@ -224,73 +691,62 @@ async def upload_worker(bot, target_chat_id, mongo, worker_id):
 
             logger.info(f"⬆️ [W{worker_id}] Processando: {filename} ({real_size/1024/1024:.2f} MB)")
             
-            file_doc = await mongo.files.find_one({"name": filename, "parent": parent})
+            # Pelo local_path primeiro: o arquivo pode ter sido renomeado desde o enfileiramento
+            file_doc = await mongo.files.find_one({"local_path": local_path}) or await mongo.files.find_one({"name": filename, "parent": parent})
             if not file_doc:
                 logger.warning(f"⚠️ [W{worker_id}] Metadados não encontrados: {filename}")
                 continue
 
-            file_uuid = str(uuid.uuid4())
-            parts_metadata = []
-            upload_failed = False
-            
+            # Conteúdo já enviado antes (mesmo sha256): reaproveita as partes, sem upload
+            if file_doc.get("sha256"):
+                blob = await BlobIndex(mongo).acquire(file_doc["sha256"], real_size)
+                if blob:
+                    await complete_upload(mongo, file_doc, real_size, blob["parts"], blob.get("obfuscated_id"), local_path, blob=blob["_id"], deduped=True)
+                    logger.info(f"🧬 [W{worker_id}] Deduplicado: {filename} (refs {blob['refs']})")
+                    continue
+
+            # Retoma do checkpoint (mesmo file_uuid e nomes de chunk) ou inicia um novo
+            part_count = (real_size + CHUNK_SIZE - 1) // CHUNK_SIZE
+            resumed = resumable_parts(file_doc, real_size)
+            if resumed:
+                file_uuid, previous = resumed
+                logger.info(f"♻️ [W{worker_id}] Retomando {filename}: {len(previous)}/{part_count} partes já enviadas")
+            else:
+                file_uuid, previous = str(uuid.uuid4()), []
+                await mongo.files.update_one({"_id": file_doc["_id"]}, {"$set": {"upload_uuid": file_uuid, "upload_size": real_size, "upload_parts": []}})
+
+            fd = os.open(local_path, os.O_RDONLY)
+            batch = PartBatch(pool, target_chat_id, fd, file_uuid, f"W{worker_id}", previous, mongo, {"_id": file_doc["_id"]})
             try:
-                async with aiofiles.open(local_path, "rb") as f:
-                    part_num = 0
-                    while True:
-                        chunk_data = await f.read(CHUNK_SIZE)
-                        if not chunk_data: break
-                        
-                        chunk_name = f"{file_uuid}.part_{part_num:03d}"
-                        mem_file = io.BytesIO(chunk_data); mem_file.name = chunk_name 
-                        sent_msg = None
-                        
-                        for attempt in range(1, MAX_RETRIES + 1):
-                            try:
-                                mem_file.seek(0)
-                                sent_msg = await bot.send_document(
-                                    chat_id=target_chat_id,
-                                    document=mem_file,
-                                    file_name=chunk_name,
-                                    force_document=True,
-                                    caption=""
-                                )
-                                break 
-                            except FloodWait as e:
-                                w = e.value + 2; logger.warning(f"⏳ [W{worker_id}] FloodWait: {w}s")
-                                await asyncio.sleep(w)
-                            except RPCError as e:
-                                w = (2 ** attempt); logger.error(f"❌ [W{worker_id}] Erro TG ({attempt}): {e}")
-                                await asyncio.sleep(w)
-                            except Exception as e:
-                                logger.error(f"❌ [W{worker_id}] Erro: {e}"); await asyncio.sleep(5)
-                        
-                        if not sent_msg: raise Exception(f"Falha upload parte {part_num}")
-
-                        parts_metadata.append({
-                            "part_id": part_num, "tg_file": sent_msg.document.file_id,
-                            "tg_message": sent_msg.id, "file_size": len(chunk_data),
-                            "chunk_name": chunk_name
-                        })
-                        part_num += 1; await asyncio.sleep(0.2)
-
-            except Exception as e:
-                logger.error(f"❌ [W{worker_id}] Abortado: {filename}: {e}"); upload_failed = True; Metrics.log_fail()
-
-            if not upload_failed:
-                await mongo.files.update_one(
-                    {"_id": file_doc["_id"]},
-                    {"$set": {"size": real_size, "uploaded_at": int(time.time()), "parts": parts_metadata, "obfuscated_id": file_uuid, "status": "completed"}, "$unset": {"uploadId": 1, "local_path": 1}}
-                )
+                async with UPLOAD_QUEUE.keep_alive(task):
+                    for part_num, offset in enumerate(range(0, real_size, CHUNK_SIZE)):
+                        batch.submit(part_num, offset, min(CHUNK_SIZE, real_size - offset))
+                    await batch.wait()
+            finally:
+                batch.cancel(); os.close(fd)
+
+            parts_metadata = batch.ordered(part_count)
+            if parts_metadata is None:
+                attempt = task.get("attempt", 1)
+                failed = sorted(i for i in range(part_count) if i not in batch.parts)
+                logger.error(f"❌ [W{worker_id}] Abortado: {filename}: partes {failed} falharam (tentativa {attempt})")
+                Metrics.log_fail()
+                # O job continua em lease com este worker: retry() o devolve à fila (put() não o alcançaria)
+                outcome = "requeued" if await UPLOAD_QUEUE.retry(task, MAX_FILE_ATTEMPTS, size=real_size) else "failed"
+            else:
+                await complete_upload(mongo, file_doc, real_size, parts_metadata, file_uuid, local_path)
                 logger.info(f"✅ [W{worker_id}] Concluído: {filename}")
-                Metrics.log_success(real_size)
-                # Agora sim o GC ou nós mesmos podemos remover
-                try: os.remove(local_path)
-                except: pass
             
-        except Exception as e: logger.error(f"❌ [W{worker_id}] Crítico: {e}")
+        except Exception as e:
+            # O job fica com o lease e volta a ficar visível após o visibility timeout
+            logger.error(f"❌ [W{worker_id}] Crítico: {e}"); outcome = "retry"
         finally:
             # --- UNLOCK: Libera o arquivo ---
             ACTIVE_UPLOADS.discard(local_path)
+            try:
+                if outcome == "ack": await UPLOAD_QUEUE.ack(task)
+                elif outcome == "failed": await UPLOAD_QUEUE.fail(task, "partes falharam após todas as tentativas")
+            except Exception as e: logger.error(f"❌ [W{worker_id}] Erro ao finalizar job: {e}")
             UPLOAD_QUEUE.task_done()
 
 async def resolve_channel(bot):
@@ -303,7 +759,7 @@ async def resolve_channel(bot):
     except: pass
     
     try:
-        chat = await bot.get_chat(target_chat)
+        chat = await patiently(lambda: bot.get_chat(target_chat))
         logger.info(f"✅ Canal Confirmado: {chat.title} (ID: {chat.id})")
         try: await bot.send_message(chat.id, "🔄 Nebula FTP MonoBot Conectado", disable_notification=True)
         except: pass
@@ -314,36 +770,62 @@ async def resolve_channel(bot):
 async def main():
     api_id = int(environ.get("API_ID"))
     api_hash = environ.get("API_HASH")
-    token_str = environ.get("BOT_TOKENS") or environ.get("BOT_TOKEN")
-    token = token_str.split(",")[0].strip()
+    token_str = environ.get("BOT_TOKENS") or environ.get("BOT_TOKEN") or ""
+    tokens = [t.strip() for t in token_str.split(",") if t.strip()]
 
-    if not token: logger.critical("❌ Sem token!"); return
+    if not tokens: logger.critical("❌ Sem token!"); return
 
-    bot = Client("Nebula_MonoBot", api_id=api_id, api_hash=api_hash, bot_token=token)
-    logger.info("🤖 Iniciando Bot...")
-    try: await bot.start()
-    except Exception as e: logger.critical(f"❌ Falha ao iniciar bot: {e}"); return
+    # O primeiro token mantém a sessão "Nebula_MonoBot"; FloodWait não dorme no cliente (sleep_threshold=0),
+    # o pool afasta o bot e segue com os demais
+    pool = BotPool([
+        Client("Nebula_MonoBot" if i == 0 else f"Nebula_Bot{i + 1}", api_id=api_id, api_hash=api_hash, bot_token=token, sleep_threshold=0)
+        for i, token in enumerate(tokens)
+    ])
+    logger.info(f"🤖 Iniciando {len(tokens)} bot(s)...")
+    if not await pool.start(): logger.critical("❌ Nenhum bot iniciou"); return
+    bot = pool.primary
 
     target_chat_id = await resolve_channel(bot)
-    if not target_chat_id: await bot.stop(); return
+    if not target_chat_id or not await pool.check_chat(target_chat_id): await pool.stop(); return
+    Metrics.pool = pool
 
     loop = asyncio.get_event_loop()
     try:
-        mongo = AsyncIOMotorClient(environ.get("MONGODB"), io_loop=loop, w="majority").ftp
+        if METADATA_BACKEND == "sqlite":
+            mongo = SQLiteDatabase(SQLITE_PATH)
+            logger.info(f"🗃️ Metadados em SQLite: {SQLITE_PATH}")
+        else: mongo = AsyncIOMotorClient(environ.get("MONGODB"), io_loop=loop, w="majority").ftp
         await setup_database_indexes(mongo)
+        await UPLOAD_QUEUE.bind(mongo)
+        await UPLOAD_QUEUE.recover(mongo.files)
+        await MongoDBPathIO.staging.load()
     except Exception as e: logger.critical(f"❌ Erro DB: {e}"); return
     
-    MongoDBPathIO.db = mongo; MongoDBPathIO.tg = bot 
-    server = Server(MongoDBUserManager(mongo), MongoDBPathIO, passive_ports=FTP_PASV_PORTS, masquerade_address=FTP_MASQUERADE_ADDRESS)
+    # Com tracing ativo as chamadas do FTP ao Mongo viram spans do comando
+    ftp_db = TracedDatabase(mongo) if TRACER.enabled else mongo
+    MongoDBPathIO.db = ftp_db; MongoDBPathIO.tg = bot; MongoDBPathIO.bots = pool; MongoDBPathIO.chat_id = target_chat_id
+    if STREAM_UPLOAD:
+        StreamingUpload.pool = pool; StreamingUpload.target_chat_id = target_chat_id; StreamingUpload.mongo = mongo
+        MongoDBPathIO.stream_uploader = StreamingUpload
+        logger.info(f"🚰 Upload em pipeline ativo (partes de {CHUNK_SIZE_MB} MB)")
+    server = Server(MongoDBUserManager(ftp_db), MongoDBPathIO, passive_ports=FTP_PASV_PORTS, masquerade_address=FTP_MASQUERADE_ADDRESS)
+    Metrics.export(server)
+    if METRICS_PORT:
+        try: await serve_metrics(METRICS_HOST, METRICS_PORT, routes={"/trace": TRACER.http} if TRACER.enabled else None)
+        except OSError as e: logger.warning(f"⚠️ Endpoint de métricas indisponível: {e}")
+    if TRACER.enabled:
+        logger.info(f"🔬 Tracing ativo (amostra {TRACER.sample:.0%}, lentos > {TRACER.slow_ms:.0f} ms)")
+        if TRACE_FILE: asyncio.create_task(TRACER.dump_forever(TRACE_FILE, TRACE_DUMP_INTERVAL))
     
-    asyncio.create_task(garbage_collector())
+    asyncio.create_task(migrate_paths(mongo))
+    asyncio.create_task(garbage_collector(mongo))
     asyncio.create_task(stats_reporter())
     asyncio.create_task(folder_watcher(mongo))
     
-    for i in range(MAX_WORKERS): asyncio.create_task(upload_worker(bot, target_chat_id, mongo, i+1))
+    for i in range(MAX_WORKERS): asyncio.create_task(upload_worker(pool, target_chat_id, mongo, i+1))
     
     port = int(environ.get("PORT", 2121))
-    logger.info(f"🚀 Nebula FTP (MonoBot) Rodando na porta {port}")
+    logger.info(f"🚀 Nebula FTP ({len(pool)} bot(s)) Rodando na porta {port}")
     
     ftp_server_task = asyncio.create_task(server.run(environ.get("HOST", "0.0.0.0"), port))
     
@@ -358,7 +840,9 @@ async def main():
         try:
             if not UPLOAD_QUEUE.empty(): await asyncio.wait_for(UPLOAD_QUEUE.join(), timeout=30)
         except: pass
-        await server.close(); await bot.stop(); logger.info("👋 Desligado.")
+        await server.close(); await pool.stop()
+        if isinstance(mongo, SQLiteDatabase): await mongo.close()
+        logger.info("👋 Desligado.")
 
 if __name__ == "__main__":
     try: asyncio.run(main())
@@ -0,0 +1,73 @@
+import asyncio
+
+from ftp.jobs import UploadQueue
+from ftp.sqlitestore import SQLiteDatabase
+
+MAX_FILE_ATTEMPTS = 3
+
+
+def _queue(tmp_path, **kwargs):
+    return SQLiteDatabase(str(tmp_path / "nebula.db"), commit_ms=0), UploadQueue(poll_interval=0.01, candidate_ttl=0, retry_backoff=0, **kwargs)
+
+
+def test_retry_reaches_fail(tmp_path):
+    async def run():
+        db, queue = _queue(tmp_path)
+        await queue.bind(db)
+        await queue.put({"path": "/staging/a", "filename": "a", "parent": "/alice", "size": 10})
+        claims = 0
+        while True:
+            task = await asyncio.wait_for(queue.get(), 1)
+            claims += 1
+            # O job está em lease com este worker: o retry precisa alcançá-lo
+            if not await queue.retry(task, MAX_FILE_ATTEMPTS, size=20):
+                await queue.fail(task, "partes falharam"); queue.task_done(); break
+            queue.task_done()
+            job = await db.upload_jobs.find_one({"path": "/staging/a"})
+            assert job["state"] == "queued" and job["attempt"] == claims + 1 and job["size"] == 20 and "lease" not in job
+        assert claims == MAX_FILE_ATTEMPTS
+        job = await db.upload_jobs.find_one({"path": "/staging/a"})
+        assert job["state"] == "failed" and job["attempt"] == MAX_FILE_ATTEMPTS
+        await db.close()
+    asyncio.run(run())
+
+
+def test_retry_backoff_and_put_on_leased(tmp_path):
+    async def run():
+        db, queue = _queue(tmp_path)
+        queue.retry_backoff = 60
+        await queue.bind(db)
+        await queue.put({"path": "/staging/a", "filename": "a", "parent": "/alice", "size": 10})
+        task = await queue.get()
+        # put() de fora não mexe no job em lease
+        await queue.put(dict(task, attempt=5))
+        job = await db.upload_jobs.find_one({"path": "/staging/a"})
+        assert job["state"] == "leased" and job["lease"] == task["lease"] and "attempt" not in job
+        assert await queue.retry(task, MAX_FILE_ATTEMPTS)
+        job = await db.upload_jobs.find_one({"path": "/staging/a"})
+        assert job["state"] == "queued" and job["visible_at"] >= job["queued_at"] + 60
+        # Ainda no backoff: nenhum claim
+        assert await queue._claim() is None
+        await db.close()
+    asyncio.run(run())
+
+
+def test_recover_skips_known_paths(tmp_path):
+    async def run():
+        db, queue = _queue(tmp_path)
+        await queue.bind(db)
+        paths = []
+        for name in ("a", "b", "c.partial", "gone"):
+            path = tmp_path / name
+            if name != "gone": path.write_bytes(b"x")
+            paths.append(str(path))
+            await db.files.insert_one({"name": name, "parent": "/alice", "size": 1, "status": "staging", "local_path": str(path)})
+        await queue.put({"path": paths[0], "filename": "a", "parent": "/alice", "size": 1})
+        task = await queue.get()
+        assert await queue.recover(db.files) == 1
+        jobs = {job["path"]: job async for job in db.upload_jobs.find({})}
+        assert set(jobs) == {paths[0], paths[1]}
+        # O job em lease deste processo continua intacto
+        assert jobs[paths[0]]["lease"] == task["lease"]
+        await db.close()
+    asyncio.run(run())
@@ -0,0 +1,65 @@
+import re
+
+from ftp.query import MISSING, match, apply_update, upsert_doc, aggregate, get_field
+from ftp.sqlitestore import _regex_prefix
+
+
+def test_regex_prefix_literal():
+    assert _regex_prefix("^/a/b/") == "/a/b/"
+    assert _regex_prefix("^" + re.escape("/pasta com espaço/a-b.txt")) == "/pasta com espaço/a-b.txt"
+
+
+def test_regex_prefix_stops_at_meta():
+    assert _regex_prefix("^/a/b.*") == "/a/b"
+    assert _regex_prefix("^/a/[0-9]") == "/a/"
+    assert _regex_prefix("^/a/\\d+") == "/a/"
+
+
+def test_regex_prefix_optional_char():
+    # "b?" e "b*" podem não aparecer: o b fica fora do prefixo
+    assert _regex_prefix("^/ab?") == "/a"
+    assert _regex_prefix("^/ab*") == "/a"
+    assert _regex_prefix("^/ab{2}") == "/a"
+    # "b+" exige pelo menos um b
+    assert _regex_prefix("^/ab+c") == "/ab"
+
+
+def test_regex_prefix_none():
+    assert _regex_prefix("/a/b/") == ""          # sem âncora
+    assert _regex_prefix("^/a|^/b") == ""        # alternativa
+    assert _regex_prefix("^/a/", "i") == ""      # case-insensitive
+    assert _regex_prefix(re.compile("^/a/")) == ""
+
+
+def test_match_arrays_and_missing():
+    doc = {"tags": ["a", "b"], "n": 3, "sub": {"x": 1}}
+    assert match(doc, {"tags": "a"})
+    assert match(doc, {"tags": ["a", "b"]})
+    assert match(doc, {"tags": {"$in": ["z", "b"]}})
+    assert not match(doc, {"tags": {"$nin": ["b"]}})
+    assert match(doc, {"sub.x": {"$gte": 1}, "n": {"$lt": 4}})
+    assert match(doc, {"missing": None})
+    assert match(doc, {"missing": {"$exists": False}})
+    assert match(doc, {"state": {"$ne": "leased"}})
+    assert match(doc, {"$or": [{"n": 1}, {"tags": {"$regex": "^b"}}]})
+    assert get_field(doc, "sub.y") is MISSING
+
+
+def test_set_on_insert_only_when_inserting():
+    update = {"$set": {"state": "queued"}, "$setOnInsert": {"created_at": 1}}
+    doc = {"path": "/a", "created_at": 0}
+    apply_update(doc, update)
+    assert doc == {"path": "/a", "created_at": 0, "state": "queued"}
+    # Igualdades do filtro entram no documento; operadores (exceto $eq) não
+    new = upsert_doc({"path": "/a", "state": {"$ne": "leased"}, "size": {"$eq": 5}}, update)
+    assert new == {"path": "/a", "size": 5, "state": "queued", "created_at": 1}
+
+
+def test_aggregate_group_sort_limit():
+    docs = [{"owner": "a", "t": 3}, {"owner": "b", "t": 1}, {"owner": "a", "t": 2}, {"owner": "c", "t": 5}]
+    out = aggregate(docs, [
+        {"$sort": {"t": 1}},
+        {"$group": {"_id": "$owner", "first": {"$first": "$t"}, "n": {"$sum": 1}}},
+        {"$sort": {"first": -1}}, {"$limit": 2},
+    ])
+    assert out == [{"_id": "c", "first": 5, "n": 1}, {"_id": "a", "first": 2, "n": 2}]
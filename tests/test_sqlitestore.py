@@ -0,0 +1,173 @@
+import asyncio
+import sqlite3
+
+import pytest
+from pymongo import InsertOne, UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+
+from ftp.sqlitestore import SQLiteStore, SQLiteDatabase
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = SQLiteStore(str(tmp_path / "nebula.db"))
+    yield s
+    s.close()
+
+
+def test_regex_prefix_becomes_range(store):
+    files = store.files
+    files.create_index("path")
+    for p in ("/a", "/a/x", "/a/y/z", "/a0", "/b/x"):
+        files.insert_one({"path": p})
+    params = []
+    assert files._where({"path": {"$regex": "^/a/"}}, params) == '"k.path" >= ? AND "k.path" < ?'
+    assert params == ["/a/", "/a0"]
+    assert sorted(d["path"] for d in files.find({"path": {"$regex": "^/a/"}})) == ["/a/x", "/a/y/z"]
+    # Sem prefixo fixo o regex é avaliado só em memória
+    assert files._where({"path": {"$regex": "x$"}}, []) == "1"
+    assert sorted(d["path"] for d in files.find({"path": {"$regex": "x$"}})) == ["/a/x", "/b/x"]
+
+
+def test_multikey_fallback(tmp_path):
+    path = str(tmp_path / "nebula.db")
+    store = SQLiteStore(path)
+    files = store.files
+    files.create_index("tags")
+    files.insert_one({"_id": 1, "tags": "x"})
+    assert files._where({"tags": "x"}, []) != "1"
+    files.insert_one({"_id": 2, "tags": ["x", "y"]})
+    # O campo recebeu array: sai do WHERE e nenhum resultado se perde
+    assert files._where({"tags": "x"}, []) == "1"
+    assert sorted(d["_id"] for d in files.find({"tags": "x"})) == [1, 2]
+    assert [d["_id"] for d in files.find({"tags": {"$in": ["y"]}})] == [2]
+    store.close()
+    # A marcação sobrevive à reabertura do arquivo
+    store = SQLiteStore(path)
+    assert "tags" in store.files.multikey
+    assert sorted(d["_id"] for d in store.files.find({"tags": "x"})) == [1, 2]
+    store.close()
+
+
+def test_duplicate_key(store):
+    files = store.files
+    files.create_index("path", unique=True)
+    files.insert_one({"path": "/a"})
+    with pytest.raises(DuplicateKeyError) as e:
+        files.insert_one({"path": "/a"})
+    assert e.value.code == 11000
+    with pytest.raises(DuplicateKeyError):
+        files.update_one({"path": "/missing"}, {"$set": {"path": "/a"}}, upsert=True)
+    _id = files.insert_one({"path": "/b"}).inserted_id
+    with pytest.raises(DuplicateKeyError):
+        files.insert_one({"_id": _id, "path": "/c"})
+    assert files.count_documents({}) == 2
+
+
+def test_insert_many_errors(store):
+    files = store.files
+    files.create_index("path", unique=True)
+    files.insert_one({"path": "/b"})
+    with pytest.raises(BulkWriteError) as e:
+        files.insert_many([{"path": "/a"}, {"path": "/b"}, {"path": "/c"}])
+    details = e.value.details
+    assert details["nInserted"] == 1
+    assert [(w["index"], w["code"]) for w in details["writeErrors"]] == [(1, 11000)]
+    assert files.find_one({"path": "/c"}) is None
+    # Sem ordem: o erro não interrompe o resto do lote
+    with pytest.raises(BulkWriteError) as e:
+        files.insert_many([{"path": "/b"}, {"path": "/c"}, {"path": "/d"}], ordered=False)
+    assert e.value.details["nInserted"] == 2
+    assert [w["index"] for w in e.value.details["writeErrors"]] == [0]
+    assert files.count_documents({}) == 4
+
+
+def test_bulk_write_errors(store):
+    jobs = store.jobs
+    jobs.create_index("path", unique=True)
+    jobs.insert_one({"path": "/leased", "state": "leased"})
+    ops = [
+        UpdateOne({"path": "/new", "state": {"$ne": "leased"}}, {"$set": {"size": 1}, "$setOnInsert": {"state": "queued"}}, upsert=True),
+        # Job arrendado: o filtro não casa e o upsert bate no índice único
+        UpdateOne({"path": "/leased", "state": {"$ne": "leased"}}, {"$set": {"size": 2}, "$setOnInsert": {"state": "queued"}}, upsert=True),
+        InsertOne({"path": "/other"}),
+    ]
+    with pytest.raises(BulkWriteError) as e:
+        jobs.bulk_write(ops, ordered=False)
+    details = e.value.details
+    assert [(w["index"], w["code"]) for w in details["writeErrors"]] == [(1, 11000)]
+    assert details["nUpserted"] == 1 and details["nInserted"] == 1
+    assert [u["index"] for u in details["upserted"]] == [0]
+    assert jobs.find_one({"path": "/leased"}, {"_id": 0}) == {"path": "/leased", "state": "leased"}
+    assert jobs.find_one({"path": "/new"}, {"_id": 0}) == {"path": "/new", "size": 1, "state": "queued"}
+    result = jobs.bulk_write([UpdateOne({"path": "/new"}, {"$set": {"size": 3}})])
+    assert result.matched_count == 1 and result.modified_count == 1
+
+
+def test_upsert_set_on_insert(store):
+    jobs = store.jobs
+    update = {"$set": {"state": "queued"}, "$setOnInsert": {"created_at": 1, "attempts": 0}}
+    result = jobs.update_one({"path": "/a", "state": {"$ne": "leased"}}, update, upsert=True)
+    assert result.upserted_id is not None and result.matched_count == 0
+    assert jobs.find_one({"path": "/a"}, {"_id": 0}) == {"path": "/a", "state": "queued", "created_at": 1, "attempts": 0}
+    jobs.update_one({"path": "/a"}, {"$set": {"state": "done"}, "$setOnInsert": {"created_at": 2}}, upsert=True)
+    assert jobs.find_one({"path": "/a"}, {"_id": 0}) == {"path": "/a", "state": "done", "created_at": 1, "attempts": 0}
+    doc = jobs.find_one_and_update({"path": "/b"}, {"$setOnInsert": {"created_at": 3}}, upsert=True, return_document=ReturnDocument.AFTER)
+    assert doc["path"] == "/b" and doc["created_at"] == 3
+    assert jobs.find_one_and_update({"path": "/c"}, {"$set": {"x": 1}}, upsert=True) is None
+    assert jobs.count_documents({}) == 3
+
+
+class _FailingCommit:
+    """Conexão que falha no COMMIT (disco cheio, I/O) e delega o resto."""
+
+    def __init__(self, conn): self.conn = conn
+
+    def execute(self, sql, *args):
+        if sql == "COMMIT": raise sqlite3.OperationalError("disk I/O error")
+        return self.conn.execute(sql, *args)
+
+    def __getattr__(self, name): return getattr(self.conn, name)
+
+
+def test_group_commit_rollback(tmp_path):
+    async def run():
+        db = SQLiteDatabase(str(tmp_path / "nebula.db"), commit_ms=50)
+        await db.files.create_index("path", unique=True)
+        await db.files.insert_one({"path": "/kept"})
+        conn = db._store.conn; before = db.commits
+        db._store.conn = _FailingCommit(conn)
+        results = await asyncio.gather(
+            db.files.insert_one({"path": "/a"}),
+            db.files.update_one({"path": "/kept"}, {"$set": {"size": 1}}),
+            db.files.insert_one({"path": "/kept"}),
+            return_exceptions=True,
+        )
+        commits = db.commits
+        db._store.conn = conn
+        # Todas as escritas do lote recebem o erro do COMMIT e nada fica gravado
+        assert all(isinstance(r, sqlite3.OperationalError) for r in results), results
+        assert commits == before + 1 and not conn.in_transaction
+        assert await db.files.find_one({"path": "/a"}) is None
+        assert await db.files.find_one({"path": "/kept"}, {"_id": 0}) == {"path": "/kept"}
+        # O banco continua utilizável depois do ROLLBACK
+        await db.files.insert_one({"path": "/b"})
+        assert await db.files.count_documents({}) == 2
+        await db.close()
+    asyncio.run(run())
+
+
+def test_group_commit_batches(tmp_path):
+    async def run():
+        db = SQLiteDatabase(str(tmp_path / "nebula.db"), commit_ms=50)
+        await asyncio.gather(*(db.files.insert_one({"n": i}) for i in range(20)))
+        assert db.stats()["commits"] == 1 and db.stats()["writes"] == 20
+        # Erro da própria escrita (não do COMMIT) só chega a quem a fez
+        await db.files.create_index("n", unique=True)
+        results = await asyncio.gather(db.files.insert_one({"n": 0}), db.files.insert_one({"n": 20}), return_exceptions=True)
+        assert isinstance(results[0], DuplicateKeyError) and not isinstance(results[1], Exception)
+        await db.close()
+        db = SQLiteDatabase(str(tmp_path / "nebula.db"))
+        assert await db.files.count_documents({}) == 21
+        await db.close()
+    asyncio.run(run())